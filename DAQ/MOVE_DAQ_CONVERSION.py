@@ -1,9 +1,8 @@
-import libximc.highlevel as ximc
 import pexpect
 import time
 import os
 import subprocess
-from logger import logger
+from logger import logger, set_context
 
 
 # BASE_PATH = "/home/arcadia/Documents/Motors_automation_test/DAQtest"            # base path where the data will be copied
@@ -67,6 +66,8 @@ def run_script_with_conditional_password(script_name):
 
 # Motor setup and control
 from motortools import Motor
+from dqm import DQMMonitor, DEFAULT_THRESHOLDS
+from runcatalog import RunCatalog
 # Main code execution
 m = Motor()
 m.initialize_devices()
@@ -85,57 +86,136 @@ move_X = float(input(f"Enter step length (X) in microns: "))
 nZ = int(input("Please enter the number of steps in Z direction: "))
 move_Z = float(input(f"Enter step length (Z) in microns: "))
 
+# laser power is a scan dimension: the X/Z grid is repeated for every power,
+# empty input keeps the current setting and leaves power untagged
+powers_input = input("Enter laser powers in % separated by commas (empty = no power sweep): ")
+POWERS = [float(p) for p in powers_input.replace(",", " ").split()] or [None]
+
 # wait_time = int(input("Please enter the WAIT_TIME in miliseconds: "))
 wait_time = 0
 
+# multi-sequence runs: acquisition.py converts while acquiring, 0 = one sequence per run
+TARGET_EVENTS = 0
+TARGET_REL_ERROR = 0.
+
+# coarse scans: only scope-side measurement statistics go to the run catalog,
+# no waveforms are saved, converted or preprocessed
+MEASURE_ONLY = False
+
+# 8-bit instead of 16-bit samples: half the scope transfer and raw storage,
+# see bench_byteformat.py for the amplitude resolution it costs
+BYTE_FORMAT = False
+
+# scope channels that are neither copied nor converted (e.g. [7, 8] when unused)
+DONT_CONVERT = []
+
+# online data-quality monitor
+DQM_ENABLED = True
+DQM_HTTP_PORT = 0          # e.g. 8000 to serve the summary page, 0 = file only
+DQM_ACTION = "flag"        # "repeat" retakes flagged points up to DQM_MAX_REPEATS times
+DQM_MAX_REPEATS = 1
+if DQM_ENABLED:
+    dqm = DQMMonitor(thresholds=DEFAULT_THRESHOLDS._replace(action=DQM_ACTION))
+    if DQM_HTTP_PORT: dqm.serve(DQM_HTTP_PORT)
+
+
+catalog = RunCatalog()
+
+steps_remaining = nX * nZ * len(POWERS)
+
+for ipower, power in enumerate(POWERS):
+    if power is not None:
+        input(f"Set the laser power to {power}% and press Enter to start the X/Z scan.")
+        logger.info(f"Laser power set to {power}%")
+
+    for iz in range(nZ):
+        for ix in range(nX):
+            # cached positions, only the axes moved since the last point are read back
+            position_calb_x, position_calb_y, position_calb_z = m.get_calb()
+            print(f"\n\nSteps remaining: {steps_remaining}.")
+            print(f"Doing run number {GetLatestNumber()}. Coordinates for this run are below:")
+            print("Current position X:", position_calb_x.Position, "um")
+            print("Current position Y:", position_calb_y.Position, "um")
+            print("Current position Z:", position_calb_z.Position, "um\n")
+            for attempt in range(DQM_MAX_REPEATS + 1):
+                latest_run_number = str(GetLatestNumber())
+                set_context(run=latest_run_number, stage="scan",
+                            coordinates=(position_calb_x.Position, position_calb_y.Position, position_calb_z.Position))
+                logger.info(f"Run number: {latest_run_number}, coordinates below")
+                m.log_state()       # cached, no controller I/O
+                catalog.record_run(int(latest_run_number), x=position_calb_x.Position,
+                                   y=position_calb_y.Position, z=position_calb_z.Position,
+                                   power=power)
+
+                # # running the scripts and sending the password lines if the terminal requires them
+                acquisition_cmd = "acquisition.py"
+                if MEASURE_ONLY:
+                    acquisition_cmd += " --measureOnly 1"
+                elif TARGET_EVENTS:
+                    acquisition_cmd += f" --targetEvents {TARGET_EVENTS} --targetRelError {TARGET_REL_ERROR}"
+                if BYTE_FORMAT:
+                    acquisition_cmd += " --byteFormat 1"
+                if DONT_CONVERT:
+                    acquisition_cmd += " --skipChannels " + ",".join(str(c) for c in DONT_CONVERT)
+                try: run_script_with_conditional_password(acquisition_cmd)
+                except Exception as e:
+                    print(f"Error occurred while running the script: {e}")
+                    logger.info(f"Error occurred while running the script: {e}", extra={"stage": "acquisition"})
+                if MEASURE_ONLY:
+                    break
+
+                if not TARGET_EVENTS:
+                    conversion_cmd = "conversion.py"
+                    if DONT_CONVERT:
+                        conversion_cmd += " --skipChannels " + ",".join(str(c) for c in DONT_CONVERT)
+                    try: run_script_with_conditional_password(conversion_cmd)
+                    except Exception as e:
+                        print(f"Error occurred while running the script: {e}")
+                        logger.info(f"Error occurred while running the script: {e}", extra={"stage": "conversion"})
+
+                flags = []
+                if DQM_ENABLED:
+                    try:
+                        flags = dqm.process_run(int(latest_run_number),
+                                                coordinates=(position_calb_x.Position, position_calb_z.Position))
+                    except Exception as e:
+                        print(f"DQM failed for run {latest_run_number}: {e}")
+                        logger.info(f"DQM failed for run {latest_run_number}: {e}", extra={"stage": "dqm"})
+                    if flags:
+                        print(f"DQM flags for run {latest_run_number}: {'; '.join(flags)}")
+                        logger.info(f"DQM flags for run {latest_run_number}: {'; '.join(flags)}", extra={"stage": "dqm"})
+
+                try:
+                    subprocess.run(['bash', sh_script_path, latest_run_number], check=True)
+                    print("Script executed successfully")
+                    logger.info("Script executed successfully", extra={"stage": "preprocessing"})
+                except subprocess.CalledProcessError as e:
+                    print(f"Error occurred while running the script: {e}")
+                    logger.info(f"Error occurred while running the script: {e}", extra={"stage": "preprocessing"})
+
+                if not (DQM_ENABLED and dqm.should_repeat(flags)):
+                    break
+                print(f"Repeating point (attempt {attempt + 2} of {DQM_MAX_REPEATS + 1}).")
+
+            m.move_XYZ_R(dX=move_X)        
+            steps_remaining -= 1
+
+        m.move_XYZ_R(dZ=move_Z)
+        m.move_XYZ_R(dX=-nX*move_X)
 
-steps_remaining = nX * nZ
-
-for iz in range(nZ):
-    for ix in range(nX):
         position_calb_x, position_calb_y, position_calb_z = m.get_calb()
-        print(f"\n\nSteps remaining: {steps_remaining}.")
-        print(f"Doing run number {GetLatestNumber()}. Coordinates for this run are below:")
-        print("Current position X:", position_calb_x.Position, "um")
-        print("Current position Y:", position_calb_y.Position, "um")
-        print("Current position Z:", position_calb_z.Position, "um\n")
-        m.axis_x.command_wait_for_stop(1000)
-        latest_run_number = str(GetLatestNumber())
-        logger.info(f"Run number: {latest_run_number}, coordinates below")
-        m.log_state()
-
-        # # running the scripts and sending the password lines if the terminal requires them
-        try: run_script_with_conditional_password("acquisition.py")
-        except:
-            print(f"Error occurred while running the script: {e}")
-            logger.info(f"Error occurred while running the script: {e}")
-
-        try: run_script_with_conditional_password("conversion.py")
-        except: 
-            print(f"Error occurred while running the script: {e}")
-            logger.info(f"Error occurred while running the script: {e}")
-
-        try:
-            subprocess.run(['bash', sh_script_path, latest_run_number], check=True)
-            print("Script executed successfully")
-            logger.info("Script executed successfully")
-        except subprocess.CalledProcessError as e:
-            print(f"Error occurred while running the script: {e}")
-            logger.info(f"Error occurred while running the script: {e}")
-
-        m.move_XYZ_R(dX=move_X)        
-        steps_remaining -= 1
-
-    m.move_XYZ_R(dZ=move_Z)
-    m.move_XYZ_R(dX=-nX*move_X)
+        print("Final position X:", position_calb_x.Position, "um")
+        print("Final position Y:", position_calb_y.Position, "um")
+        print("Final position Z:", position_calb_z.Position, "um")
 
-    position_calb_x, position_calb_y, position_calb_z = m.get_calb()
-    print("Final position X:", position_calb_x.Position, "um")
-    print("Final position Y:", position_calb_y.Position, "um")
-    print("Final position Z:", position_calb_z.Position, "um")
+    # back to the starting Z for the next power, the scan ends where it stops
+    if ipower < len(POWERS) - 1:
+        m.move_XYZ_R(dZ=-nZ*move_Z)
 
 
 m.close_devices()
+if DQM_ENABLED: dqm.close()
+catalog.close()
 
 
 # command run arguments to unmount the drive
@@ -1,30 +1,42 @@
-import numpy as np
 import sys
-import optparse
 import argparse
-import signal
 import os
 import time
 import shutil
 import datetime
-from shutil import copy
-import pyvisa as visa
-import glob
 import subprocess
+from scopesession import ScopeSession, scpi, vbs
+## pyvisa and the multi-sequence helpers are imported when a run starts, so
+## --help and argument errors never touch the scope
 
 
 """#################SEARCH/CONNECT#################"""
-# establish communication with scope
 LECROY_IP = "192.168.0.170"
-initial = time.time()
-rm = visa.ResourceManager("@py")
-lecroy = rm.open_resource(f"TCPIP0::{LECROY_IP}::inst0::INSTR")
-lecroy.timeout = 3000000
-lecroy.encoding = 'latin_1'
-lecroy.clear()
+
+def connect():
+    # establish communication with scope
+    import pyvisa as visa
+    rm = visa.ResourceManager("@py")
+    lecroy = rm.open_resource(f"TCPIP0::{LECROY_IP}::inst0::INSTR")
+    lecroy.timeout = 3000000
+    lecroy.encoding = 'latin_1'
+    lecroy.clear()
+    return rm, lecroy
+
 # BASE_PATH = "/home/daq/2025_08_SNSPD/ScopeHandler/"
 BASE_PATH = "/home/arcadia/Documents/Motors_automation_test/DAQtest"
 run_log_path = BASE_PATH + "/RunLog.txt"
+scope_state_path = BASE_PATH + "/scope_state.json"
+MOUNT_POINT = "/mnt"
+# WAVEFORMS_PATH = os.path.join(MOUNT_POINT, "Waveforms")
+WAVEFORMS_PATH = MOUNT_POINT
+mount_cmd = [
+    "sudo", "mount", "-t", "cifs",
+    f"//{LECROY_IP}/Waveforms",
+    MOUNT_POINT,
+    "-o", "username=lcrydmin"
+]
+umount_cmd = ["sudo", "umount", MOUNT_POINT]
 
 
 def GetNextNumber():
@@ -41,329 +53,445 @@ nchan=8
 
 NSegments = 100 # change number of segments to 1000
 
-parser = argparse.ArgumentParser(description='Run info.')
-
-parser.add_argument('--numEvents',metavar='Events', type=str,default = NSegments, help='numEvents (default 500)',required=False)
-parser.add_argument('--runNumber',metavar='runNumber', type=str,default = -1, help='runNumber (default -1)',required=False)
-parser.add_argument('--sampleRate',metavar='sampleRate', type=str,default = 10, help='Sampling rate (default 20)',required=False)
-parser.add_argument('--horizontalWindow',metavar='horizontalWindow', type=str,default = 50, help='horizontal Window (default 125)',required=False)
-# parser.add_argument('--numPoints',metavar='Points', type=str,default = 500, help='numPoints (default 500)',required=True)
-parser.add_argument('--trigCh',metavar='trigCh', type=str, default='C1',help='trigger Channel (EX, or CN',required=False)
-parser.add_argument('--trig',metavar='trig', type=float, default= 0.150, help='trigger value in V',required=False)
-parser.add_argument('--trigSlope',metavar='trigSlope', type=str, default= 'NEGative', help='trigger slope; positive(rise) or negative(fall)',required=False)
-
-parser.add_argument('--vScale1',metavar='vScale1', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale2',metavar='vScale2', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale3',metavar='vScale3', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale4',metavar='vScale4', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale5',metavar='vScale5', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale6',metavar='vScale6', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale7',metavar='vScale7', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-parser.add_argument('--vScale8',metavar='vScale8', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
-
-parser.add_argument('--vPos1',metavar='vPos1', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos2',metavar='vPos2', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos3',metavar='vPos3', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos4',metavar='vPos4', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos5',metavar='vPos5', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos6',metavar='vPos6', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos7',metavar='vPos7', type=float, default= 3, help='Vertical Pos, div',required=False)
-parser.add_argument('--vPos8',metavar='vPos8', type=float, default= 3, help='Vertical Pos, div',required=False)
-
-parser.add_argument('--display',metavar='display', type=int, default= 0, help='enable display',required=False)
-
-
-parser.add_argument('--timeoffset',metavar='timeoffset', type=float, default=0, help='Offset to compensate for trigger delay. This is the delta T between the center of the acquisition window and the trigger. (default for NimPlusX: -160 ns)',required=False)
-parser.add_argument('--holdoff',metavar='holdoff', type=float, default=0, help='trigger hold off time in units of ns, default is 0',required=False)
-parser.add_argument('--auxOutPulseWidth',metavar='args.auxOutPulseWidth', type=float, default=0, help='Aux Output Pulse Width',required=False)
-
-# parser.add_argument('--save',metavar='save', type=int, default= 1, help='Save waveforms',required=False)
-# parser.add_argument('--timeout',metavar='timeout', type=float, default= -1, help='Max run duration [s]',required=False)
-
-args = parser.parse_args()
-trigCh = str(args.trigCh)
-
-print("trigchannel is : " + trigCh)
-runNumber = int(args.runNumber) 
-if trigCh != "AUX": trigCh = 'CHANnel'+trigCh
-trigLevel = float(args.trig)
-triggerSlope = args.trigSlope
-timeoffset = float(args.timeoffset)*1e-9
-# print "timeoffset is ",timeoffset
-date = datetime.datetime.now()
-# savewaves = int(args.save)
-# timeout = float(args.timeout)
-# print savewaves
-# print "timeout is ",timeout
-
-if runNumber==-1:
-	runNumber=GetNextNumber()
-#### Initial preparation
-print ("Next run number: %i"%runNumber)
-
-print ("\n \nPreparing 8-channel scope. \n")
-lecroy.write('STOP')
-lecroy.write("*CLS")
-lecroy.write("COMM_HEADER OFF")
-# if args.display == 0: lecroy.write("DISPLAY OFF")
-# else: lecroy.write("DISPLAY ON")
-
-####### Vertical setup ######
-
-vScales_in_mV = []
-vScales_in_mV.append(int(1000* args.vScale1))
-vScales_in_mV.append(int(1000* args.vScale2))
-vScales_in_mV.append(int(1000* args.vScale3))
-vScales_in_mV.append(int(1000* args.vScale4))
-vScales_in_mV.append(int(1000* args.vScale5))
-vScales_in_mV.append(int(1000* args.vScale6))
-vScales_in_mV.append(int(1000* args.vScale7))
-vScales_in_mV.append(int(1000* args.vScale8))
-
-vOffsets_in_mV = []
-vOffsets_in_mV.append(int(1000* args.vScale1 * args.vPos1))
-vOffsets_in_mV.append(int(1000* args.vScale2 * args.vPos2))
-vOffsets_in_mV.append(int(1000* args.vScale3 * args.vPos3))
-vOffsets_in_mV.append(int(1000* args.vScale4 * args.vPos4))
-vOffsets_in_mV.append(int(1000* args.vScale5 * args.vPos5))
-vOffsets_in_mV.append(int(1000* args.vScale6 * args.vPos6))
-vOffsets_in_mV.append(int(1000* args.vScale7 * args.vPos7))
-vOffsets_in_mV.append(int(1000* args.vScale8 * args.vPos8))
-print ("Vertical setup.")
-
-# for chan in range(1,nchan+1):
-# 	print ("\tChannel %i: %i mV/div, %i mV offset. "% (chan, vScales_in_mV[chan-1],vOffsets_in_mV[chan-1]))
-# 	lecroy.write("C%i:TRA ON"%(chan))
-# 	lecroy.write("C%i:COUPLING D50"%(chan))
-# 	lecroy.write("C%i:VOLT_DIV %iMV"%(chan, vScales_in_mV[chan-1]))
-# 	lecroy.write("C%i:OFFSET %iMV"%(chan, vOffsets_in_mV[chan-1]))
-
-### Disable bandwidth limit
-lecroy.write("BANDWIDTH_LIMIT OFF")
-
-
-####### Horizontal setup ########
-
-time_div_in_ns = int(args.horizontalWindow)/10 ## specify full window as argument
-print ("\nTimebase: %i ns/div." % time_div_in_ns)
-if time_div_in_ns != 2 and time_div_in_ns != 5 and time_div_in_ns!=500000 and time_div_in_ns!=1000000:
-	print ("Warning: time base must fit predefined set of possible values.")
-sample_rate_in_GS = args.sampleRate
-
-# lecroy.write("TIME_DIV %iNS"%time_div_in_ns)
-# print ("\tMake sure sampling rate is set to 10 GS/s manually.")
-# lecroy.write("TIME_DIV e-9")
-
-# print ("Setting horizontal offset 50 %i ns" %args.timeoffset)
-# lecroy.write("TRIG_DELAY %i ns"%args.timeoffset)
-
-
-####### Trigger setup #####
-# if args.holdoff > 0: lecroy.write("TRIG_SELECT Edge,SR,%s,HT,TI,HV,%0.3f NS"% (args.trigCh, args.holdoff))
-# else:lecroy.write("TRIG_SELECT Edge,SR,%s, HT, OFF" % args.trigCh) 
-# print("\nTrigger holdoff time is %0.3f ns" % args.holdoff)
-# if args.trigCh != "LINE":
-# 	lecroy.write("%s:TRLV %0.3fV"%(args.trigCh,args.trig))
-# 	lecroy.write("TRIG_SLOPE %s" %args.trigSlope)
-
-# print ("Triggering on %s with %0.3fV threshold, %s polarity." % (args.trigCh,args.trig,args.trigSlope))
-
-####### Trigger Aux Out Setup ######
-if args.auxOutPulseWidth > 0:
-	lecroy.write(r"""vbs 'app.Acquisition.AuxOutput.AuxMode = "TriggerOut"' """)
-	lecroy.write(r"""vbs 'app.Acquisition.AuxOutput.TrigOutPulseWidth = "%d ns"' """ % args.auxOutPulseWidth)
-	print("Trigger Aux Output Pulse Width: %d ns" % args.auxOutPulseWidth)
-else:
-	lecroy.write(r"""vbs 'app.Acquisition.AuxOutput.AuxMode = "Off"' """)
-	print("No Trigger Aux Output Set")
-
-
-#lecroy.write("TRIG_SELECT Edge,SR,LINE")
-#lecroy.write("TRIG_SELECT Edge,SR,EX")
-# lecroy.write("EX:TRSL POS")
-# lecroy.write("EX:TRLV 0.15V")
-# lecroy.write("EX:TRSL POS")
-
-lecroy.write("STORE_SETUP ALL_DISPLAYED,HDD,AUTO,OFF,FORMAT,BINARY")
-# lecroy.write("STORE_SETUP C1,HDD,AUTO,OFF,FORMAT,BINARY")
-
-nevents = int(args.numEvents)
-##Sequence configuration
-print ("\nTaking %i events in sequence mode."%nevents)
-lecroy.write("SEQ ON,%i"%nevents)
-status = ""
-status = "busy"
-
-run_logf = open(run_log_path,"w")
-run_logf.write(status)
-#run_logf.write("\n")
-run_logf.close()
-start = time.time()
-now = datetime.datetime.now()
-current_time = now.strftime("%H:%M:%S")
-print ("\n \n \n  -------------  Starting acquisition for run %i at %s. ---------------" %(runNumber,current_time))
-lecroy.write("*TRG")
-#prewait = time.time()
-#lecroy.query(r"""vbs? 'app.waituntilidle(7)' """)
-#time.sleep(7)
-#postwait=time.time()
-#print "wait until idle took %i seconds."%(postwait-prewait)
-
-
-#lecroy.write("ARM")
-lecroy.write("WAIT")
-#ime.sleep(10)
-#print "Finished waiting, attempting stop."
-#lecroy.write("STOP;*OPC?")
-#lecroy.write("STOP")
-#time.sleep(10)
-# lecroy.write("WAIT")
-
-
-
-lecroy.query("ALST?")
-
-end = time.time()
-duration = end-start
-print ("\n \n \n  -------------  Acquisition complete.   ------------------------")
-print ("\tAcquisition duration: %0.4f s" % duration)
-print ("\tTrigger rate: %0.1f Hz" % (nevents/duration))
-
-# print("Storage configuration:")
-# print(lecroy.query("STORE_SETUP?"))
-print("\n\n  -------------  Beginning save waveforms.  ----------------------")
-tmp_file = open(run_log_path,"w")
-status = "writing"
-tmp_file.write(status)
-tmp_file.write("\n")
-tmp_file.close()
-
-
-start = time.time()
-### save all active channels with single command, using ALL_DISPLAYED ###
-lecroy.write(r"""vbs 'app.SaveRecall.Waveform.TraceTitle="Trace%i" ' """%(runNumber))
-lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
-#lecroy.write("STORE")
-#for ichan in range(1,9):
-#	lecroy.write("STORE_SETUP C%i,HDD,AUTO,OFF,FORMAT,BINARY"%ichan)
-	#lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFilename="C%i--Trace%i.trc" ' """%(ichan,int(runNumber)))
-	#lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
-
-# for ichan in range(1,9):
-#        print "Saving channel %i"%ichan
-#        lecroy.write("STORE_SETUP C%i,HDD,AUTO,OFF,FORMAT,BINARY"%ichan)
-#        lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFilename="C%i--Trace%i.trc" ' """%(ichan,int(runNumber)))
-#        lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
-#        lecroy.query("ALST?")
-
-lecroy.query("ALST?")
-end = time.time()
-
-
-print("Waveform storage complete. \n\tStoring waveforms took %0.4f s" % (end - start))
-#time.sleep(0.5)
-
-## renaming files with automatic numbering scheme.. no lnoger needed.
-#list_of_files = glob.glob('/home/daq/LecroyMount/*.trc') 
-#latest_file = max(list_of_files, key=os.path.getctime)
-
-#autoRunNum = latest_file.split("Trace")[1].split(".trc")[0]
-#print "Lecroy run number: %s. Renaming to run %s."%(autoRunNum,runNumber)
-#for chan in range(1,nchan+1):
-#	os.rename("/home/daq/LecroyMount/C%iTrace%s.trc" % (chan,autoRunNum), "/home/daq/LecroyMount/C%iTrace%s.trc" % (chan,runNumber))
-
-#lecroy.write("WAIT")
-
-# for x in xrange(1,10):
-# 	time.sleep(0.5)
-# 	lecroy.write("OPC?")
-
-lecroy.close()
-rm.close()
-final = time.time()
-print ("\nFinished run %i." % runNumber)
-print ("Full script duration: %0.f s" %(final-initial))
-tmp_file2 = open(run_log_path,"w")
-status = "ready"
-tmp_file2.write(status)
-tmp_file2.write("\n")
-
-tmp_file2.close()
-
-
-# os.makedirs("/Waveforms/Trace{runNumber}", exist_ok = False) 
-# import subprocess
-# proc = subprocess.Popen('cmd.exe', stdin = subprocess.PIPE, stdout = subprocess.PIPE)
-
-# com1 = f"sudo mount -t cifs //{LECROY_IP}/Waveforms /mnt -o username=lcrydmin"
-# com2 = f"cp -r /mnt/Trace{runNumber} {BASE_PATH}"
-
-# stdout, stderr = proc.communicate(com1)
-# stdout, stderr = proc.communicate(com2)
-
-# mount_cmd = [
-#     "sudo", "mount", "-t", "cifs",
-#     f"//{LECROY_IP}/Waveforms",
-#     "/mnt",
-#     "-o", "username=lcrydmin"
-# ]
-
-# print(f"Running: {' '.join(mount_cmd)}")
-# mount_proc = subprocess.run(mount_cmd, capture_output=True, text=True)
-
-# if mount_proc.returncode != 0:
-#     print("Mount failed:")
-#     print(mount_proc.stderr)
-# else:
-#     print("Mount successful.")
-#     # copy_cmd = ["cp", "-r", f"/mnt/Trace{runNumber}", BASE_PATH]
-#     copy_cmd = ["cp", "-r", f"/mnt/Trace23", BASE_PATH]
-
-#     print(f"Running: {' '.join(copy_cmd)}")
-#     copy_proc = subprocess.run(copy_cmd, capture_output=True, text=True)
-
-#     if copy_proc.returncode != 0:
-#         print("Copy failed:")
-#         print(copy_proc.stderr)
-#     else:
-#         print("Copy successful.")
-
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run info.')
+
+    parser.add_argument('--numEvents',metavar='Events', type=str,default = NSegments, help='numEvents (default 500)',required=False)
+    parser.add_argument('--runNumber',metavar='runNumber', type=str,default = -1, help='runNumber (default -1)',required=False)
+    parser.add_argument('--sampleRate',metavar='sampleRate', type=str,default = 10, help='Sampling rate (default 20)',required=False)
+    parser.add_argument('--horizontalWindow',metavar='horizontalWindow', type=str,default = 50, help='horizontal Window (default 125)',required=False)
+    # parser.add_argument('--numPoints',metavar='Points', type=str,default = 500, help='numPoints (default 500)',required=True)
+    parser.add_argument('--trigCh',metavar='trigCh', type=str, default='C1',help='trigger Channel (EX, or CN',required=False)
+    parser.add_argument('--trig',metavar='trig', type=float, default= 0.150, help='trigger value in V',required=False)
+    parser.add_argument('--trigSlope',metavar='trigSlope', type=str, default= 'NEGative', help='trigger slope; positive(rise) or negative(fall)',required=False)
+
+    parser.add_argument('--vScale1',metavar='vScale1', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale2',metavar='vScale2', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale3',metavar='vScale3', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale4',metavar='vScale4', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale5',metavar='vScale5', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale6',metavar='vScale6', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale7',metavar='vScale7', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+    parser.add_argument('--vScale8',metavar='vScale8', type=float, default= 0.05, help='Vertical scale, volts/div',required=False)
+
+    parser.add_argument('--vPos1',metavar='vPos1', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos2',metavar='vPos2', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos3',metavar='vPos3', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos4',metavar='vPos4', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos5',metavar='vPos5', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos6',metavar='vPos6', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos7',metavar='vPos7', type=float, default= 3, help='Vertical Pos, div',required=False)
+    parser.add_argument('--vPos8',metavar='vPos8', type=float, default= 3, help='Vertical Pos, div',required=False)
+
+    parser.add_argument('--display',metavar='display', type=int, default= 0, help='enable display',required=False)
+
+
+    parser.add_argument('--timeoffset',metavar='timeoffset', type=float, default=0, help='Offset to compensate for trigger delay. This is the delta T between the center of the acquisition window and the trigger. (default for NimPlusX: -160 ns)',required=False)
+    parser.add_argument('--holdoff',metavar='holdoff', type=float, default=0, help='trigger hold off time in units of ns, default is 0',required=False)
+    parser.add_argument('--auxOutPulseWidth',metavar='args.auxOutPulseWidth', type=float, default=0, help='Aux Output Pulse Width',required=False)
+    parser.add_argument('--targetEvents',metavar='targetEvents', type=int, default=0, help='split the run into several sequences up to this many events (default 0: one sequence of numEvents)',required=False)
+    parser.add_argument('--maxSegments',metavar='maxSegments', type=int, default=5000, help='largest sequence that fits in scope memory',required=False)
+    parser.add_argument('--maxSequenceSeconds',metavar='maxSequenceSeconds', type=float, default=10, help='target acquisition time of one sequence in s',required=False)
+    parser.add_argument('--statChannel',metavar='statChannel', type=int, default=5, help='channel index used for the early-stop criterion',required=False)
+    parser.add_argument('--targetRelError',metavar='targetRelError', type=float, default=0, help='stop once the relative error on the mean hit amplitude is below this (0: off)',required=False)
+    parser.add_argument('--forceSetup',metavar='forceSetup', type=int, default=0, help='resend the full scope setup instead of only the changes',required=False)
+    parser.add_argument('--measureOnly',metavar='measureOnly', type=int, default=0, help='only read scope-side measurement statistics into the run catalog, no waveforms are saved',required=False)
+    parser.add_argument('--measureChannels',metavar='measureChannels', type=str, default='2,4,6', help='scope channels measured in measureOnly mode',required=False)
+    parser.add_argument('--skipChannels',metavar='skipChannels', type=str, default='', help='comma separated scope channels that are neither copied nor converted',required=False)
+    parser.add_argument('--byteFormat',metavar='byteFormat', type=int, default=0, help='save 8-bit (byte) instead of 16-bit (word) samples, halves the trace files',required=False)
+    parser.add_argument('--measureParams',metavar='measureParams', type=str, default='Amplitude,Area,Maximum', help='scope parameters measured in measureOnly mode',required=False)
+    parser.add_argument('--runStatus',metavar='runStatus', type=str, default='measured', help='run catalog status of a measureOnly run (e.g. focus)',required=False)
+
+    # parser.add_argument('--save',metavar='save', type=int, default= 1, help='Save waveforms',required=False)
+    # parser.add_argument('--timeout',metavar='timeout', type=float, default= -1, help='Max run duration [s]',required=False)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    initial = time.time()
+    rm, lecroy = connect()
+    trigCh = str(args.trigCh)
+
+    print("trigchannel is : " + trigCh)
+    runNumber = int(args.runNumber) 
+    if trigCh != "AUX": trigCh = 'CHANnel'+trigCh
+    trigLevel = float(args.trig)
+    triggerSlope = args.trigSlope
+    timeoffset = float(args.timeoffset)*1e-9
+    # print "timeoffset is ",timeoffset
+    date = datetime.datetime.now()
+    # savewaves = int(args.save)
+    # timeout = float(args.timeout)
+    # print savewaves
+    # print "timeout is ",timeout
+
+    if runNumber==-1:
+        runNumber=GetNextNumber()
+    #### Initial preparation
+    print ("Next run number: %i"%runNumber)
+
+    print ("\n \nPreparing 8-channel scope. \n")
+    ## settings are collected here and sent through the session cache below,
+    ## STOP and *CLS are only sent when something has to change
+    scope_settings = [scpi("comm_header", "COMM_HEADER OFF", "COMM_HEADER?", "OFF")]
+    # if args.display == 0: lecroy.write("DISPLAY OFF")
+    # else: lecroy.write("DISPLAY ON")
+
+    ####### Vertical setup ######
+
+    vScales_in_mV = []
+    vScales_in_mV.append(int(1000* args.vScale1))
+    vScales_in_mV.append(int(1000* args.vScale2))
+    vScales_in_mV.append(int(1000* args.vScale3))
+    vScales_in_mV.append(int(1000* args.vScale4))
+    vScales_in_mV.append(int(1000* args.vScale5))
+    vScales_in_mV.append(int(1000* args.vScale6))
+    vScales_in_mV.append(int(1000* args.vScale7))
+    vScales_in_mV.append(int(1000* args.vScale8))
+
+    vOffsets_in_mV = []
+    vOffsets_in_mV.append(int(1000* args.vScale1 * args.vPos1))
+    vOffsets_in_mV.append(int(1000* args.vScale2 * args.vPos2))
+    vOffsets_in_mV.append(int(1000* args.vScale3 * args.vPos3))
+    vOffsets_in_mV.append(int(1000* args.vScale4 * args.vPos4))
+    vOffsets_in_mV.append(int(1000* args.vScale5 * args.vPos5))
+    vOffsets_in_mV.append(int(1000* args.vScale6 * args.vPos6))
+    vOffsets_in_mV.append(int(1000* args.vScale7 * args.vPos7))
+    vOffsets_in_mV.append(int(1000* args.vScale8 * args.vPos8))
+    print ("Vertical setup.")
+
+    # for chan in range(1,nchan+1):
+    #   print ("\tChannel %i: %i mV/div, %i mV offset. "% (chan, vScales_in_mV[chan-1],vOffsets_in_mV[chan-1]))
+    #   lecroy.write("C%i:TRA ON"%(chan))
+    #   lecroy.write("C%i:COUPLING D50"%(chan))
+    #   lecroy.write("C%i:VOLT_DIV %iMV"%(chan, vScales_in_mV[chan-1]))
+    #   lecroy.write("C%i:OFFSET %iMV"%(chan, vOffsets_in_mV[chan-1]))
+
+    ### Disable bandwidth limit
+    scope_settings.append(scpi("bandwidth_limit", "BANDWIDTH_LIMIT OFF", "BANDWIDTH_LIMIT?", "OFF", match="all"))
+
+
+    ####### Horizontal setup ########
+
+    time_div_in_ns = int(args.horizontalWindow)/10 ## specify full window as argument
+    print ("\nTimebase: %i ns/div." % time_div_in_ns)
+    if time_div_in_ns != 2 and time_div_in_ns != 5 and time_div_in_ns!=500000 and time_div_in_ns!=1000000:
+        print ("Warning: time base must fit predefined set of possible values.")
+    sample_rate_in_GS = args.sampleRate
+
+    # lecroy.write("TIME_DIV %iNS"%time_div_in_ns)
+    # print ("\tMake sure sampling rate is set to 10 GS/s manually.")
+    # lecroy.write("TIME_DIV e-9")
+
+    # print ("Setting horizontal offset 50 %i ns" %args.timeoffset)
+    # lecroy.write("TRIG_DELAY %i ns"%args.timeoffset)
+
+
+    ####### Trigger setup #####
+    # if args.holdoff > 0: lecroy.write("TRIG_SELECT Edge,SR,%s,HT,TI,HV,%0.3f NS"% (args.trigCh, args.holdoff))
+    # else:lecroy.write("TRIG_SELECT Edge,SR,%s, HT, OFF" % args.trigCh) 
+    # print("\nTrigger holdoff time is %0.3f ns" % args.holdoff)
+    # if args.trigCh != "LINE":
+    #   lecroy.write("%s:TRLV %0.3fV"%(args.trigCh,args.trig))
+    #   lecroy.write("TRIG_SLOPE %s" %args.trigSlope)
+
+    # print ("Triggering on %s with %0.3fV threshold, %s polarity." % (args.trigCh,args.trig,args.trigSlope))
+
+    ####### Trigger Aux Out Setup ######
+    if args.auxOutPulseWidth > 0:
+        scope_settings.append(vbs("aux_mode", 'app.Acquisition.AuxOutput.AuxMode = "TriggerOut"', "app.Acquisition.AuxOutput.AuxMode", "TriggerOut"))
+        scope_settings.append(vbs("aux_pulse_width", 'app.Acquisition.AuxOutput.TrigOutPulseWidth = "%d ns"' % args.auxOutPulseWidth, "app.Acquisition.AuxOutput.TrigOutPulseWidth", 1e-9*int(args.auxOutPulseWidth), match="number"))
+        print("Trigger Aux Output Pulse Width: %d ns" % args.auxOutPulseWidth)
+    else:
+        scope_settings.append(vbs("aux_mode", 'app.Acquisition.AuxOutput.AuxMode = "Off"', "app.Acquisition.AuxOutput.AuxMode", "Off"))
+        print("No Trigger Aux Output Set")
+
+
+    #lecroy.write("TRIG_SELECT Edge,SR,LINE")
+    #lecroy.write("TRIG_SELECT Edge,SR,EX")
+    # lecroy.write("EX:TRSL POS")
+    # lecroy.write("EX:TRLV 0.15V")
+    # lecroy.write("EX:TRSL POS")
+
+    scope_settings.append(scpi("store_setup", "STORE_SETUP ALL_DISPLAYED,HDD,AUTO,OFF,FORMAT,BINARY",
+                               "STORE_SETUP?", "ALL_DISPLAYED,HDD,AUTO,OFF,FORMAT,BINARY"))
+    ## 8-bit samples: half the transfer and storage, the descriptor gain follows
+    ## the format so conversion.py decodes both (COMM_TYPE)
+    subformat = "Byte" if args.byteFormat else "Word"
+    scope_settings.append(vbs("waveform_subformat", 'app.SaveRecall.Waveform.BinarySubFormat = "%s"' % subformat, "app.SaveRecall.Waveform.BinarySubFormat", subformat))
+    # lecroy.write("STORE_SETUP C1,HDD,AUTO,OFF,FORMAT,BINARY")
+
+    nevents = int(args.numEvents)
+    ##Sequence configuration
+    print ("\nTaking %i events in sequence mode."%nevents)
+    scope_settings.append(scpi("sequence", "SEQ ON,%i"%nevents, "SEQ?", "ON,%i"%nevents))
+
+    if args.measureOnly:
+        import scopemeasure
+        measurements = scopemeasure.plan([int(c) for c in args.measureChannels.split(",")],
+                                         args.measureParams.split(","))
+        scope_settings += scopemeasure.settings(measurements)
+
+    session = ScopeSession(lecroy, scope_state_path)
+    session.apply(scope_settings, force=bool(args.forceSetup))
+    print(session.describe_last_setup())
+
+    if args.measureOnly:
+        #### measurement run: statistics computed by the scope, nothing is saved or copied
+        from runcatalog import RunCatalog
+        run_logf = open(run_log_path,"w")
+        run_logf.write("busy")
+        run_logf.close()
+        scopemeasure.clear(lecroy)
+        start = time.time()
+        lecroy.write("*TRG")
+        lecroy.write("WAIT")
+        lecroy.query("ALST?")
+        duration = time.time()-start
+        start = time.time()
+        rows = scopemeasure.read_statistics(lecroy, measurements)
+        print("Run %i: %i events in %0.2f s, statistics read in %0.1f ms" % (runNumber, nevents, duration, 1000*(time.time()-start)))
+        print(scopemeasure.describe(rows))
+        session.remember("trigger_rate", nevents/duration)
+        with RunCatalog() as catalog:
+            catalog.record_run(runNumber, status=args.runStatus)
+            catalog.record_measurements(runNumber, rows)
+        lecroy.close()
+        rm.close()
+        run_logf = open(run_log_path,"w")
+        run_logf.write("ready\n")
+        run_logf.close()
+        return 0
+
+    if args.targetEvents > 0:
+        #### multi-sequence run: acquire sequence k+1 while k is copied and converted
+        from sequencing import SequencePlanner, SequenceWorker
+        planner = SequencePlanner(args.targetEvents, session.state.get("trigger_rate"),
+                      max_segments=args.maxSegments, max_seconds=args.maxSequenceSeconds,
+                      target_rel_error=args.targetRelError)
+        worker = SequenceWorker(runNumber, WAVEFORMS_PATH, BASE_PATH + "/RawData_from_oscilloscope",
+                    BASE_PATH + "/Converted_runs_root", args.statChannel, 0.1,
+                    skip_channels=args.skipChannels)
+        mount_proc = subprocess.run(mount_cmd, capture_output=True, text=True)
+        if mount_proc.returncode != 0:
+            print("Mount failed:")
+            print(mount_proc.stderr)
+            return 1
+        run_logf = open(run_log_path,"w")
+        run_logf.write("busy")
+        run_logf.close()
+        start_run = time.time()
+        sequence = 0
+        current_size = nevents
+        while not planner.target_reached():
+            n_seq = planner.next_size()
+            if n_seq != current_size:
+                session.apply([scpi("sequence", "SEQ ON,%i"%n_seq, "SEQ?", "ON,%i"%n_seq)])
+                current_size = n_seq
+            wait_s = planner.wait_seconds(n_seq)
+            lecroy.timeout = 1000*(wait_s + 30)
+            start = time.time()
+            lecroy.write("*TRG")
+            lecroy.write("WAIT %i" % wait_s)
+            lecroy.query("ALST?")
+            rate = planner.update_rate(n_seq, time.time()-start)
+            print("Sequence %i: %i events, trigger rate %0.1f Hz" % (sequence, n_seq, rate))
+            lecroy.write(r"""vbs 'app.SaveRecall.Waveform.TraceTitle="Trace%i_%i" ' """%(runNumber, sequence))
+            lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
+            lecroy.query("ALST?")
+            previous = worker.submit(sequence, planner.collected - n_seq)
+            if previous: planner.add_amplitudes(*previous)
+            sequence += 1
+            if worker.failed:
+                print("Stopping run %i: sequence %i was not converted." % (runNumber, worker.failed[0][0]))
+                break
+        last = worker.wait()
+        if last: planner.add_amplitudes(*last)
+        merged = worker.merge()
+        subprocess.run(umount_cmd)
+        session.remember("trigger_rate", planner.rate)
+        print("\nRun %i: %i events in %i sequences, %0.1f s. Relative error on mean amplitude (CH%i): %0.4f" % (
+            runNumber, planner.collected, sequence, time.time()-start_run, args.statChannel+1, planner.relative_error()))
+        print("Merged output: %s" % merged)
+        for failed_sequence, error in worker.failed:
+            print("Sequence %i failed: %s" % (failed_sequence, error))
+        lecroy.close()
+        rm.close()
+        run_logf = open(run_log_path,"w")
+        run_logf.write("ready\n")
+        run_logf.close()
+        return 1 if worker.failed else 0
+
+    status = ""
+    status = "busy"
+
+    run_logf = open(run_log_path,"w")
+    run_logf.write(status)
+    #run_logf.write("\n")
+    run_logf.close()
+    start = time.time()
+    now = datetime.datetime.now()
+    current_time = now.strftime("%H:%M:%S")
+    print ("\n \n \n  -------------  Starting acquisition for run %i at %s. ---------------" %(runNumber,current_time))
+    lecroy.write("*TRG")
+    #prewait = time.time()
+    #lecroy.query(r"""vbs? 'app.waituntilidle(7)' """)
+    #time.sleep(7)
+    #postwait=time.time()
+    #print "wait until idle took %i seconds."%(postwait-prewait)
+
+
+    #lecroy.write("ARM")
+    lecroy.write("WAIT")
+    #ime.sleep(10)
+    #print "Finished waiting, attempting stop."
+    #lecroy.write("STOP;*OPC?")
+    #lecroy.write("STOP")
+    #time.sleep(10)
+    # lecroy.write("WAIT")
+
+
+
+    lecroy.query("ALST?")
+
+    end = time.time()
+    duration = end-start
+    print ("\n \n \n  -------------  Acquisition complete.   ------------------------")
+    print ("\tAcquisition duration: %0.4f s" % duration)
+    print ("\tTrigger rate: %0.1f Hz" % (nevents/duration))
+    session.remember("trigger_rate", nevents/duration)
+
+    # print("Storage configuration:")
+    # print(lecroy.query("STORE_SETUP?"))
+    print("\n\n  -------------  Beginning save waveforms.  ----------------------")
+    tmp_file = open(run_log_path,"w")
+    status = "writing"
+    tmp_file.write(status)
+    tmp_file.write("\n")
+    tmp_file.close()
+
+
+    start = time.time()
+    ### save all active channels with single command, using ALL_DISPLAYED ###
+    lecroy.write(r"""vbs 'app.SaveRecall.Waveform.TraceTitle="Trace%i" ' """%(runNumber))
+    lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
+    #lecroy.write("STORE")
+    #for ichan in range(1,9):
+    #   lecroy.write("STORE_SETUP C%i,HDD,AUTO,OFF,FORMAT,BINARY"%ichan)
+        #lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFilename="C%i--Trace%i.trc" ' """%(ichan,int(runNumber)))
+        #lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
+
+    # for ichan in range(1,9):
+    #        print "Saving channel %i"%ichan
+    #        lecroy.write("STORE_SETUP C%i,HDD,AUTO,OFF,FORMAT,BINARY"%ichan)
+    #        lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFilename="C%i--Trace%i.trc" ' """%(ichan,int(runNumber)))
+    #        lecroy.write(r"""vbs 'app.SaveRecall.Waveform.SaveFile' """)
+    #        lecroy.query("ALST?")
+
+    lecroy.query("ALST?")
+    end = time.time()
+
+
+    print("Waveform storage complete. \n\tStoring waveforms took %0.4f s" % (end - start))
+    #time.sleep(0.5)
+
+    ## renaming files with automatic numbering scheme.. no lnoger needed.
+    #list_of_files = glob.glob('/home/daq/LecroyMount/*.trc') 
+    #latest_file = max(list_of_files, key=os.path.getctime)
+
+    #autoRunNum = latest_file.split("Trace")[1].split(".trc")[0]
+    #print "Lecroy run number: %s. Renaming to run %s."%(autoRunNum,runNumber)
+    #for chan in range(1,nchan+1):
+    #   os.rename("/home/daq/LecroyMount/C%iTrace%s.trc" % (chan,autoRunNum), "/home/daq/LecroyMount/C%iTrace%s.trc" % (chan,runNumber))
+
+    #lecroy.write("WAIT")
+
+    # for x in xrange(1,10):
+    #   time.sleep(0.5)
+    #   lecroy.write("OPC?")
+
+    lecroy.close()
+    rm.close()
+    final = time.time()
+    print ("\nFinished run %i." % runNumber)
+    print ("Full script duration: %0.f s" %(final-initial))
+    tmp_file2 = open(run_log_path,"w")
+    status = "ready"
+    tmp_file2.write(status)
+    tmp_file2.write("\n")
+
+    tmp_file2.close()
+
+
+    # os.makedirs("/Waveforms/Trace{runNumber}", exist_ok = False) 
+    # import subprocess
+    # proc = subprocess.Popen('cmd.exe', stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+
+    # com1 = f"sudo mount -t cifs //{LECROY_IP}/Waveforms /mnt -o username=lcrydmin"
+    # com2 = f"cp -r /mnt/Trace{runNumber} {BASE_PATH}"
+
+    # stdout, stderr = proc.communicate(com1)
+    # stdout, stderr = proc.communicate(com2)
+
+    # mount_cmd = [
+    #     "sudo", "mount", "-t", "cifs",
+    #     f"//{LECROY_IP}/Waveforms",
+    #     "/mnt",
+    #     "-o", "username=lcrydmin"
+    # ]
 
+    # print(f"Running: {' '.join(mount_cmd)}")
+    # mount_proc = subprocess.run(mount_cmd, capture_output=True, text=True)
+
+    # if mount_proc.returncode != 0:
+    #     print("Mount failed:")
+    #     print(mount_proc.stderr)
+    # else:
+    #     print("Mount successful.")
+    #     # copy_cmd = ["cp", "-r", f"/mnt/Trace{runNumber}", BASE_PATH]
+    #     copy_cmd = ["cp", "-r", f"/mnt/Trace23", BASE_PATH]
 
-MOUNT_POINT = "/mnt"
-# WAVEFORMS_PATH = os.path.join(MOUNT_POINT, "Waveforms")
-WAVEFORMS_PATH = MOUNT_POINT
-mount_cmd = [
-    "sudo", "mount", "-t", "cifs",
-    f"//{LECROY_IP}/Waveforms",
-    MOUNT_POINT,
-    "-o", "username=lcrydmin"
-]
-
-print(f"Running: {' '.join(mount_cmd)}")
-mount_proc = subprocess.run(mount_cmd, capture_output=True, text=True)
+    #     print(f"Running: {' '.join(copy_cmd)}")
+    #     copy_proc = subprocess.run(copy_cmd, capture_output=True, text=True)
+
+    #     if copy_proc.returncode != 0:
+    #         print("Copy failed:")
+    #         print(copy_proc.stderr)
+    #     else:
+    #         print("Copy successful.")
+
+
+    print(f"Running: {' '.join(mount_cmd)}")
+    mount_proc = subprocess.run(mount_cmd, capture_output=True, text=True)
+
+
+    if mount_proc.returncode != 0:
+        print("Mount failed:")
+        print(mount_proc.stderr)
+    else:
+        print("Mount successful.")
 
+        ## every saved channel C1..C7 except the ones marked as not converted
+        import conversion
+        matching_files = list(conversion.find_channels(WAVEFORMS_PATH, f"Trace{runNumber}",
+                                                       conversion.parse_channels(args.skipChannels)).values())
 
-if mount_proc.returncode != 0:
-    print("Mount failed:")
-    print(mount_proc.stderr)
-else:
-    print("Mount successful.")
+        if not matching_files:
+            print(f"No files matching '*Trace{runNumber}.trc' found in {WAVEFORMS_PATH}")
+        else:
+            print(f"Found {len(matching_files)} files. Copying them...")
 
-    pattern = os.path.join(WAVEFORMS_PATH, f"C[1-7]--Trace{runNumber}.trc")
-    matching_files = glob.glob(pattern)
+            for filepath in matching_files:
+                try:
+                    shutil.copy(filepath, BASE_PATH + "/RawData_from_oscilloscope")
+                    print(f"Copied {os.path.basename(filepath)}")
+                except Exception as e:
+                    print(f"Failed to copy {filepath}: {e}")
 
-    if not matching_files:
-        print(f"No files matching '*Trace{runNumber}.trc' found in {WAVEFORMS_PATH}")
-    else:
-        print(f"Found {len(matching_files)} files. Copying them...")
+        subprocess.run(umount_cmd)
+    return 0
 
-        for filepath in matching_files:
-            try:
-                shutil.copy(filepath, BASE_PATH + "/RawData_from_oscilloscope")
-                print(f"Copied {os.path.basename(filepath)}")
-            except Exception as e:
-                print(f"Failed to copy {filepath}: {e}")
 
-    umount_cmd = ["sudo", "umount", MOUNT_POINT]
-    subprocess.run(umount_cmd)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# bench_byteformat.py
+# What byte-format traces (acquisition.py --byteFormat 1) cost and gain
+# against the usual word format.
+#
+# Word samples are turned into the bytes the scope would save (the high byte,
+# with a 256x larger vertical gain), then both are compared for
+#   - raw, trcarchive-compressed size,
+#   - decode throughput of conversion.get_adc_block and get_vertical_array,
+#   - amplitude resolution: spread of the byte - word amplitude per pulse,
+#   - hit finding: agreement of amplitude > threshold between both formats.
+#
+#   python bench_byteformat.py                        # synthetic 1000 x 7 x 500 run
+#   python bench_byteformat.py --trcRun 12 --rawPath ../RawData_from_oscilloscope
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import conversion
+import trcarchive
+from bench_wavestore import synthetic_run, trc_run
+
+
+def to_bytes(adc):
+    # LeCroy byte format keeps the upper byte of the 16-bit word
+    return (adc.astype(np.int16) >> 8).astype(np.int8)
+
+
+def amplitudes(adc, gain, offset):
+    # pulse height above the pre-pulse baseline, volts, shape (events, channels)
+    volts = adc * gain[None, :, None] - offset[None, :, None]
+    baseline = volts[:, :, :adc.shape[2] // 5].mean(axis=2)
+    return volts.max(axis=2) - baseline
+
+
+def write_samples(path, adc):
+    # (events, channels, points) -> one file per channel, sample block at offset 0
+    files = []
+    for ichan in range(adc.shape[1]):
+        name = "%s_C%i.bin" % (path, ichan + 1)
+        np.ascontiguousarray(adc[:, ichan, :]).tofile(name)
+        files.append(name)
+    return files
+
+
+def archived_size(adc, block_segments=trcarchive.DEFAULT_BLOCK_SEGMENTS):
+    codec = trcarchive.default_codec()
+    level = trcarchive.DEFAULT_LEVELS[codec]
+    total = 0
+    for ichan in range(adc.shape[1]):
+        for first in range(0, adc.shape[0], block_segments):
+            block = np.ascontiguousarray(adc[first:first + block_segments, ichan, :])
+            total += len(trcarchive.compress(trcarchive.encode_block(block), codec, level))
+    return total
+
+
+def time_decode(files, dtype, nsegments, points, gain, offset, repeat):
+    # whole-channel reads as in --arrayStore, event reads as in the ROOT loop
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for f in files:
+            conversion.get_adc_block(f, 0, points, nsegments, dtype)
+    block = (time.perf_counter() - start) / repeat
+    n_events = min(nsegments, 200)
+    start = time.perf_counter()
+    for i in range(n_events):
+        for k, f in enumerate(files):
+            conversion.get_vertical_array(f, 0, points, gain[k], offset[k], i, dtype)
+    per_event = (time.perf_counter() - start) / n_events
+    return block, per_event
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare 8-bit (byte) and 16-bit (word) trace formats.')
+    parser.add_argument('--trcRun', type=int, default=None, help='use the word-format .trc files of this run')
+    parser.add_argument('--rawPath', type=str, default='../RawData_from_oscilloscope')
+    parser.add_argument('--events', type=int, default=1000, help='synthetic events')
+    parser.add_argument('--points', type=int, default=500, help='synthetic points per segment')
+    parser.add_argument('--threshold', type=float, default=15., help='hit threshold on the amplitude [mV]')
+    parser.add_argument('--repeat', type=int, default=5, help='repetitions of the block decode timing')
+    args = parser.parse_args()
+
+    if args.trcRun is not None:
+        adc, gain, offset, _, _, _ = trc_run(args.rawPath, args.trcRun)
+        if adc.dtype == np.int8:
+            raise SystemExit("Run %i is already byte format, take a word-format run" % args.trcRun)
+    else:
+        adc, gain, offset, _, _, _ = synthetic_run(args.events, 7, args.points)
+    nsegments, nchan, points = adc.shape
+    adc8 = to_bytes(adc)
+    gain8 = gain * 256.
+
+    print("%i events x %i channels x %i points" % (nsegments, nchan, points))
+    print("\n%-8s %12s %14s %14s %14s" % ("format", "raw [MB]", "archive [MB]", "block [ms]", "event [ms]"))
+    tmp = tempfile.mkdtemp(prefix="bench_byteformat_")
+    try:
+        results = {}
+        for name, data, dtype, g in [("word", adc.astype("<i2"), "<i2", gain), ("byte", adc8, "<i1", gain8)]:
+            files = write_samples(os.path.join(tmp, name), data)
+            block, per_event = time_decode(files, dtype, nsegments, points, g, offset, args.repeat)
+            results[name] = (data.nbytes, archived_size(data), block, per_event)
+            print("%-8s %12.2f %14.2f %14.1f %14.3f" % (name, data.nbytes / 1e6, results[name][1] / 1e6,
+                                                       1000 * block, 1000 * per_event))
+    finally:
+        shutil.rmtree(tmp)
+    word, byte = results["word"], results["byte"]
+    print("%-8s %12.2f %14.2f %14.2f %14.2f   (word / byte)" % ("ratio", word[0] / byte[0], word[1] / byte[1],
+                                                                word[2] / byte[2], word[3] / byte[3]))
+
+    amp16 = amplitudes(adc, gain, offset)
+    amp8 = amplitudes(adc8, gain8, offset)
+    diff = 1000 * (amp8 - amp16)
+    noise = 1000 * (adc[:, :, :points // 5] * gain[None, :, None]).std(axis=2).mean(axis=0)
+    threshold = args.threshold / 1000.
+    hit16, hit8 = amp16 > threshold, amp8 > threshold
+    print("\nchannel   LSB8 [mV]  noise [mV]  bias [mV]  spread [mV]  hits16  hits8  agreement")
+    for ichan in range(nchan):
+        print("CH%-6i %10.3f %11.3f %10.3f %12.3f %7i %6i %9.4f" % (
+            ichan + 1, 1000 * gain8[ichan], noise[ichan], diff[:, ichan].mean(), diff[:, ichan].std(),
+            hit16[:, ichan].sum(), hit8[:, ichan].sum(), (hit16[:, ichan] == hit8[:, ichan]).mean()))
+    print("\nByte format adds %.3f mV quantization spread on average (LSB/sqrt(12) = %.3f mV)"
+          % (diff.std(axis=0).mean(), 1000 * gain8.mean() / np.sqrt(12)))
+
+
+if __name__ == "__main__":
+    main()
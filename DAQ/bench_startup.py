@@ -0,0 +1,82 @@
+# bench_startup.py
+# Startup-time benchmark for the DAQ command-line tools.
+#
+# Every command is started as a fresh interpreter from this folder; the first
+# (coldest) start and the median of the repeats are reported against the
+# 200 ms target. Hardware commands are benchmarked only up to argument parsing
+# (--help), which must not load ROOT/pyvisa/libximc or open any connection.
+#   python bench_startup.py [--repeat 10] [--importtime]
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+DAQ_DIR = os.path.dirname(os.path.abspath(__file__))
+TARGET_MS = 200.
+
+COMMANDS = [
+    ("conversion --help", ["conversion.py", "--help"]),
+    ("acquisition --help", ["acquisition.py", "--help"]),
+    ("dqm --help", ["dqm.py", "--help"]),
+    ("import motortools", ["-c", "import motortools"]),
+    ("import logger", ["-c", "import logger"]),
+]
+
+
+def time_command(argv, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable] + argv, cwd=DAQ_DIR,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        times.append(1000 * (time.perf_counter() - start))
+        if proc.returncode != 0:
+            return times, proc.stderr.decode(errors="replace").strip().splitlines()[-1:]
+    return times, None
+
+
+def slowest_imports(argv, n=8):
+    # largest cumulative import times from python -X importtime
+    proc = subprocess.run([sys.executable, "-X", "importtime"] + argv, cwd=DAQ_DIR,
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup-time benchmark of the DAQ tools.')
+    parser.add_argument('--repeat', type=int, default=10, help='starts per command')
+    parser.add_argument('--importtime', action='store_true', help='list the slowest imports per command')
+    args = parser.parse_args()
+
+    print("%-22s %10s %10s  %s" % ("command", "first[ms]", "median[ms]", "status"))
+    failed = 0
+    for label, argv in COMMANDS:
+        times, error = time_command(argv, args.repeat)
+        median = statistics.median(times)
+        if error:
+            status = "ERROR: %s" % " ".join(error)
+            failed += 1
+        elif median > TARGET_MS:
+            status = "SLOW (> %i ms)" % TARGET_MS
+            failed += 1
+        else:
+            status = "ok"
+        print("%-22s %10.1f %10.1f  %s" % (label, times[0], median, status))
+        if args.importtime:
+            for cumulative_us, name in slowest_imports(argv):
+                print("%30s %8.1f ms" % (name, cumulative_us / 1000.))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,153 @@
+# bench_wavestore.py
+# Size, write speed and random-access read speed of the array stores
+# (wavestore.py) against a ROOT file with the converted_run{N}.root layout.
+#
+#   python bench_wavestore.py                         # synthetic 1000 x 7 x 500 run
+#   python bench_wavestore.py --trcRun 12 --rawPath ../RawData_from_oscilloscope
+#
+# Random access reads one event of one channel at random positions, the
+# typical event-display access pattern of analysis.ipynb.
+#
+# The "root" row is an approximation: uproot writes only the channel/time
+# branches with ZLIB level 1, while conversion.py writes a PyROOT TTree with
+# ROOT's default compression and all branches. For the real numbers pass the
+# converted_run{N}.root of the same run with --convertedFile (size and reads).
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import wavestore
+
+
+def synthetic_run(nevents, nchan, npoints, seed=1):
+    rng = np.random.default_rng(seed)
+    adc = rng.normal(0, 40, size=(nevents, nchan, npoints))
+    t = np.arange(npoints)
+    for ichan in range(nchan):
+        hits = rng.random(nevents) < 0.5
+        t0 = rng.normal(npoints / 2, 5, size=nevents)
+        amp = rng.uniform(2000, 8000, size=nevents) * hits
+        adc[:, ichan, :] += amp[:, None] * np.exp(-0.5 * ((t[None, :] - t0[:, None]) / 8.) ** 2)
+    gains = np.full(nchan, 1.5e-5)
+    offsets = np.zeros(nchan)
+    trigger_times = np.cumsum(rng.exponential(1e-3, size=nevents))
+    horizontal_offsets = rng.normal(-25e-9, 1e-11, size=(nevents, nchan))
+    return adc.astype(np.int16), gains, offsets, 1e-10, trigger_times, horizontal_offsets
+
+
+def trc_run(raw_path, run_number, nchan=7):
+    import conversion
+    files = ["%s/C%i--Trace%i.trc" % (raw_path, ichan + 1, run_number) for ichan in range(nchan)]
+    nsegments, points_per_frame, horizontal_interval, _, _ = conversion.get_configuration(files[0])
+    gains, offsets = [], []
+    for f in files:
+        config = conversion.get_configuration(f)
+        gains.append(config[3])
+        offsets.append(config[4])
+    offset, full_offset = conversion.get_waveform_block_offset(files[0])
+    adc = np.stack([conversion.get_adc_block(f, full_offset, points_per_frame, nsegments,
+                                             conversion.get_sample_format(f)) for f in files], axis=1)
+    times = [conversion.get_segment_times(f, offset, nsegments) for f in files]
+    trigger_times = np.asarray(times[0][0])
+    horizontal_offsets = np.column_stack([t[1] for t in times])
+    return adc, np.asarray(gains), np.asarray(offsets), horizontal_interval, trigger_times, horizontal_offsets
+
+
+def path_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(d, f)) for d, _, files in os.walk(path) for f in files)
+    return os.path.getsize(path)
+
+
+def write_root(path, volts, horizontal_interval, horizontal_offsets):
+    import uproot as ur
+    nevents, nchan, npoints = volts.shape
+    time_array = (horizontal_offsets[:, :1] + horizontal_interval * np.arange(npoints)[None, :]).astype(np.float32)
+    with ur.recreate(path, compression=ur.ZLIB(1)) as f:
+        f["pulse"] = {
+            "i_evt": np.arange(nevents, dtype=np.uint32),
+            "channel": volts,
+            "time": time_array[:, None, :],
+        }
+
+
+def random_reads_root(path, picks):
+    import uproot as ur
+    with ur.open(path) as f:
+        branch = f["pulse"]["channel"]
+        start = time.perf_counter()
+        for event, ichan in picks:
+            branch.array(entry_start=event, entry_stop=event + 1, library="np")[0, ichan]
+        return time.perf_counter() - start
+
+
+def random_reads_store(path, picks):
+    with wavestore.WaveStore(path) as store:
+        start = time.perf_counter()
+        for event, ichan in picks:
+            store.read(events=int(event), channels=[int(ichan)])
+        return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the array stores against ROOT.')
+    parser.add_argument('--events', type=int, default=1000)
+    parser.add_argument('--channels', type=int, default=7)
+    parser.add_argument('--points', type=int, default=500)
+    parser.add_argument('--trcRun', type=int, default=-1, help='use the raw .trc files of this run instead of synthetic data')
+    parser.add_argument('--rawPath', type=str, default='.', help='folder with the raw .trc files')
+    parser.add_argument('--reads', type=int, default=200, help='random single event/channel reads')
+    parser.add_argument('--backends', type=str, nargs='+', default=['root', 'hdf5', 'zarr'])
+    parser.add_argument('--convertedFile', type=str, default=None, help='conversion.py output of the same run, measured as is')
+    args = parser.parse_args()
+
+    if args.trcRun >= 0:
+        adc, gains, offsets, interval, trigger_times, horizontal_offsets = trc_run(args.rawPath, args.trcRun, args.channels)
+    else:
+        adc, gains, offsets, interval, trigger_times, horizontal_offsets = synthetic_run(args.events, args.channels, args.points)
+    volts = (gains[None, :, None] * adc - offsets[None, :, None]).astype(np.float32)
+    nevents, nchan, npoints = adc.shape
+    rng = np.random.default_rng(2)
+    picks = np.column_stack([rng.integers(0, nevents, args.reads), rng.integers(0, nchan, args.reads)])
+    raw_mb = adc.nbytes / 1e6
+
+    workdir = tempfile.mkdtemp(prefix="bench_wavestore_")
+    print("%i events x %i channels x %i points (%0.1f MB as int16)" % (nevents, nchan, npoints, raw_mb))
+    print("%-6s %10s %12s %14s" % ("format", "size[MB]", "write[MB/s]", "read[ms/event]"))
+    try:
+        for backend in args.backends:
+            try:
+                start = time.perf_counter()
+                if backend == "root":
+                    path = os.path.join(workdir, "run.root")
+                    write_root(path, volts, interval, horizontal_offsets)
+                else:
+                    path = wavestore.store_path(os.path.join(workdir, "run"), backend)
+                    wavestore.write_run(path, adc, gains, offsets, interval, trigger_times,
+                                        horizontal_offsets, backend=backend)
+                write_s = time.perf_counter() - start
+                read_s = (random_reads_root if backend == "root" else random_reads_store)(path, picks)
+            except ImportError as e:
+                print("%-6s skipped (%s)" % (backend, e))
+                continue
+            print("%-6s %10.2f %12.1f %14.3f" % (backend + ("*" if backend == "root" else ""),
+                                                 path_size(path) / 1e6, raw_mb / write_s,
+                                                 1000 * read_s / args.reads))
+        if args.convertedFile:
+            read_s = random_reads_root(args.convertedFile, picks)
+            print("%-6s %10.2f %12s %14.3f" % ("conv", path_size(args.convertedFile) / 1e6, "-",
+                                               1000 * read_s / args.reads))
+    finally:
+        shutil.rmtree(workdir)
+    if "root" in args.backends:
+        print("* uproot rewrite (channel/time branches, ZLIB 1), approximates the conversion.py output;"
+              " use --convertedFile for the real file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# campaign.py
+# Laser-power sweep campaigns: power is a scan dimension next to X and Z.
+#
+# MOVE_DAQ_CONVERSION.py repeats the X/Z grid for every laser power and tags
+# each run with its power in the run catalog. This module turns a campaign
+# into dense (power, X, Z, channel) arrays from the per-run summary table
+# (computed in parallel for runs that are new or changed), looking every run
+# up in the catalog instead of parsing run_Power_{power}% folder names.
+#
+#   python campaign.py --first 1 --last 560 --value plateau_mean --jobs 8
+#   powers, x, z, channels, values = campaign_arrays(range(1, 561))
+#
+# Runs taken before the catalog existed can be tagged once:
+#
+#   python campaign.py --first 1 --last 70 --tagPower 90 --tagZ 85000 --tagX0 45910 --tagStepX 2
+
+import numpy as np
+
+import constants
+import runsummary
+from runcatalog import RunCatalog
+
+
+def campaign_runs(runs=None, power=None, catalog_path=constants.CATALOG_PATH):
+    # catalog rows of a campaign, optionally restricted to runs / one power
+    with RunCatalog(catalog_path) as catalog:
+        rows = catalog.runs() if power is None else catalog.runs(power=power)
+    if runs is not None:
+        wanted = set(runs)
+        rows = [r for r in rows if r["run"] in wanted]
+    return rows
+
+
+def campaign_arrays(runs, value="plateau_mean", channels=None, jobs=1,
+                    summary_path=constants.SUMMARY_PATH, converted_path=constants.CONVERTED_PATH,
+                    catalog_path=constants.CATALOG_PATH, use_pedestals=True):
+    # returns powers, x, z, channels and values[power, x, z, channel];
+    # NaN where a point was not taken. Repeated points are averaged.
+    # Hits are cut on the smoothed pedestals unless use_pedestals=False.
+    summary = runsummary.update_summary(list(runs), path=summary_path, converted_path=converted_path,
+                                        catalog_path=catalog_path, jobs=jobs, use_pedestals=use_pedestals)
+    summary = summary[summary["run"].isin(list(runs))]
+    if channels is not None:
+        summary = summary[summary["channel"].isin(channels)]
+    summary = summary.dropna(subset=["x", "z"])
+    # untagged runs (no power sweep) are kept as power NaN -> one slice
+    power_key = summary["power"].fillna(-1.)
+
+    powers = np.unique(power_key.to_numpy())
+    xs = np.unique(summary["x"].to_numpy())
+    zs = np.unique(summary["z"].to_numpy())
+    chans = np.unique(summary["channel"].to_numpy())
+    ip = np.searchsorted(powers, power_key.to_numpy())
+    ix = np.searchsorted(xs, summary["x"].to_numpy())
+    iz = np.searchsorted(zs, summary["z"].to_numpy())
+    ic = np.searchsorted(chans, summary["channel"].to_numpy())
+
+    shape = (len(powers), len(xs), len(zs), len(chans))
+    flat = np.ravel_multi_index((ip, ix, iz, ic), shape)
+    v = summary[value].to_numpy(dtype=np.float64)
+    good = np.isfinite(v)
+    sums = np.bincount(flat[good], weights=v[good], minlength=int(np.prod(shape)))
+    counts = np.bincount(flat[good], minlength=int(np.prod(shape)))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        values = (sums / counts).reshape(shape)
+    powers = np.where(powers < 0, np.nan, powers)
+    return powers, xs, zs, chans, values
+
+
+def tag_runs(first, last, power=None, z=None, x0=None, step_x=None, catalog_path=constants.CATALOG_PATH):
+    # records power (and optionally the X/Z of a linear X scan) for runs
+    # taken before they were written to the catalog
+    with RunCatalog(catalog_path) as catalog:
+        for i, run in enumerate(range(first, last + 1)):
+            x = None if x0 is None else x0 + i * (step_x or 0)
+            # runs already in the catalog keep their time and status
+            status = "tagged" if catalog.get_run(run) is None else None
+            catalog.record_run(run, x=x, z=z, power=power, status=status)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Power/X/Z campaign arrays from the run catalog and summary table.')
+    parser.add_argument('--first', type=int, required=True, help='first run')
+    parser.add_argument('--last', type=int, required=True, help='last run (inclusive)')
+    parser.add_argument('--value', type=str, default='plateau_mean', help='summary column')
+    parser.add_argument('--channels', type=int, nargs='+', default=None)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--fixedThreshold', action='store_true', help='fixed 0.1 V hit cut instead of the pedestals')
+    parser.add_argument('--output', type=str, default=None, help='.npz with the campaign arrays')
+    parser.add_argument('--tagPower', type=float, default=None, help='only tag the runs with this power')
+    parser.add_argument('--tagZ', type=float, default=None)
+    parser.add_argument('--tagX0', type=float, default=None)
+    parser.add_argument('--tagStepX', type=float, default=None)
+    args = parser.parse_args()
+
+    if args.tagPower is not None or args.tagZ is not None or args.tagX0 is not None:
+        tag_runs(args.first, args.last, args.tagPower, args.tagZ, args.tagX0, args.tagStepX)
+        print("Tagged runs %i-%i." % (args.first, args.last))
+    else:
+        powers, xs, zs, chans, values = campaign_arrays(range(args.first, args.last + 1), args.value,
+                                                        args.channels, args.jobs,
+                                                        use_pedestals=not args.fixedThreshold)
+        print("%s: %i powers x %i X x %i Z x %i channels, %i points filled" % (
+            args.value, len(powers), len(xs), len(zs), len(chans), np.isfinite(values).sum()))
+        for ip, power in enumerate(powers):
+            print("  power %s%%: mean %.5f" % (power, np.nanmean(values[ip])))
+        if args.output:
+            np.savez(args.output, powers=powers, x=xs, z=zs, channels=chans, values=values)
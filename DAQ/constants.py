@@ -1,3 +1,11 @@
 LOG_FILE = "log.txt"
 
-HOME_COORDINATE = [45400, 35000] # [x, y] 
\ No newline at end of file
+HOME_COORDINATE = [45400, 35000] # [x, y]
+
+BASE_PATH = "/home/arcadia/Documents/Motors_automation_test/DAQtest"
+CONVERTED_PATH = BASE_PATH + "/Converted_runs_root"
+PREPROCESSED_PATH = BASE_PATH + "/pre_proc_without_meas"
+DQM_PATH = BASE_PATH + "/DQM"
+CATALOG_PATH = BASE_PATH + "/run_catalog.sqlite"
+SUMMARY_PATH = BASE_PATH + "/RunSummary.parquet"
+SKIM_PATH = BASE_PATH + "/Skims"
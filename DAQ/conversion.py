@@ -1,12 +1,15 @@
 import struct  #struct unpack result - tuple
-import numpy as np
-# from ROOT import *
-import ROOT
 import time
-import optparse
 import argparse
 import os
 import sys
+import glob
+import re
+## numpy, ROOT and roi are imported inside the functions that need them so
+## that --help and argument errors return without loading them
+## channel[] always has one slot per scope channel C1..C7 (positional, as the
+## analyses and the DatAnalyzer config expect); missing, disabled or skipped
+## channels are neither read nor copied and their slots stay zero
 nchan=7
 
 
@@ -18,40 +21,20 @@ def GetLatestNumber():
     FileHandle.close()
     return latestNumber
 
-parser = argparse.ArgumentParser(description='Run info.')
-parser.add_argument('--runNumber',metavar='runNumber', type=str,default = GetLatestNumber(), help='runNumber (default -1)',required=False)
-args = parser.parse_args()
-
-initial = time.time()
-
-RawDataPath = ""
-RawDataLocalCopyPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest/RawData_from_oscilloscope"
-OutputFilePath = BASE_PATH + "/Converted_runs_root"
-# eosPath = "root://cmseos.fnal.gov//store/group/cmstestbeam/%s/LecroyScope/RecoData/ConversionRECO/"  % BasePath
-
-LocalMode=True
-CopyToEOS=False
-isLPC = False
-
-if os.path.exists("_condor_stdout"):
-	print("Detected condor")
-	LocalMode=False
-else:
-    try:
-        user = os.environ['USER']
-        isLPC = 'cmslpc' in os.environ['HOSTNAME']
-    except:
-        print("Failed to find environment")
-    if isLPC:
-        print("Found user: {} Running on LPC: {}".format(user, isLPC))
-        LocalMode = False
-if LocalMode:
-	# RawDataPath = "/home/daq/LecroyMount/"
-	RawDataPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest"
-	RawDataLocalCopyPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest/RawData_from_oscilloscope"
-if not LocalMode:
-        OutputFilePath = ""
-
+def build_parser():
+    parser = argparse.ArgumentParser(description='Run info.')
+    parser.add_argument('--runNumber',metavar='runNumber', type=str,default = None, help='runNumber (default: latest run)',required=False)
+    parser.add_argument('--sequence',metavar='sequence', type=int, default=-1, help='sequence index of a multi-sequence run (default -1: single sequence)',required=False)
+    parser.add_argument('--eventOffset',metavar='eventOffset', type=int, default=0, help='added to i_evt, for multi-sequence runs',required=False)
+    parser.add_argument('--storage',metavar='storage', type=str, default='full', choices=['full','roi'], help='full waveforms or zero-suppressed region of interest (default full)',required=False)
+    parser.add_argument('--arrayStore',metavar='arrayStore', type=str, default='none', choices=['none','hdf5','zarr'], help='also write a chunked compressed array store (default none)',required=False)
+    parser.add_argument('--archive',metavar='archive', type=str, default=None, help='read the channels from a compressed Trace{run}.trca archive instead of .trc files',required=False)
+    parser.add_argument('--skipChannels',metavar='skipChannels', type=str, default='', help='comma separated scope channels not to convert, e.g. 7,8',required=False)
+    parser.add_argument('--roiBaseline',metavar='roiBaseline', type=int, default=None, help='samples in the baseline window (roi storage)',required=False)
+    parser.add_argument('--roiThreshold',metavar='roiThreshold', type=float, default=None, help='hit threshold in V above baseline (roi storage)',required=False)
+    parser.add_argument('--roiPre',metavar='roiPre', type=int, default=None, help='samples kept before the first sample over threshold (roi storage)',required=False)
+    parser.add_argument('--roiPost',metavar='roiPost', type=int, default=None, help='samples kept after the last sample over threshold (roi storage)',required=False)
+    return parser
 
 
 #### Memory addresses #####
@@ -220,8 +203,23 @@ def dump_info(filepath_in, index_in,n_points):
 	#	print "%.2f" %y
 
 
+def open_trc(filepath_in):
+	# .trc path, or a member of a compressed run archive (trcarchive.py)
+	if hasattr(filepath_in, 'open'):
+		return filepath_in.open()
+	return open(filepath_in, 'rb')
+
+
+def read_array(filepath_in,dtype,count,offset):
+	import numpy as np
+	if not hasattr(filepath_in, 'read_at'):
+		return np.fromfile(filepath_in, dtype=dtype, count=count, offset=offset)
+	dtype = np.dtype(dtype)
+	return np.frombuffer(filepath_in.read_at(offset, count*dtype.itemsize), dtype=dtype, count=count)
+
+
 def get_waveform_block_offset(filepath_in):
-	my_file = open(filepath_in, 'rb')
+	my_file = open_trc(filepath_in)
 
 	my_file.seek(aUSER_TEXT)
 	USER_TEXT = struct.unpack('i',my_file.read(4))#ReadLong(fid, aUSER_TEXT);
@@ -237,7 +235,7 @@ def get_waveform_block_offset(filepath_in):
 
 
 def get_configuration(filepath_in):
-	my_file = open(filepath_in, 'rb')
+	my_file = open_trc(filepath_in)
 	my_file.seek(aVERTICAL_GAIN)
 	vertical_gain = struct.unpack('f',my_file.read(4))[0]
 	my_file.seek(aVERTICAL_OFFSET)
@@ -253,8 +251,51 @@ def get_configuration(filepath_in):
 	return [nsegments,points_per_frame,horizontal_interval,vertical_gain,vertical_offset]
 
 
+## COMM_TYPE 0: byte samples, 1: 16-bit word samples
+SAMPLE_FORMATS = {0: '<i1', 1: '<i2'}
+SAMPLE_BYTES = {'<i1': 1, '<i2': 2}
+STRUCT_FORMATS = {'<i1': 'b', '<i2': 'h'}
+
+
+def get_sample_format(filepath_in):
+	my_file = open_trc(filepath_in)
+	my_file.seek(aCOMM_TYPE)
+	comm_type = struct.unpack('h',my_file.read(2))[0]
+	my_file.close()
+	if comm_type not in SAMPLE_FORMATS:
+		raise ValueError("Unknown COMM_TYPE %i in %s" % (comm_type, filepath_in))
+	return SAMPLE_FORMATS[comm_type]
+
+
+def parse_channels(text):
+	# "2,4,6" -> [2, 4, 6]
+	return sorted(set(int(c) for c in str(text).replace(' ','').split(',') if c))
+
+
+def find_channels(directory,traceName,skip=(),channels=range(1,nchan+1)):
+	# {scope channel: path} of the C{n}--{traceName}.trc files in directory,
+	# only for the given scope channels (default C1..C7)
+	files = {}
+	for path in glob.glob(os.path.join(directory, "C*--%s.trc" % traceName)):
+		match = re.match(r"C(\d+)--", os.path.basename(path))
+		if match and int(match.group(1)) in channels and int(match.group(1)) not in skip:
+			files[int(match.group(1))] = path
+	return dict(sorted(files.items()))
+
+
+def channel_enabled(filepath_in):
+	# a channel that was off when the sequence was saved has an empty sample array
+	my_file = open_trc(filepath_in)
+	my_file.seek(aWAVE_ARRAY_1)
+	wave_array_bytes = struct.unpack('i',my_file.read(4))[0]
+	my_file.seek(aWAVE_ARRAY_COUNT)
+	wave_array_count = struct.unpack('i',my_file.read(4))[0]
+	my_file.close()
+	return wave_array_bytes > 0 and wave_array_count > 0
+
+
 def get_segment_times(filepath_in,offset,nsegments):
-	my_file = open(filepath_in, 'rb')
+	my_file = open_trc(filepath_in)
 	trigger_times = []
 	horizontal_offsets = []
 
@@ -267,144 +308,300 @@ def get_segment_times(filepath_in,offset,nsegments):
 	return trigger_times,horizontal_offsets
 
 
-def get_vertical_array(filepath_in,full_offset,points_per_frame,vertical_gain,vertical_offset,event_number):
-	my_file = open(filepath_in, 'rb')
+def get_vertical_array(filepath_in,full_offset,points_per_frame,vertical_gain,vertical_offset,event_number,sample_dtype='<i2'):
+	my_file = open_trc(filepath_in)
 
-	starting_position = full_offset + 2*points_per_frame*event_number
+	sample_bytes = SAMPLE_BYTES[sample_dtype]
+	starting_position = full_offset + sample_bytes*points_per_frame*event_number
 	my_file.seek(starting_position)
-	binary_y_data = my_file.read(2*points_per_frame)
-	y_axis_raw = struct.unpack("<"+str(points_per_frame)+"h", binary_y_data)
+	binary_y_data = my_file.read(sample_bytes*points_per_frame)
+	y_axis_raw = struct.unpack("<"+str(points_per_frame)+STRUCT_FORMATS[sample_dtype], binary_y_data)
 	y_axis = [vertical_gain*y - vertical_offset for y in y_axis_raw]
 
 	my_file.close()
 	return y_axis
 
 
-def calc_horizontal_array(points_per_frame,horizontal_interval,horizontal_offset):
-	x_axis = horizontal_offset + horizontal_interval * np.linspace(0, points_per_frame-1, points_per_frame)
-	return x_axis
+def get_adc_array(filepath_in,full_offset,points_per_frame,event_number,sample_dtype='<i2'):
+	# raw ADC codes of one segment, used by the roi storage mode
+	starting_position = full_offset + SAMPLE_BYTES[sample_dtype]*points_per_frame*event_number
+	return read_array(filepath_in, sample_dtype, points_per_frame, starting_position)
 
 
+def get_adc_block(filepath_in,full_offset,points_per_frame,nsegments,sample_dtype='<i2'):
+	# raw ADC codes of all segments of one channel, shape (nsegments, points_per_frame)
+	data = read_array(filepath_in, sample_dtype, nsegments*points_per_frame, full_offset)
+	return data.reshape(nsegments, points_per_frame)
 
 
+def calc_horizontal_array(points_per_frame,horizontal_interval,horizontal_offset):
+	import numpy as np
+	x_axis = horizontal_offset + horizontal_interval * np.linspace(0, points_per_frame-1, points_per_frame)
+	return x_axis
 
 
-runNumber = int(args.runNumber)
-# runNumber = 38
-print("\nProcessing run %i." % runNumber)
-
-sourceFiles=[]
-inputFiles=[]
-start = time.time()
-for ic in range(nchan):
-	this_file = "%s/C%i--Trace%i.trc" % (RawDataPath, ic+1,runNumber)
-	if LocalMode: 
-		print("Copying files locally and moving originals to deletion folder.")
-		inputFiles.append("%s/C%i--Trace%i.trc" % (RawDataLocalCopyPath, ic+1,runNumber))
-		#print 'rsync -z -v %s %s && mv %s %s' % (this_file,RawDataLocalCopyPath,this_file,RawDataPath+"/to_delete/")
-		os.system('rsync -z -v %s %s && mv %s %s' % (this_file,RawDataLocalCopyPath,this_file,RawDataPath+"/to_delete/"))
-
-	else: inputFiles.append("C%i--Trace%i.trc" % (ic+1,runNumber)) ### condor copies files to current directory
-
-end = time.time()
-print("\nCopying files locally took %i seconds." % (end-start))
-
-outputFile = "%s/converted_run%i.root"%(OutputFilePath, runNumber)
-#outputFile = "%srun_scope%i.root"%(OutputFilePath, runNumber)
-
-#inputFile = "%s/C1--Trace%i.trc" %(RawDataPath,runNumber)  ### use ch1 to get information
-##### Get necessary information about format
-
-vertical_gains =[]
-vertical_offsets =[]
-nsegments=0
-points_per_frame=0
-horizontal_interval=0
-for ichan in range(nchan):
-	nsegments,points_per_frame,horizontal_interval,vertical_gain,vertical_offset = get_configuration(inputFiles[ichan])
-	vertical_gains.append(vertical_gain)
-	vertical_offsets.append(vertical_offset)
-
-print("Number of segments: %i" %nsegments)
-print("Points per segment %i" % points_per_frame)
-print("Horizontal interval %s" % str(horizontal_interval))
-
-for ichan in range(nchan):
-	print("Channel %i"%ichan)
-	print("\t vertical_gain %0.3f" % vertical_gains[ichan])
-	print("\t vertical offset %0.3f" % vertical_offsets[ichan])
-
-### find beginning of trigger time block and y-axis block
-offset,full_offset = get_waveform_block_offset(inputFiles[0])
-#print "offset is ",offset
-
-## get event times and offsets
-trigger_times,horizontal_offsets = get_segment_times(inputFiles[0],offset,nsegments)
-trigger_times2,horizontal_offsets2 = get_segment_times(inputFiles[1],offset,nsegments)
-trigger_times3,horizontal_offsets3 = get_segment_times(inputFiles[2],offset,nsegments)
-trigger_times3,horizontal_offsets4 = get_segment_times(inputFiles[3],offset,nsegments)
-trigger_times3,horizontal_offsets5 = get_segment_times(inputFiles[4],offset,nsegments)
-trigger_times3,horizontal_offsets6 = get_segment_times(inputFiles[5],offset,nsegments)
-trigger_times3,horizontal_offsets7 = get_segment_times(inputFiles[6],offset,nsegments)
-# trigger_times3,horizontal_offsets8 = get_segment_times(inputFiles[7],offset,nsegments)
-
-# for i in range(20):
-# 	print "delta offsets 1st group %i %0.4f" % (i,1e12*(horizontal_offsets[i]-horizontal_offsets2[i]))
-# 	print "delta offsets 2 groups %i %0.4f" % (i,1e12*(horizontal_offsets[i]-horizontal_offsets3[i]))
-# for i in range(20):
-# 	print "Offsets %i %0.1f %0.1f %0.1f %0.1f %0.1f %0.1f %0.1f %0.1f" % (i,1e12*horizontal_offsets[i] +25000,1e12*horizontal_offsets2[i] +25000,1e12*horizontal_offsets3[i] +25000,1e12*horizontal_offsets4[i] +25000,1e12*horizontal_offsets5[i] +25000,1e12*horizontal_offsets6[i] +25000,1e12*horizontal_offsets7[i] +25000,1e12*horizontal_offsets8[i]+25000)
-#print "Trigger times: ",trigger_times
-#print "Horizontal offsets: ",horizontal_offsets
-
-## prepare the output files
-# outputFile = '%srun_scope%s.root' % (output, run)
-start = time.time()
-outRoot = ROOT.TFile(outputFile, "RECREATE") # Error in here
-outTree = ROOT.TTree("pulse","pulse")
-
-i_evt = np.zeros(1,dtype=np.dtype("u4"))
-segment_time = np.zeros(1,dtype=np.dtype("f"))
-channel = np.zeros([8,points_per_frame],dtype=np.float32)
-time_array = np.zeros([1,points_per_frame],dtype=np.float32)
-time_offsets = np.zeros(8,dtype=np.dtype("f"))
-
-outTree.Branch('i_evt',i_evt,'i_evt/i')
-outTree.Branch('segment_time',segment_time,'segment_time/F')
-outTree.Branch('channel', channel, 'channel[%i][%i]/F' %(nchan,points_per_frame) )
-outTree.Branch('time', time_array, 'time[1]['+str(points_per_frame)+']/F' )
-outTree.Branch('timeoffsets',time_offsets,'timeoffsets[8]/F')
-
-for i in range(nsegments):
-    if i%1000==0:
-        print("Processing event %i" % i)
-    channel[0] = get_vertical_array(inputFiles[0],full_offset,points_per_frame,vertical_gains[0],vertical_offsets[0],i)
-    channel[1] = get_vertical_array(inputFiles[1],full_offset,points_per_frame,vertical_gains[1],vertical_offsets[1],i)
-    channel[2] = get_vertical_array(inputFiles[2],full_offset,points_per_frame,vertical_gains[2],vertical_offsets[2],i)
-    channel[3] = get_vertical_array(inputFiles[3],full_offset,points_per_frame,vertical_gains[3],vertical_offsets[3],i)
-    channel[4] = get_vertical_array(inputFiles[4],full_offset,points_per_frame,vertical_gains[4],vertical_offsets[4],i)
-    channel[5] = get_vertical_array(inputFiles[5],full_offset,points_per_frame,vertical_gains[5],vertical_offsets[5],i)
-    channel[6] = get_vertical_array(inputFiles[6],full_offset,points_per_frame,vertical_gains[6],vertical_offsets[6],i)
-    # channel[7] = get_vertical_array(inputFiles[7],full_offset,points_per_frame,vertical_gains[7],vertical_offsets[7],i)
-    time_array[0]    = calc_horizontal_array(points_per_frame,horizontal_interval,horizontal_offsets[i])
-    i_evt[0]   = i
-    segment_time[0] = trigger_times[i]
-    time_offsets[0] = horizontal_offsets[i] -horizontal_offsets[i]
-    time_offsets[1] = horizontal_offsets2[i]-horizontal_offsets[i]
-    time_offsets[2] = horizontal_offsets3[i]-horizontal_offsets[i]
-    time_offsets[3] = horizontal_offsets4[i]-horizontal_offsets[i]
-    time_offsets[4] = horizontal_offsets5[i]-horizontal_offsets[i]
-    time_offsets[5] = horizontal_offsets6[i]-horizontal_offsets[i]
-    time_offsets[6] = horizontal_offsets7[i]-horizontal_offsets[i]
-    # time_offsets[7] = horizontal_offsets8[i]-horizontal_offsets[i]
-
-    outTree.Fill()
-
-print("done filling the tree")
-outRoot.cd()
-outTree.Write()
-outRoot.Close()
-final = time.time()
-print("\nFilling tree took %i seconds." %(final-start))
-print("\nFull script duration: %0.f s"%(final-initial))
-
-# if CopyToEOS: os.system("xrdcp -fs %s %s" %(outputFile,eosPath))
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.runNumber is None: args.runNumber = GetLatestNumber()
+
+    import numpy as np
+    import ROOT
+    import roi
+    import trigindex
+    import pedestals
+    if args.roiBaseline is None: args.roiBaseline = roi.DEFAULT_BASELINE_SAMPLES
+    if args.roiThreshold is None: args.roiThreshold = roi.DEFAULT_THRESHOLD
+    if args.roiPre is None: args.roiPre = roi.DEFAULT_PRE_SAMPLES
+    if args.roiPost is None: args.roiPost = roi.DEFAULT_POST_SAMPLES
+
+    initial = time.time()
+
+    RawDataPath = ""
+    RawDataLocalCopyPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest/RawData_from_oscilloscope"
+    OutputFilePath = BASE_PATH + "/Converted_runs_root"
+    # eosPath = "root://cmseos.fnal.gov//store/group/cmstestbeam/%s/LecroyScope/RecoData/ConversionRECO/"  % BasePath
+
+    LocalMode=True
+    CopyToEOS=False
+    isLPC = False
+
+    if os.path.exists("_condor_stdout"):
+        print("Detected condor")
+        LocalMode=False
+    else:
+        try:
+            user = os.environ['USER']
+            isLPC = 'cmslpc' in os.environ['HOSTNAME']
+        except:
+            print("Failed to find environment")
+        if isLPC:
+            print("Found user: {} Running on LPC: {}".format(user, isLPC))
+            LocalMode = False
+    if LocalMode:
+        # RawDataPath = "/home/daq/LecroyMount/"
+        RawDataPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest"
+        RawDataLocalCopyPath = "/home/arcadia/Documents/Motors_automation_test/DAQtest/RawData_from_oscilloscope"
+    if not LocalMode:
+            OutputFilePath = ""
+
+    runNumber = int(args.runNumber)
+    # runNumber = 38
+    print("\nProcessing run %i." % runNumber)
+
+    ## only the channel files that exist, are enabled and not skipped are read
+    skipChannels = parse_channels(args.skipChannels)
+    start = time.time()
+    traceName = "Trace%i" % runNumber
+    if args.sequence >= 0: traceName = "Trace%i_%i" % (runNumber, args.sequence)
+    if args.archive:
+        import trcarchive
+        archive = trcarchive.TrcArchive(args.archive)
+        print("Reading channels from archive %s." % args.archive)
+        foundFiles = dict((ch, archive.member(ch)) for ch in archive.channels if 1 <= ch <= nchan and ch not in skipChannels)
+    elif LocalMode:
+        print("Copying files locally and moving originals to deletion folder.")
+        for this_file in find_channels(RawDataPath, traceName, skipChannels).values():
+            #print 'rsync -z -v %s %s && mv %s %s' % (this_file,RawDataLocalCopyPath,this_file,RawDataPath+"/to_delete/")
+            os.system('rsync -z -v %s %s && mv %s %s' % (this_file,RawDataLocalCopyPath,this_file,RawDataPath+"/to_delete/"))
+        foundFiles = find_channels(RawDataLocalCopyPath, traceName, skipChannels)
+    else: foundFiles = find_channels(".", traceName, skipChannels) ### condor copies files to current directory
+
+    end = time.time()
+    print("\nCopying files locally took %i seconds." % (end-start))
+
+    channels = []
+    inputFiles = []
+    for ch, f in foundFiles.items():
+        if channel_enabled(f):
+            channels.append(ch)
+            inputFiles.append(f)
+        else: print("Channel C%i is disabled in %s, not converted." % (ch, f))
+    if not channels:
+        raise SystemExit("No channel files C*--%s.trc to convert." % traceName)
+    nconv = len(channels)
+    slots = [ch-1 for ch in channels]   ## index in channel[] of every converted channel
+    print("Converting %i channels: %s" % (nconv, ", ".join("C%i" % ch for ch in channels)))
+
+    runLabel = "%i" % runNumber
+    if args.sequence >= 0: runLabel = "%i_%i" % (runNumber, args.sequence)
+    outputFile = "%s/converted_run%s.root"%(OutputFilePath, runLabel)
+    if args.storage == 'roi':
+        outputFile = "%s/converted_roi_run%s.root"%(OutputFilePath, runLabel)
+    #outputFile = "%srun_scope%i.root"%(OutputFilePath, runNumber)
+
+    #inputFile = "%s/C1--Trace%i.trc" %(RawDataPath,runNumber)  ### use ch1 to get information
+    ##### Get necessary information about format
+
+    vertical_gains =[]
+    vertical_offsets =[]
+    nsegments=0
+    points_per_frame=0
+    horizontal_interval=0
+    for ichan in range(nconv):
+        nsegments,points_per_frame,horizontal_interval,vertical_gain,vertical_offset = get_configuration(inputFiles[ichan])
+        vertical_gains.append(vertical_gain)
+        vertical_offsets.append(vertical_offset)
+
+    ## byte (8-bit) or word (16-bit) samples, from COMM_TYPE of each file
+    sample_dtypes = [get_sample_format(f) for f in inputFiles]
+
+    print("Number of segments: %i" %nsegments)
+    print("Points per segment %i" % points_per_frame)
+    print("Horizontal interval %s" % str(horizontal_interval))
+
+    for ichan in range(nconv):
+        print("Channel %i (C%i)"%(slots[ichan],channels[ichan]))
+        print("\t vertical_gain %0.3f" % vertical_gains[ichan])
+        print("\t vertical offset %0.3f" % vertical_offsets[ichan])
+        print("\t samples %s" % ("8-bit" if sample_dtypes[ichan] == '<i1' else "16-bit"))
+
+    ### find beginning of trigger time block and y-axis block
+    offset,full_offset = get_waveform_block_offset(inputFiles[0])
+    #print "offset is ",offset
+
+    ## get event times and offsets of all channels at once, checked across channels
+    index = trigindex.build_index(inputFiles, channels=slots, run=runNumber, sequence=args.sequence)
+    trigger_times = index.trigger_time
+    horizontal_offsets = index.horizontal_offset[0]
+    event_time_offsets = index.time_offsets()
+    indexFile = index.save("%s/converted_run%s_trigindex.npz" % (OutputFilePath, runLabel))
+    print("Trigger index: %i segments, mean rate %0.1f Hz (%s)" % (len(index), index.rate(), indexFile))
+
+    ## prepare the output files
+    # outputFile = '%srun_scope%s.root' % (output, run)
+    start = time.time()
+    outRoot = ROOT.TFile(outputFile, "RECREATE") # Error in here
+    outTree = ROOT.TTree("pulse","pulse")
+
+    i_evt = np.zeros(1,dtype=np.dtype("u4"))
+    segment_time = np.zeros(1,dtype=np.dtype("f"))
+    channel = np.zeros([nchan,points_per_frame],dtype=np.float32)
+    time_array = np.zeros([1,points_per_frame],dtype=np.float32)
+    time_offsets = np.zeros(8,dtype=np.dtype("f"))
+    ## gains/offsets per slot, zero for channels that are not converted
+    slot_gains = np.zeros(nchan,dtype=np.float64)
+    slot_offsets = np.zeros(nchan,dtype=np.float64)
+    slot_gains[slots] = vertical_gains
+    slot_offsets[slots] = vertical_offsets
+
+    outTree.Branch('i_evt',i_evt,'i_evt/i')
+    outTree.Branch('segment_time',segment_time,'segment_time/F')
+    if args.storage == 'full':
+        outTree.Branch('channel', channel, 'channel[%i][%i]/F' %(nchan,points_per_frame) )
+        outTree.Branch('time', time_array, 'time[1]['+str(points_per_frame)+']/F' )
+    outTree.Branch('timeoffsets',time_offsets,'timeoffsets[8]/F')
+
+    ## scope channel of every slot of channel[] and whether it holds data
+    channelTree = ROOT.TTree("channel_map","channel_map")
+    channel_ids = np.arange(1,nchan+1,dtype=np.int32)
+    channel_converted = np.zeros(nchan,dtype=np.int32)
+    channel_converted[slots] = 1
+    channelTree.Branch('channel_id',channel_ids,'channel_id[%i]/I' % nchan)
+    channelTree.Branch('converted',channel_converted,'converted[%i]/I' % nchan)
+    channelTree.Fill()
+
+    if args.storage == 'roi':
+        ## zero-suppressed layout, see roi.py
+        time0 = np.zeros(1,dtype=np.dtype("f"))
+        baseline_mean = np.zeros(nchan,dtype=np.float32)
+        baseline_rms = np.zeros(nchan,dtype=np.float32)
+        roi_start = np.zeros(nchan,dtype=np.int16)
+        roi_length = np.zeros(nchan,dtype=np.int16)
+        roi_offset = np.zeros(nchan,dtype=np.int32)
+        n_roi = np.zeros(1,dtype=np.int32)
+        roi_adc = np.zeros(nchan*points_per_frame,dtype=np.int16)
+        adc = np.zeros([nchan,points_per_frame],dtype=np.int16)
+        roi_gains = slot_gains
+        roi_offsets = slot_offsets
+
+        outTree.Branch('time0',time0,'time0/F')
+        outTree.Branch('baseline_mean',baseline_mean,'baseline_mean[%i]/F' % nchan)
+        outTree.Branch('baseline_rms',baseline_rms,'baseline_rms[%i]/F' % nchan)
+        outTree.Branch('roi_start',roi_start,'roi_start[%i]/S' % nchan)
+        outTree.Branch('roi_length',roi_length,'roi_length[%i]/S' % nchan)
+        outTree.Branch('roi_offset',roi_offset,'roi_offset[%i]/I' % nchan)
+        outTree.Branch('n_roi',n_roi,'n_roi/I')
+        outTree.Branch('roi_adc',roi_adc,'roi_adc[n_roi]/S')
+
+        ## run constants needed to turn ADC codes back into volts and seconds
+        configTree = ROOT.TTree("roi_config","roi_config")
+        cfg_interval = np.array([horizontal_interval],dtype=np.float64)
+        cfg_points = np.array([points_per_frame],dtype=np.int32)
+        cfg_roi = np.array([args.roiBaseline,args.roiPre,args.roiPost],dtype=np.int32)
+        cfg_threshold = np.array([args.roiThreshold],dtype=np.float64)
+        configTree.Branch('vertical_gain',roi_gains,'vertical_gain[%i]/D' % nchan)
+        configTree.Branch('vertical_offset',roi_offsets,'vertical_offset[%i]/D' % nchan)
+        configTree.Branch('horizontal_interval',cfg_interval,'horizontal_interval/D')
+        configTree.Branch('points_per_frame',cfg_points,'points_per_frame/I')
+        configTree.Branch('baseline_pre_post',cfg_roi,'baseline_pre_post[3]/I')
+        configTree.Branch('threshold',cfg_threshold,'threshold/D')
+        configTree.Fill()
+
+    ## baseline statistics of every channel, recorded in the run catalog
+    pedestal = pedestals.PedestalAccumulator(channels)
+
+    for i in range(nsegments):
+        if i%1000==0:
+            print("Processing event %i" % i)
+        if args.storage == 'full':
+            for ichan in range(nconv):
+                channel[slots[ichan]] = get_vertical_array(inputFiles[ichan],full_offset,points_per_frame,vertical_gains[ichan],vertical_offsets[ichan],i,sample_dtypes[ichan])
+            pedestal.update(channel[slots])
+            time_array[0]    = calc_horizontal_array(points_per_frame,horizontal_interval,horizontal_offsets[i])
+        else:
+            for ichan in range(nconv):
+                adc[slots[ichan]] = get_adc_array(inputFiles[ichan],full_offset,points_per_frame,i,sample_dtypes[ichan])
+            baseline_mean[:],baseline_rms[:],start_idx,stop_idx = roi.find_roi(adc,roi_gains,roi_offsets,args.roiBaseline,args.roiThreshold,args.roiPre,args.roiPost)
+            n_roi[0] = roi.pack_event(adc,start_idx,stop_idx,roi_adc,roi_start,roi_length,roi_offset)
+            pedestal.update_moments(baseline_mean[slots],baseline_rms[slots],args.roiBaseline)
+            time0[0] = horizontal_offsets[i]
+        i_evt[0]   = i + args.eventOffset
+        segment_time[0] = trigger_times[i]
+        time_offsets[slots] = event_time_offsets[i]
+
+        outTree.Fill()
+
+    print("done filling the tree")
+    outRoot.cd()
+    outTree.Write()
+    channelTree.Write()
+    if args.storage == 'roi':
+        configTree.Write()
+    outRoot.Close()
+    final = time.time()
+    print("\nFilling tree took %i seconds." %(final-start))
+    print("\nFull script duration: %0.f s"%(final-initial))
+    print("Output size: %0.1f MB (%s storage)" % (os.path.getsize(outputFile)/1e6, args.storage))
+
+    pedestal_rows = pedestal.rows()
+    for row in pedestal_rows:
+        print("\t C%i pedestal %0.2f mV, rms %0.2f mV" % (row["channel"], 1000*row["mean"], 1000*row["rms"]))
+    try:
+        import sqlite3
+        from runcatalog import RunCatalog
+        with RunCatalog() as catalog:
+            catalog.record_pedestals(runNumber, pedestal_rows, sequence=args.sequence)
+    except (OSError, sqlite3.Error) as e:
+        print("Pedestals not recorded in the run catalog: %s" % e)
+
+    if args.arrayStore != 'none':
+        import wavestore
+        start = time.time()
+        store_adc = np.zeros([nsegments,nchan,points_per_frame],dtype=np.result_type(*sample_dtypes))
+        store_offsets = np.zeros([nsegments,nchan])
+        for ichan in range(nconv):
+            store_adc[:,slots[ichan],:] = get_adc_block(inputFiles[ichan],full_offset,points_per_frame,nsegments,sample_dtypes[ichan])
+            store_offsets[:,slots[ichan]] = index.horizontal_offset[ichan]
+        storeFile = wavestore.store_path("%s/converted_run%s" % (OutputFilePath, runLabel), args.arrayStore)
+        wavestore.write_run(storeFile, store_adc, slot_gains, slot_offsets, horizontal_interval,
+                            trigger_times, store_offsets, attrs={"run": runNumber, "sequence": args.sequence,
+                                                                 "channels": list(range(1,nchan+1)), "converted": channels,
+                                                                 "reference_slot": slots[0]},
+                            backend=args.arrayStore)
+        print("Writing %s store took %0.1f s: %s" % (args.arrayStore, time.time()-start, storeFile))
+
+    # if CopyToEOS: os.system("xrdcp -fs %s %s" %(outputFile,eosPath))
+
+
+if __name__ == "__main__":
+    main()
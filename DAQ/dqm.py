@@ -0,0 +1,300 @@
+# dqm.py
+# Online data-quality monitor for the scan loop.
+#
+# Every converted run is streamed once in fixed-size chunks; per channel it
+# accumulates hit rate, an amplitude histogram, baseline mean/RMS and the
+# saturated fraction with constant memory. The scan summary is rewritten after
+# each run as DQM/summary.html (auto-refreshing) and DQM/summary.json, and can
+# also be served on a local HTTP port. Thresholds flag bad points so the scan
+# loop can repeat them.
+
+import html
+import json
+import os
+import threading
+import time
+from collections import deque, namedtuple
+
+import numpy as np
+
+import constants
+
+
+# hit_channels: channels that must fire on every trigger (CH1 trigger by default);
+# position-dependent channels are not checked for hit rate.
+# saturation_level: top of screen with the default 50 mV/div and 3 div offset.
+DQMThresholds = namedtuple("DQMThresholds", [
+    "hit_threshold", "saturation_level", "min_hit_rate", "hit_channels",
+    "max_saturation", "max_baseline_shift", "max_baseline_rms", "action"])
+
+DEFAULT_THRESHOLDS = DQMThresholds(
+    hit_threshold=0.1, saturation_level=0.35, min_hit_rate=0.9, hit_channels=(0,),
+    max_saturation=0.05, max_baseline_shift=0.005, max_baseline_rms=0.005,
+    action="flag")
+
+AMPLITUDE_RANGE = (0., 1.)  # V
+AMPLITUDE_BINS = 100
+BASELINE_SAMPLES = 100
+CHUNK_EVENTS = 200
+HISTORY_ROWS = 50
+
+
+class RunningHistogram:
+    # fixed binning with under/overflow, filled chunk by chunk
+
+    def __init__(self, lo, hi, nbins):
+        self.lo = lo
+        self.hi = hi
+        self.nbins = nbins
+        self.counts = np.zeros(nbins + 2, dtype=np.int64)
+
+    def fill(self, values):
+        idx = np.floor((np.asarray(values) - self.lo) * self.nbins / (self.hi - self.lo)).astype(np.int64) + 1
+        idx = np.clip(idx, 0, self.nbins + 1)
+        self.counts += np.bincount(idx, minlength=self.nbins + 2)
+
+    def add(self, other):
+        self.counts += other.counts
+
+    def reset(self):
+        self.counts[:] = 0
+
+    def centers(self):
+        width = (self.hi - self.lo) / self.nbins
+        return self.lo + width * (np.arange(self.nbins) + 0.5)
+
+    def mean(self):
+        inside = self.counts[1:-1]
+        if inside.sum() == 0:
+            return float("nan")
+        return float(np.dot(inside, self.centers()) / inside.sum())
+
+
+class RunningMoments:
+    # count/mean/M2 merged chunk by chunk (Chan et al. parallel variance)
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def update(self, values):
+        values = np.asarray(values, dtype=np.float64).ravel()
+        n_b = values.size
+        if n_b == 0:
+            return
+        mean_b = values.mean()
+        m2_b = ((values - mean_b) ** 2).sum()
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+
+    def rms(self):
+        return float(np.sqrt(self.m2 / self.n)) if self.n else float("nan")
+
+
+class ChannelMonitor:
+    # per-run accumulators of one channel
+
+    def __init__(self, thresholds):
+        self.thresholds = thresholds
+        self.n_events = 0
+        self.n_hits = 0
+        self.n_saturated = 0
+        self.baseline = RunningMoments()
+        self.amplitude = RunningHistogram(AMPLITUDE_RANGE[0], AMPLITUDE_RANGE[1], AMPLITUDE_BINS)
+
+    def update(self, frames):
+        # frames: (events, samples) in volts
+        base = frames[:, :BASELINE_SAMPLES]
+        self.baseline.update(base)
+        amplitude = np.abs(frames - base.mean(axis=1)[:, None]).max(axis=1)
+        self.amplitude.fill(amplitude)
+        self.n_events += frames.shape[0]
+        self.n_hits += int((amplitude > self.thresholds.hit_threshold).sum())
+        self.n_saturated += int((frames.max(axis=1) >= self.thresholds.saturation_level).sum())
+
+    def summary(self):
+        n = max(self.n_events, 1)
+        return {
+            "hit_rate": self.n_hits / n,
+            "saturation": self.n_saturated / n,
+            "baseline_mean": self.baseline.mean,
+            "baseline_rms": self.baseline.rms(),
+            "amplitude_mean": self.amplitude.mean(),
+            "amplitude_hist": self.amplitude.counts[1:-1].tolist(),
+        }
+
+
+class DQMMonitor:
+
+    def __init__(self, output_dir=constants.DQM_PATH, nchan=7, thresholds=DEFAULT_THRESHOLDS):
+        self.output_dir = output_dir
+        self.nchan = nchan
+        self.thresholds = thresholds
+        self.history = deque(maxlen=HISTORY_ROWS)   # rows shown in the summary
+        self.reference_baseline = None
+        self.scan_amplitude = [RunningHistogram(AMPLITUDE_RANGE[0], AMPLITUDE_RANGE[1], AMPLITUDE_BINS)
+                               for _ in range(nchan)]
+        self._server = None
+        os.makedirs(output_dir, exist_ok=True)
+
+    def converted_file(self, run_number):
+        return "%s/converted_run%i.root" % (constants.CONVERTED_PATH, run_number)
+
+    def process_run(self, run_number, filepath=None, coordinates=None):
+        # streams one converted run, appends it to the summary and returns the
+        # list of flags (empty when the point is good)
+        import uproot as ur
+
+        filepath = filepath or self.converted_file(run_number)
+        start = time.time()
+        # channels that were not converted (conversion.py channel_map) are
+        # all zero, they get no monitor and no flags
+        converted = [True] * self.nchan
+        with ur.open(filepath) as f:
+            if "channel_map" in f:
+                mask = f["channel_map"]["converted"].array(library="np")[0]
+                converted = [ichan < len(mask) and bool(mask[ichan]) for ichan in range(self.nchan)]
+        monitors = [ChannelMonitor(self.thresholds) if converted[ichan] else None for ichan in range(self.nchan)]
+        n_events = 0
+        for chunk in ur.iterate("%s:pulse" % filepath, ["channel"], step_size=CHUNK_EVENTS, library="np"):
+            frames = chunk["channel"]
+            n_events += frames.shape[0]
+            for ichan in range(min(self.nchan, frames.shape[1])):
+                if monitors[ichan] is not None:
+                    monitors[ichan].update(frames[:, ichan, :])
+
+        channels = []
+        for ichan, monitor in enumerate(monitors):
+            if monitor is None:
+                channels.append(None)
+                continue
+            self.scan_amplitude[ichan].add(monitor.amplitude)
+            channels.append(monitor.summary())
+
+        flags = self.check(channels, n_events)
+        if self.reference_baseline is None and not flags:
+            self.reference_baseline = [ch and ch["baseline_mean"] for ch in channels]
+
+        self.history.append({
+            "run": run_number,
+            "time": time.strftime("%H:%M:%S"),
+            "coordinates": coordinates,
+            "events": n_events,
+            "channels": channels,
+            "flags": flags,
+            "dqm_seconds": time.time() - start,
+        })
+        self.write_summary()
+        return flags
+
+    def check(self, channels, n_events):
+        t = self.thresholds
+        flags = []
+        if n_events == 0:
+            return ["no events"]
+        for ichan, ch in enumerate(channels):
+            if ch is None:
+                continue
+            if ichan in t.hit_channels and ch["hit_rate"] < t.min_hit_rate:
+                flags.append("CH%i hit rate %.2f" % (ichan + 1, ch["hit_rate"]))
+            if ch["saturation"] > t.max_saturation:
+                flags.append("CH%i saturated %.2f" % (ichan + 1, ch["saturation"]))
+            if ch["baseline_rms"] > t.max_baseline_rms:
+                flags.append("CH%i baseline RMS %.1f mV" % (ichan + 1, 1000 * ch["baseline_rms"]))
+            if self.reference_baseline is not None and self.reference_baseline[ichan] is not None:
+                shift = ch["baseline_mean"] - self.reference_baseline[ichan]
+                if abs(shift) > t.max_baseline_shift:
+                    flags.append("CH%i baseline shift %.1f mV" % (ichan + 1, 1000 * shift))
+        return flags
+
+    def should_repeat(self, flags):
+        return bool(flags) and self.thresholds.action == "repeat"
+
+    def write_summary(self):
+        self._write_atomic("summary.json", json.dumps(list(self.history), indent=1))
+        self._write_atomic("summary.html", self.render_html())
+
+    def _write_atomic(self, name, text):
+        path = os.path.join(self.output_dir, name)
+        with open(path + ".tmp", "w") as f:
+            f.write(text)
+        os.replace(path + ".tmp", path)
+
+    def render_html(self, refresh_seconds=5):
+        head = "".join("<th>CH%i</th>" % (i + 1) for i in range(self.nchan))
+        rows = []
+        for entry in reversed(self.history):
+            cells = []
+            for ch in entry["channels"]:
+                if ch is None:
+                    cells.append("<td>-</td>")
+                    continue
+                cells.append("<td>%.0f%% | %.1f&plusmn;%.1f mV | sat %.0f%%</td>" % (
+                    100 * ch["hit_rate"], 1000 * ch["baseline_mean"], 1000 * ch["baseline_rms"],
+                    100 * ch["saturation"]))
+            style = ' class="bad"' if entry["flags"] else ""
+            rows.append("<tr%s><td>%i</td><td>%s</td><td>%s</td>%s<td>%s</td></tr>" % (
+                style, entry["run"], entry["time"], html.escape(str(entry["coordinates"] or "")),
+                "".join(cells), html.escape("; ".join(entry["flags"]))))
+
+        plots = []
+        for ichan, hist in enumerate(self.scan_amplitude):
+            plots.append("<div>CH%i %s</div>" % (ichan + 1, svg_histogram(hist.counts[1:-1])))
+        return """<html><head><meta http-equiv="refresh" content="%i"><title>FCFD DQM</title>
+<style>body{font-family:monospace} td,th{padding:2px 6px;border:1px solid #ccc} .bad{background:#f99}
+div{display:inline-block;margin:4px}</style></head><body>
+<h3>FCFD laser scan DQM &mdash; updated %s</h3>
+<p>hit rate | baseline mean&plusmn;RMS | saturated fraction</p>
+<table><tr><th>run</th><th>time</th><th>position</th>%s<th>flags</th></tr>%s</table>
+<h4>Scan amplitude histograms (0&ndash;%.1f V)</h4>%s
+</body></html>""" % (refresh_seconds, time.strftime("%Y-%m-%d %H:%M:%S"), head, "".join(rows),
+                     AMPLITUDE_RANGE[1], "".join(plots))
+
+    def serve(self, port=8000):
+        # serves the DQM folder on http://localhost:<port>/summary.html
+        import functools
+        from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+        handler = functools.partial(SimpleHTTPRequestHandler, directory=self.output_dir)
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        print("DQM summary at http://localhost:%i/summary.html" % port)
+
+    def close(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server = None
+
+
+def svg_histogram(counts, width=200, height=60):
+    counts = np.asarray(counts, dtype=np.float64)
+    if counts.max() <= 0:
+        return '<svg width="%i" height="%i"></svg>' % (width, height)
+    x = np.linspace(0, width, counts.size)
+    y = height - height * np.log1p(counts) / np.log1p(counts.max())
+    points = " ".join("%.1f,%.1f" % p for p in zip(x, y))
+    return '<svg width="%i" height="%i"><polyline fill="none" stroke="navy" points="%s"/></svg>' % (
+        width, height, points)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the DQM on already converted runs.')
+    parser.add_argument('--runs', metavar='runs', type=int, nargs='+', required=True, help='run numbers')
+    parser.add_argument('--serve', metavar='port', type=int, default=0, help='serve the summary on this port')
+    args = parser.parse_args()
+
+    dqm = DQMMonitor()
+    if args.serve:
+        dqm.serve(args.serve)
+    for run in args.runs:
+        flags = dqm.process_run(run)
+        print("Run %i: %s" % (run, "; ".join(flags) if flags else "ok"))
+    if args.serve:
+        input("Press enter to stop the DQM server.")
+        dqm.close()
@@ -0,0 +1,221 @@
+# edgefit.py
+# Batched error-function fits of strip edges and inter-pad gaps.
+#
+# The response map values[z, x, channel] (campaign.py, or plot_Csv.py grids)
+# is cut into one X profile per (Z, channel). Each profile is fitted with
+#
+#   edge: b + h/2 * (1 + erf((x - x1) / (sqrt2 w1)))
+#   box:  b + h/2 * (erf((x - x1) / (sqrt2 w1)) - erf((x - x2) / (sqrt2 w2)))
+#
+# with all profiles solved together: initial guesses from the 50% crossings
+# are computed with array operations and a Levenberg-Marquardt loop works on
+# the stacked (profiles, points, params) Jacobian with one batched linear
+# solve per iteration, so a whole campaign refits in a fraction of a second.
+# Errors come from the covariance scaled by chi2/ndf. gap_table() turns the
+# box fits of neighbouring pads into gap widths per Z.
+#
+#   powers, x, z, channels, values = campaign.campaign_arrays(range(1, 281))
+#   table = fit_map(x, z, channels, values[0].transpose(1, 0, 2), model="box")   # [x, z, ch] -> [z, x, ch]
+#   gaps = gap_table(table, pairs=[(1, 3), (3, 5)])
+
+import math
+
+import numpy as np
+
+
+SQRT2 = math.sqrt(2.)
+MODELS = {"edge": ["baseline", "height", "x1", "w1"],
+          "box": ["baseline", "height", "x1", "w1", "x2", "w2"]}
+MAX_ITERATIONS = 100
+MIN_WIDTH_FRACTION = 0.05       # of the X step, keeps widths away from 0
+
+
+def _erf(u):
+    from scipy.special import erf
+    return erf(u)
+
+
+def model_and_jacobian(model, x, p):
+    # x: (points,), p: (n, params) -> f (n, points), J (n, points, params)
+    x = x[None, :]
+    b, h = p[:, 0:1], p[:, 1:2]
+    x1, w1 = p[:, 2:3], p[:, 3:4]
+    u1 = (x - x1) / (SQRT2 * w1)
+    g1 = np.exp(-u1 ** 2) / math.sqrt(math.pi)      # d erf(u)/du / 2
+    if model == "edge":
+        s = 0.5 * (1 + _erf(u1))
+        f = b + h * s
+        J = np.stack([np.ones_like(f), s,
+                      -h * g1 / (SQRT2 * w1),
+                      -h * g1 * u1 / w1], axis=-1)
+        return f, J
+    x2, w2 = p[:, 4:5], p[:, 5:6]
+    u2 = (x - x2) / (SQRT2 * w2)
+    g2 = np.exp(-u2 ** 2) / math.sqrt(math.pi)
+    s = 0.5 * (_erf(u1) - _erf(u2))
+    f = b + h * s
+    J = np.stack([np.ones_like(f), s,
+                  -h * g1 / (SQRT2 * w1),
+                  -h * g1 * u1 / w1,
+                  h * g2 / (SQRT2 * w2),
+                  h * g2 * u2 / w2], axis=-1)
+    return f, J
+
+
+def initial_guess(model, x, y):
+    # vectorized start values for every profile (rows of y, NaN = missing)
+    n = y.shape[0]
+    step = np.median(np.diff(x)) if len(x) > 1 else 1.
+    low = np.nanpercentile(y, 10, axis=1)
+    high = np.nanpercentile(y, 90, axis=1)
+    height = high - low
+    frac = (y - low[:, None]) / np.where(height != 0, height, 1.)[:, None]
+    above = np.nan_to_num(frac, nan=0.) > 0.5
+    any_above = above.any(axis=1)
+    first = np.argmax(above, axis=1)
+    last = len(x) - 1 - np.argmax(above[:, ::-1], axis=1)
+    width = np.full(n, 2 * abs(step))
+    if model == "edge":
+        # a falling profile is a rising edge with negative height
+        rising = np.nanmean(y[:, len(x) // 2:], axis=1) >= np.nanmean(y[:, :len(x) // 2], axis=1)
+        x1 = np.where(any_above, np.where(rising, x[first], x[last]), x.mean())
+        b = np.where(rising, low, high)
+        h = np.where(rising, height, -height)
+        return np.column_stack([b, h, x1, width])
+    x1 = np.where(any_above, x[first] - 0.5 * step, x.min())
+    x2 = np.where(any_above, x[last] + 0.5 * step, x.max())
+    return np.column_stack([low, height, x1, width, x2, width])
+
+
+def fit_profiles(model, x, y, p0=None, max_iterations=MAX_ITERATIONS, tolerance=1e-8):
+    # Levenberg-Marquardt for all rows of y at once; returns params, errors,
+    # chi2/ndf and a converged flag per row
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    mask = np.isfinite(y)
+    y0 = np.where(mask, y, 0.)
+    p = initial_guess(model, x, y) if p0 is None else np.array(p0, dtype=np.float64)
+    n, npar = p.shape
+    min_width = MIN_WIDTH_FRACTION * abs(np.median(np.diff(x))) if len(x) > 1 else 1e-6
+    width_cols = [3] if model == "edge" else [3, 5]
+
+    def residual(params):
+        f, J = model_and_jacobian(model, x, params)
+        return (y0 - f) * mask, J * mask[..., None]
+
+    r, J = residual(p)
+    cost = (r ** 2).sum(axis=1)
+    lam = np.full(n, 1e-3)
+    converged = np.zeros(n, dtype=bool)
+    failed = np.zeros(n, dtype=bool)        # stuck without reaching the tolerance
+    eye = np.eye(npar)
+    for _ in range(max_iterations):
+        active = ~converged & ~failed
+        if not active.any():
+            break
+        JTJ = np.einsum("npi,npj->nij", J, J)
+        JTr = np.einsum("npi,np->ni", J, r)
+        A = JTJ + lam[:, None, None] * (JTJ * eye + 1e-12 * eye)
+        try:
+            step = np.linalg.solve(A, JTr[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.stack([np.linalg.lstsq(A[i], JTr[i], rcond=None)[0] for i in range(n)])
+        trial = p + np.where(active[:, None], step, 0.)
+        trial[:, width_cols] = np.maximum(np.abs(trial[:, width_cols]), min_width)
+        r_new, J_new = residual(trial)
+        cost_new = (r_new ** 2).sum(axis=1)
+        better = (cost_new < cost) & active
+        small = np.abs(cost - cost_new) <= tolerance * np.maximum(cost, 1e-30)
+        p = np.where(better[:, None], trial, p)
+        r = np.where(better[:, None], r_new, r)
+        J = np.where(better[:, None, None], J_new, J)
+        converged |= better & small
+        cost = np.where(better, cost_new, cost)
+        lam = np.where(better, lam / 3., lam * 4.)
+        failed |= ~converged & (lam > 1e10)     # no further improvement possible
+
+    ndf = np.maximum(mask.sum(axis=1) - npar, 1)
+    chi2 = cost / ndf
+    JTJ = np.einsum("npi,npj->nij", J, J)
+    cov = np.linalg.pinv(JTJ) * chi2[:, None, None]
+    errors = np.sqrt(np.abs(np.diagonal(cov, axis1=1, axis2=2)))
+    return p, errors, chi2, converged
+
+
+def fit_map(x, z, channels, values, model="box"):
+    # values[z, x, channel] -> one row per (z, channel) with params and errors
+    import pandas as pd
+    values = np.asarray(values, dtype=np.float64)
+    nz, nx, nch = values.shape
+    profiles = values.transpose(0, 2, 1).reshape(nz * nch, nx)
+    usable = np.isfinite(profiles).sum(axis=1) > len(MODELS[model])
+    p = np.full((nz * nch, len(MODELS[model])), np.nan)
+    e = np.full_like(p, np.nan)
+    chi2 = np.full(nz * nch, np.nan)
+    converged = np.zeros(nz * nch, dtype=bool)
+    if usable.any():
+        p[usable], e[usable], chi2[usable], converged[usable] = fit_profiles(model, x, profiles[usable])
+    table = pd.DataFrame({"z": np.repeat(z, nch), "channel": np.tile(channels, nz)})
+    for i, name in enumerate(MODELS[model]):
+        table[name] = p[:, i]
+        table[name + "_err"] = e[:, i]
+    table["chi2_ndf"] = chi2
+    table["converged"] = converged
+    return table
+
+
+def gap_table(table, pairs):
+    # gap between pad a (falling edge x2) and pad b (rising edge x1) per Z;
+    # negative gaps mean the responses overlap
+    import pandas as pd
+    rows = []
+    for a, b in pairs:
+        left = table[table["channel"] == a].set_index("z")
+        right = table[table["channel"] == b].set_index("z")
+        for z in left.index.intersection(right.index):
+            la, rb = left.loc[z], right.loc[z]
+            # order the pads along X
+            if la["x1"] > rb["x1"]:
+                la, rb = rb, la
+            rows.append({
+                "z": z, "pair": "CH%i-CH%i" % (a + 1, b + 1),
+                "gap": rb["x1"] - la["x2"],
+                "gap_err": math.hypot(rb["x1_err"], la["x2_err"]),
+                "mean_width": 0.5 * (la["w2"] + rb["w1"]),
+            })
+    return pd.DataFrame(rows)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    parser = argparse.ArgumentParser(description='Fit edges/pads of every channel and Z plane of a response map.')
+    parser.add_argument('--npz', type=str, default=None, help='campaign.py --output file')
+    parser.add_argument('--first', type=int, default=None, help='or build the map from runs first..last')
+    parser.add_argument('--last', type=int, default=None)
+    parser.add_argument('--value', type=str, default='plateau_mean')
+    parser.add_argument('--power', type=int, default=0, help='power slice of the campaign')
+    parser.add_argument('--model', type=str, default='box', choices=list(MODELS))
+    parser.add_argument('--gaps', type=str, nargs='*', default=[], help='channel index pairs a-b for the gap table')
+    parser.add_argument('--output', type=str, default=None, help='CSV with the fit table')
+    args = parser.parse_args()
+
+    if args.npz:
+        data = np.load(args.npz)
+        x, z, channels, values = data["x"], data["z"], data["channels"], data["values"]
+    else:
+        import campaign
+        _, x, z, channels, values = campaign.campaign_arrays(range(args.first, args.last + 1), args.value)
+    # campaign arrays are [power, x, z, channel]
+    values = values[args.power].transpose(1, 0, 2)
+
+    start = time.time()
+    table = fit_map(x, z, channels, values, args.model)
+    print("%i profiles fitted in %0.1f ms, %i converged" % (len(table), 1000 * (time.time() - start), table["converged"].sum()))
+    print(table.to_string(index=False, float_format=lambda v: "%.3f" % v))
+    if args.gaps:
+        pairs = [tuple(int(c) for c in g.split("-")) for g in args.gaps]
+        print(gap_table(table, pairs).to_string(index=False, float_format=lambda v: "%.3f" % v))
+    if args.output:
+        table.to_csv(args.output, index=False)
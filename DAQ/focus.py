@@ -0,0 +1,164 @@
+# focus.py
+# Automated laser focus search along Z.
+#
+# At a candidate Z the stage does a short X scan across a strip edge, taking a
+# scope-side measurement run (acquisition.py --measureOnly) at every point.
+# The mean amplitude vs X is fitted with an error function, whose width is the
+# laser spot size at that Z. A golden-section search on Z minimizes the width,
+# so the focus is found in about ten short edge scans instead of full 70-point
+# X scans on a grid of Z planes. Every edge scan is appended to focus_scan.csv.
+#
+#   python focus.py --zMin 84750 --zMax 86000 --xCenter 46000 --xHalfWidth 60 --xPoints 13
+
+import math
+import os
+import time
+
+import numpy as np
+
+import constants
+
+
+GOLDEN = (math.sqrt(5) - 1) / 2
+FOCUS_LOG = constants.BASE_PATH + "/focus_scan.csv"
+
+
+def erf_edge(x, baseline, height, x0, width):
+    # step of the given height at x0, smeared by a Gaussian spot of sigma = width
+    from scipy.special import erf
+    return baseline + 0.5 * height * (1 + erf((x - x0) / (math.sqrt(2) * width)))
+
+
+def fit_edge(x, y):
+    # (baseline, height, x0, width) and their errors; a falling edge has height < 0
+    from scipy.optimize import curve_fit
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    order = np.argsort(x)
+    x, y = x[order], y[order]
+    n_side = max(1, len(x) // 4)
+    low, high = y[:n_side].mean(), y[-n_side:].mean()
+    # initial edge position and 10-90% width from the crossings of the data
+    frac = (y - low) / (high - low) if high != low else np.full_like(y, 0.5)
+    x0 = x[np.argmin(np.abs(frac - 0.5))]
+    x10, x90 = x[np.argmin(np.abs(frac - 0.1))], x[np.argmin(np.abs(frac - 0.9))]
+    width = max(abs(x90 - x10) / 2.563, np.min(np.diff(x)) if len(x) > 1 else 1.)
+    params, cov = curve_fit(erf_edge, x, y, p0=[low, high - low, x0, width], maxfev=5000)
+    params[3] = abs(params[3])
+    return params, np.sqrt(np.diag(cov))
+
+
+def measure_point(run, n_events, channel, parameter, status="focus"):
+    # one measurement-only acquisition, recorded with this catalog status;
+    # returns the mean of the parameter
+    import acquisition
+    from runcatalog import RunCatalog
+    acquisition.main(["--measureOnly", "1", "--runNumber", str(run), "--numEvents", str(n_events),
+                      "--measureChannels", str(channel), "--measureParams", parameter,
+                      "--runStatus", status])
+    with RunCatalog() as catalog:
+        rows = [r for r in catalog.measurements(first=run, last=run, parameter=parameter)
+                if r["channel"] == channel]
+    return rows[0]["mean"] if rows else np.nan
+
+
+class FocusSearch:
+
+    def __init__(self, motor, x_center, x_half_width, x_points=13, channel=6, parameter="Amplitude",
+                 n_events=200, log_path=FOCUS_LOG):
+        self.motor = motor
+        self.x = np.linspace(x_center - x_half_width, x_center + x_half_width, x_points)
+        self.channel = channel
+        self.parameter = parameter
+        self.n_events = n_events
+        self.log_path = log_path
+        self.history = []           # (z, width, width_err, x0)
+        self._forward = True
+
+    def edge_scan(self, z):
+        # X scan at this Z, alternating direction to avoid the return travel
+        import acquisition
+        from runcatalog import RunCatalog
+        self.motor.move_XYZ(Z=z)
+        points = self.x if self._forward else self.x[::-1]
+        self._forward = not self._forward
+        values = []
+        with RunCatalog() as catalog:
+            for x in points:
+                self.motor.move_XYZ(X=x)
+                run = acquisition.GetNextNumber()
+                catalog.record_run(run, x=x, z=z, status="focus")
+                values.append(measure_point(run, self.n_events, self.channel, self.parameter))
+        return points, np.asarray(values)
+
+    def spot_width(self, z):
+        start = time.time()
+        x, y = self.edge_scan(z)
+        good = np.isfinite(y)
+        try:
+            params, errors = fit_edge(x[good], y[good])
+            width, width_err, x0 = params[3], errors[3], params[2]
+        except (RuntimeError, ValueError, TypeError) as e:
+            print("Z = %.1f um: edge fit failed (%s)" % (z, e))
+            width, width_err, x0 = np.inf, np.nan, np.nan
+        self.history.append((z, width, width_err, x0))
+        print("Z = %.1f um: spot width %.2f +- %.2f um, edge at X = %.1f um (%.0f s)"
+              % (z, width, width_err, x0, time.time() - start))
+        self._log(z, x, y, width, width_err, x0)
+        return width
+
+    def _log(self, z, x, y, width, width_err, x0):
+        new = not os.path.exists(self.log_path)
+        with open(self.log_path, "a") as f:
+            if new:
+                f.write("time,z,width,width_err,x0,x_values,y_values\n")
+            f.write("%f,%f,%f,%f,%f,%s,%s\n" % (time.time(), z, width, width_err, x0,
+                                                " ".join("%g" % v for v in x), " ".join("%g" % v for v in y)))
+
+    def search(self, z_min, z_max, tolerance=20., max_scans=12):
+        # golden-section search for the Z of minimal spot width
+        a, b = float(z_min), float(z_max)
+        c, d = b - GOLDEN * (b - a), a + GOLDEN * (b - a)
+        fc, fd = self.spot_width(c), self.spot_width(d)
+        scans = 2
+        while b - a > tolerance and scans < max_scans:
+            if fc < fd:
+                b, d, fd = d, c, fc
+                c = b - GOLDEN * (b - a)
+                fc = self.spot_width(c)
+            else:
+                a, c, fc = c, d, fd
+                d = a + GOLDEN * (b - a)
+                fd = self.spot_width(d)
+            scans += 1
+        best = min(self.history, key=lambda h: h[1])
+        return best[0], best[1], scans
+
+
+if __name__ == "__main__":
+    import argparse
+    from motortools import Motor
+
+    parser = argparse.ArgumentParser(description='Find the laser focus (Z of minimal spot width) with edge scans.')
+    parser.add_argument('--zMin', type=float, required=True, help='lower end of the Z search range [um]')
+    parser.add_argument('--zMax', type=float, required=True, help='upper end of the Z search range [um]')
+    parser.add_argument('--xCenter', type=float, required=True, help='approximate X of the strip edge [um]')
+    parser.add_argument('--xHalfWidth', type=float, default=50., help='X scan half range around the edge [um]')
+    parser.add_argument('--xPoints', type=int, default=13, help='points per edge scan')
+    parser.add_argument('--channel', type=int, default=6, help='scope channel measured (C6: analog 3)')
+    parser.add_argument('--parameter', type=str, default='Amplitude', help='scope measurement parameter')
+    parser.add_argument('--events', type=int, default=200, help='segments per point')
+    parser.add_argument('--tolerance', type=float, default=20., help='stop when the Z bracket is this small [um]')
+    parser.add_argument('--maxScans', type=int, default=12)
+    args = parser.parse_args()
+
+    m = Motor()
+    m.initialize_devices()
+    try:
+        focus = FocusSearch(m, args.xCenter, args.xHalfWidth, args.xPoints, args.channel,
+                            args.parameter, args.events)
+        z_best, width, scans = focus.search(args.zMin, args.zMax, args.tolerance, args.maxScans)
+        print("\nFocus at Z = %.1f um, spot width %.2f um after %i edge scans." % (z_best, width, scans))
+        m.move_XYZ(X=args.xCenter, Z=z_best)
+    finally:
+        m.close_devices()
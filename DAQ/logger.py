@@ -1,37 +1,121 @@
 # logger.py
+# Session log of the scan.
+#
+# logger.info() only puts the record on a queue (QueueHandler); a background
+# QueueListener thread formats it and does the file and console I/O, so log
+# calls in the motor and trigger loop never wait for the disk or terminal.
+#
+# The first process of a session picks the log file and exports it in
+# FCFD_LOG_SESSION; every process started from it (acquisition, conversion,
+# DQM, ...) appends to the same file instead of opening its own. Records carry
+# the fields run, stage and coordinates, set per process with set_context() or
+# per call with extra={...}:
+#
+#   from logger import logger, set_context
+#   set_context(run=12, stage="acquisition", coordinates=(46000, 35000, 85250))
+#   logger.info("sequence saved")
+#   logger.info("moved", extra={"stage": "motor"})
+
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import random
+import sys
 from datetime import datetime
 
 
+SESSION_ENV = "FCFD_LOG_SESSION"
+FIELDS = ("run", "stage", "coordinates")
+FORMAT = '%(asctime)s - %(levelname)s - %(process)d %(stage)s run=%(run)s pos=%(coordinates)s - %(message)s'
+
+_context = {"run": "-", "stage": os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0] or "python",
+            "coordinates": "-"}
+
+
+class _LazyFileHandler(logging.FileHandler):
+    # creates the log folder and file on the first record instead of on import,
+    # so tools that never log (e.g. --help) leave no empty log files behind;
+    # append mode, several processes write to the same session file
+
+    def __init__(self, log_path):
+        super().__init__(log_path, mode="a", delay=True)
+
+    def _open(self):
+        os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        return super()._open()
+
+
+class _ContextFilter(logging.Filter):
+    # fills run/stage/coordinates from the process context unless given in extra
+
+    def filter(self, record):
+        for field in FIELDS:
+            if not hasattr(record, field):
+                setattr(record, field, _context[field])
+        return True
+
+
+class _FastQueueHandler(logging.handlers.QueueHandler):
+    # the listener runs in this process, so the record is queued as it is;
+    # only the message is resolved now, formatting happens in the writer thread
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+def set_context(**fields):
+    # e.g. set_context(run=12, coordinates=(x, y, z)); None resets a field
+    for field, value in fields.items():
+        if field not in FIELDS:
+            raise ValueError("Unknown log field: %s" % field)
+        if field == "coordinates" and isinstance(value, (tuple, list)):
+            value = "(%s)" % ",".join("%g" % v for v in value)
+        _context[field] = "-" if value is None else value
+
+
+def session_log_path(log_dir):
+    # the session file of the parent process, or a new one exported to children
+    path = os.environ.get(SESSION_ENV)
+    if not path:
+        fingerprint = '%08x' % random.randrange(16**8)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(log_dir, f"log_{timestamp}_{fingerprint}.txt")
+        os.environ[SESSION_ENV] = path
+    return path
+
+
 def setup_logger(log_path):
     logger = logging.getLogger('logger')
     logger.setLevel(logging.INFO)
+    logger.propagate = False
 
-    file_handler = logging.FileHandler(log_path)
+    formatter = logging.Formatter(FORMAT)
+    file_handler = _LazyFileHandler(log_path)
     file_handler.setLevel(logging.INFO)
-
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
     file_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
-
-    return logger
 
-LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
-os.makedirs(LOG_DIR, exist_ok=True)
-fingerprint = '%08x' % random.randrange(16**8)
-timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    # unbounded, a burst of records never blocks the caller
+    records = queue.SimpleQueue()
+    queue_handler = _FastQueueHandler(records)
+    queue_handler.addFilter(_ContextFilter())
+    logger.addHandler(queue_handler)
 
-# Log file name
-log_filename = f"log_{timestamp}_{fingerprint}.txt"
+    listener = logging.handlers.QueueListener(records, file_handler, console_handler,
+                                              respect_handler_level=True)
+    listener.start()
+    # drains the queue before the interpreter exits
+    atexit.register(listener.stop)
+    return logger
 
 
-log_path = os.path.join(LOG_DIR, log_filename)
+LOG_DIR = os.path.join(os.path.dirname(__file__), "logs")
+log_path = session_log_path(LOG_DIR)
 logger = setup_logger(log_path)
@@ -1,23 +1,48 @@
 # motortools.py
 
-import libximc.highlevel as ximc
 import time
 
 from logger import logger
 import constants
 
+MOTOR_LOG = {"stage": "motor"}   # structured log field of every motor record
+
 # Motor setup and control
 
+class CachedPosition:
+    # same attribute as libximc's get_position_calb() result
+    __slots__ = ("Position",)
+
+    def __init__(self, position):
+        self.Position = position
+
+    def __repr__(self):
+        return "CachedPosition(%r)" % self.Position
+
+
 class Motor:
+    # Positions are cached per axis. A commanded move updates the cached value
+    # right away and marks the axis stale; the next get_calb() reads only the
+    # stale axes back from their controllers (in parallel, one serial port
+    # each), so a scan point that moved X costs one position read instead of
+    # three, and an axis that did not move is never polled.
+
+    AXES = "XYZ"
 
     def __init__(self,
                  Motor_X = r"xi-com:///dev/ttyACM2",  # assigned the motor axes
                  Motor_Y = r"xi-com:///dev/ttyACM0",
                  Motor_Z = r"xi-com:///dev/ttyACM1",
                  ):
+        # libximc is only needed once a controller is actually opened
+        import libximc.highlevel as ximc
         self.axis_x = ximc.Axis(Motor_X)   
         self.axis_y = ximc.Axis(Motor_Y)
         self.axis_z = ximc.Axis(Motor_Z)
+        self._axes = {"X": self.axis_x, "Y": self.axis_y, "Z": self.axis_z}
+        self._position = {"X": None, "Y": None, "Z": None}
+        self._stale = set(self.AXES)
+        self._reader = None
 
     def initialize_devices(self, step_to_um_conversion_coeff = 2.5):
         self.axis_x.open_device()
@@ -32,60 +57,94 @@ class Motor:
         self.axis_y.set_calb(step_to_um_conversion_coeff, engine_settings_y.MicrostepMode)
         self.axis_z.set_calb(step_to_um_conversion_coeff, engine_settings_z.MicrostepMode)
 
-        logger.info(f"Initializing Motor")
+        self.refresh()
+        logger.info(f"Initializing Motor", extra=MOTOR_LOG)
 
     def close_devices(self):
         print("Stop movement")
         self.axis_x.command_stop()
         self.axis_y.command_stop()
         self.axis_z.command_stop()
+        self._stale = set(self.AXES)
 
         print("Disconnect device")
         self.axis_x.close_device()  # It's also called automatically by the garbage collector, so explicit closing is optional
         self.axis_y.close_device()
         self.axis_z.close_device()
-    
-    def get_calb(self):
-        position_calb_x = self.axis_x.get_position_calb()
-        position_calb_y = self.axis_y.get_position_calb()
-        position_calb_z = self.axis_z.get_position_calb()
-
-        return position_calb_x, position_calb_y, position_calb_z
+        if self._reader is not None:
+            self._reader.shutdown()
+            self._reader = None
+
+    def refresh(self, axes=None):
+        # reads the given axes (default: the stale ones) from the controllers
+        axes = [a for a in self.AXES if a in (self._stale if axes is None else axes.upper())]
+        if len(axes) > 1:
+            if self._reader is None:
+                from concurrent.futures import ThreadPoolExecutor
+                self._reader = ThreadPoolExecutor(max_workers=len(self.AXES))
+            values = list(self._reader.map(lambda a: self._axes[a].get_position_calb().Position, axes))
+        else:
+            values = [self._axes[a].get_position_calb().Position for a in axes]
+        for a, value in zip(axes, values):
+            self._position[a] = value
+            self._stale.discard(a)
+
+    def invalidate(self, axes=None):
+        # forget the cached positions, e.g. after moving the stages by hand
+        self._stale.update(self.AXES if axes is None else axes.upper())
+
+    def _moved(self, axis, target=None, delta=None):
+        # cached position after a completed move, confirmed on the next read
+        if target is not None:
+            self._position[axis] = target
+        elif self._position[axis] is not None:
+            self._position[axis] += delta
+        self._stale.add(axis)
+
+    def get_calb(self, refresh=False):
+        # (X, Y, Z) objects with .Position in um; only stale axes are read
+        self.refresh(self.AXES if refresh else None)
+        return tuple(CachedPosition(self._position[a]) for a in self.AXES)
 
     def log_state(self):
         posx, posy, posz = self.get_calb()
         logger.info(f"Motor State - X: {posx.Position} um, "
                      f"Y: {posy.Position} um, "
-                     f"Z: {posz.Position} um")
+                     f"Z: {posz.Position} um", extra=MOTOR_LOG)
 
     def move_XYZ_R(self, dX=0, dY=0, dZ=0, wait_time=100, verbose=False):
         if dX: # Note 0 is False
-            logger.info(f"move_rel axis=X dX={dX}um wait={wait_time}")
+            logger.info(f"move_rel axis=X dX={dX}um wait={wait_time}", extra=MOTOR_LOG)
             self.axis_x.command_movr_calb(dX)
             if verbose: print(f"Moving X by {dX} um")
             self.axis_x.command_wait_for_stop(wait_time)
+            self._moved("X", delta=dX)
         if dY: # Note 0 is False
-            logger.info(f"move_rel axis=Y dY={dY}um wait={wait_time}")
+            logger.info(f"move_rel axis=Y dY={dY}um wait={wait_time}", extra=MOTOR_LOG)
             self.axis_y.command_movr_calb(dY)
             if verbose: print(f"Moving Y by {dY} um")
             self.axis_y.command_wait_for_stop(wait_time)
+            self._moved("Y", delta=dY)
         if dZ: # Note 0 is False
-            logger.info(f"move_rel axis=Z dZ={dZ}um wait={wait_time}")
+            logger.info(f"move_rel axis=Z dZ={dZ}um wait={wait_time}", extra=MOTOR_LOG)
             self.axis_z.command_movr_calb(dZ)
             if verbose: print(f"Moving Z by {dZ} um")
             self.axis_z.command_wait_for_stop(wait_time)
+            self._moved("Z", delta=dZ)
     
     def move_home(self, X=constants.HOME_COORDINATE[0], 
                   Y=constants.HOME_COORDINATE[1], wait_time=100, 
                   verbose=False):
         self.axis_x.command_move_calb(X)
         self.axis_x.command_wait_for_stop(wait_time)
+        self._moved("X", target=X)
         self.axis_y.command_move_calb(Y)
         self.axis_y.command_wait_for_stop(wait_time)
+        self._moved("Y", target=Y)
 
         posx, posy, posz = self.get_calb()
-        logger.info("Motor moved to home.")
-        logger.info(f"new_position X={posx.Position}um Y={posy.Position}um Z={posz.Position}um")
+        logger.info("Motor moved to home.", extra=MOTOR_LOG)
+        logger.info(f"new_position X={posx.Position}um Y={posy.Position}um Z={posz.Position}um", extra=MOTOR_LOG)
 
     def move_XYZ(self, X=0, Y=0, Z=0, wait_time=100, verbose=False):
 
@@ -93,14 +152,17 @@ class Motor:
             self.axis_x.command_move_calb(X)
             if verbose: print(f"Moving X to {X} um")
             self.axis_x.command_wait_for_stop(wait_time)
+            self._moved("X", target=X)
         if Y: # Note 0 is False
             self.axis_y.command_move_calb(Y)
             if verbose: print(f"Moving Y to {X} um")
             self.axis_y.command_wait_for_stop(wait_time)
+            self._moved("Y", target=Y)
         if Z: # Note 0 is False
             self.axis_z.command_move_calb(Z)
             if verbose: print(f"Moving Z to {X} um")
             self.axis_z.command_wait_for_stop(wait_time)
+            self._moved("Z", target=Z)
 
 
     def a_scan(self, wait_time=100, step_in_um = 0, Num_of_steps = 0, verbose=False):
@@ -110,14 +172,17 @@ class Motor:
                 self.axis_x.command_movr_calb(step_in_um)
                 if verbose: print(f"Moving X by {step_in_um} um")
                 self.axis_x.command_wait_for_stop(wait_time)
+                self._moved("X", delta=step_in_um)
             if current_axis == 'Y': # Note 0 is False
                 self.axis_y.command_movr_calb(step_in_um)
                 if verbose: print(f"Moving Y by {step_in_um} um")
                 self.axis_y.command_wait_for_stop(wait_time)
+                self._moved("Y", delta=step_in_um)
             if current_axis == 'Z': # Note 0 is False
                 self.axis_z.command_movr_calb(step_in_um)
                 if verbose: print(f"Moving Z by {step_in_um} um")
                 self.axis_z.command_wait_for_stop(wait_time)
+                self._moved("Z", delta=step_in_um)
             Num_of_steps = Num_of_steps - 1
 
 
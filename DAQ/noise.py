@@ -0,0 +1,209 @@
+# noise.py
+# Vectorized noise characterization of converted runs.
+#
+# baseline_spectra() averages the power spectrum of the baseline window over
+# all events of a channel, dominant_frequencies() picks the pickup lines out of
+# it, and fit_harmonics()/remove_harmonics() replace DatAnalyzer's per-event
+# "HNR" TF1 fit ([0]+[1]*sin([2]+[3]*x)): at a known frequency the model
+# c + a*sin(wt) + b*cos(wt) is linear, so every event is solved at once with
+# a batched least-squares (pseudo-inverse) solve instead of a nonlinear fit
+# per event. Frequencies below MIN_CYCLES periods per baseline window cannot
+# be told apart from the constant and are rejected.
+#
+#   python noise.py converted_run12.root --channels 1 3 5
+#
+#   t, frames = load_channel("converted_run12.root", 3)
+#   freqs, psd = baseline_spectra(t, frames)
+#   peaks = dominant_frequencies(freqs, psd)
+#   clean = remove_harmonics(t, frames, peaks[:1, 0])
+
+import warnings
+
+import numpy as np
+
+
+BASELINE_SAMPLES = 100
+CHUNK_EVENTS = 500
+DEFAULT_PEAKS = 5
+MIN_PEAK_RATIO = 10.    # peak power over the median of the spectrum
+MIN_CYCLES = 1.         # lowest fitted frequency, in periods per baseline window
+MAX_CONDITION = 1e8     # warn above this condition number of the design matrix
+
+
+def load_channel(filepath, ichan, events=None):
+    # sample times (events, points) and volts (events, points) of one channel
+    import uproot as ur
+    entry_start, entry_stop = (None, None) if events is None else (events.start, events.stop)
+    with ur.open(filepath) as f:
+        data = f["pulse"].arrays(["time", "channel"], entry_start=entry_start,
+                                 entry_stop=entry_stop, library="np")
+    return data["time"][:, 0, :].astype(np.float64), data["channel"][:, ichan, :].astype(np.float64)
+
+
+def converted_channels(filepath):
+    # indexes of channel[] that hold data (conversion.py channel_map)
+    import uproot as ur
+    with ur.open(filepath) as f:
+        nslots = f["pulse"]["channel"].array(entry_stop=1, library="np").shape[1]
+        if "channel_map" not in f:
+            return list(range(nslots))
+        converted = f["channel_map"]["converted"].array(library="np")[0]
+    return [k for k in range(nslots) if converted[k]]
+
+
+def min_frequency(t, baseline=(0, BASELINE_SAMPLES), cycles=MIN_CYCLES):
+    # lowest frequency with `cycles` periods inside the baseline window
+    return cycles / ((baseline[1] - baseline[0]) * sample_interval(t))
+
+
+def sample_interval(t):
+    t = np.atleast_2d(t)
+    return float(np.median(np.diff(t[0])))
+
+
+def baseline_spectra(t, frames, baseline=(0, BASELINE_SAMPLES), n_fft=None):
+    # one-sided power spectral density [V^2/Hz] of the baseline window,
+    # averaged over events; n_fft > window length zero-pads for a finer grid
+    window = np.asarray(frames)[:, baseline[0]:baseline[1]]
+    n = window.shape[1]
+    n_fft = n_fft or n
+    dt = sample_interval(t)
+    taper = np.hanning(n)
+    centered = (window - window.mean(axis=1, keepdims=True)) * taper
+    spectrum = np.fft.rfft(centered, n=n_fft, axis=1)
+    psd = (np.abs(spectrum) ** 2).mean(axis=0) * 2 * dt / (taper ** 2).sum()
+    psd[0] /= 2
+    return np.fft.rfftfreq(n_fft, dt), psd
+
+
+def run_spectra(filepath, channels, baseline=(0, BASELINE_SAMPLES), n_fft=None, chunk_events=CHUNK_EVENTS):
+    # averaged spectra of several channels of a run, streamed in chunks;
+    # returns freqs and {channel: psd}
+    import uproot as ur
+    sums = {}
+    n_events = 0
+    freqs = None
+    for chunk in ur.iterate("%s:pulse" % filepath, ["time", "channel"], step_size=chunk_events, library="np"):
+        t = chunk["time"][:, 0, :]
+        n = len(t)
+        for ichan in channels:
+            freqs, psd = baseline_spectra(t, chunk["channel"][:, ichan, :], baseline, n_fft)
+            sums[ichan] = sums.get(ichan, 0.) + psd * n
+        n_events += n
+    return freqs, {ichan: s / max(n_events, 1) for ichan, s in sums.items()}
+
+
+def dominant_frequencies(freqs, psd, n_peaks=DEFAULT_PEAKS, min_ratio=MIN_PEAK_RATIO, f_min=0.):
+    # local maxima standing min_ratio above the median power, strongest first,
+    # with the frequency refined by a parabola through the three top bins;
+    # peaks below f_min (see min_frequency) are skipped.
+    # Returns (n, 2) rows of (frequency [Hz], power [V^2/Hz])
+    psd = np.asarray(psd)
+    floor = np.median(psd[1:])
+    inner = np.arange(1, psd.size - 1)     # DC is never a pickup line
+    is_peak = (psd[inner] > psd[inner - 1]) & (psd[inner] >= psd[inner + 1]) & (psd[inner] > min_ratio * floor)
+    is_peak &= np.asarray(freqs)[inner] >= f_min
+    idx = inner[is_peak]
+    idx = idx[np.argsort(psd[idx])[::-1]][:n_peaks]
+    if idx.size == 0:
+        return np.zeros((0, 2))
+    left, mid, right = np.log(psd[idx - 1]), np.log(psd[idx]), np.log(psd[idx + 1])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        shift = 0.5 * (left - right) / (left - 2 * mid + right)
+    shift = np.where(np.isfinite(shift), np.clip(shift, -0.5, 0.5), 0.)
+    df = freqs[1] - freqs[0]
+    return np.column_stack([freqs[idx] + shift * df, psd[idx]])
+
+
+def _design(t, frequencies):
+    # (events, points, 1 + 2*nf): constant, then sin/cos per frequency
+    t = np.asarray(t, dtype=np.float64)
+    phase = 2 * np.pi * t[..., None] * np.asarray(frequencies, dtype=np.float64)
+    columns = [np.ones(t.shape + (1,)), np.sin(phase), np.cos(phase)]
+    return np.concatenate(columns, axis=-1)
+
+
+def fit_harmonics(t, frames, frequencies, baseline=(0, BASELINE_SAMPLES)):
+    # linear least squares of c + sum(a_k sin + b_k cos) on the baseline
+    # window of every event; t is (points,) or (events, points).
+    # Returns coefficients (events, 1 + 2*nf): c, a_1..a_nf, b_1..b_nf.
+    # Raises ValueError for frequencies below min_frequency(); nearly
+    # degenerate sets (e.g. two lines closer than 1/window) give a warning
+    # and the minimum-norm solution instead of blowing up.
+    frames = np.asarray(frames, dtype=np.float64)
+    t = np.broadcast_to(np.asarray(t, dtype=np.float64), frames.shape)
+    frequencies = np.atleast_1d(np.asarray(frequencies, dtype=np.float64))
+    f_min = min_frequency(t, baseline)
+    if np.any(np.abs(frequencies) < f_min):
+        raise ValueError("Frequencies %s below %.3g Hz, less than %g period(s) in the %i-sample baseline"
+                         % (frequencies[np.abs(frequencies) < f_min], f_min, MIN_CYCLES, baseline[1] - baseline[0]))
+    sl = slice(baseline[0], baseline[1])
+    X = _design(t[:, sl], frequencies)
+    y = frames[:, sl]
+    condition = np.linalg.cond(X)
+    if np.any(condition > MAX_CONDITION):
+        warnings.warn("Harmonic fit is ill-conditioned (condition number up to %.3g) for %s Hz"
+                      % (condition.max(), frequencies))
+    return np.einsum("eij,ej->ei", np.linalg.pinv(X), y)
+
+
+def harmonic_amplitudes(coefficients):
+    # amplitude and phase per frequency of the fitted sin/cos pairs,
+    # same convention as DatAnalyzer's A*sin(phi0 + w t)
+    nf = (coefficients.shape[1] - 1) // 2
+    a = coefficients[:, 1:1 + nf]
+    b = coefficients[:, 1 + nf:]
+    return np.hypot(a, b), np.arctan2(b, a)
+
+
+def remove_harmonics(t, frames, frequencies, baseline=(0, BASELINE_SAMPLES), subtract_constant=True):
+    # frames minus the harmonic model fitted on the baseline, evaluated over
+    # the whole frame (and minus the constant, as DatAnalyzer's HNR does)
+    frames = np.asarray(frames, dtype=np.float64)
+    t = np.broadcast_to(np.asarray(t, dtype=np.float64), frames.shape)
+    coefficients = fit_harmonics(t, frames, frequencies, baseline)
+    if not subtract_constant:
+        coefficients = coefficients.copy()
+        coefficients[:, 0] = 0.
+    model = np.einsum("epi,ei->ep", _design(t, np.atleast_1d(frequencies)), coefficients)
+    return frames - model
+
+
+def baseline_rms(frames, baseline=(0, BASELINE_SAMPLES)):
+    return np.asarray(frames)[:, baseline[0]:baseline[1]].std(axis=1)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Baseline noise spectra and harmonic pickup of a converted run.')
+    parser.add_argument('file', type=str, help='converted_run{N}.root')
+    parser.add_argument('--channels', type=int, nargs='+', default=None, help='indexes of channel[] (default: the converted ones)')
+    parser.add_argument('--baseline', type=int, nargs=2, default=[0, BASELINE_SAMPLES], help='baseline window [first, last) sample')
+    parser.add_argument('--nfft', type=int, default=None, help='zero-padded FFT length')
+    parser.add_argument('--peaks', type=int, default=DEFAULT_PEAKS)
+    parser.add_argument('--plot', action='store_true')
+    args = parser.parse_args()
+
+    channels = args.channels if args.channels is not None else converted_channels(args.file)
+    freqs, spectra = run_spectra(args.file, channels, tuple(args.baseline), args.nfft)
+    for ichan, psd in spectra.items():
+        t, frames = load_channel(args.file, ichan)
+        peaks = dominant_frequencies(freqs, psd, args.peaks, f_min=min_frequency(t, args.baseline))
+        before = baseline_rms(frames, args.baseline).mean()
+        line = "CH%i: noise %.2f mV" % (ichan + 1, 1000 * before)
+        if len(peaks):
+            clean = remove_harmonics(t, frames, peaks[:, 0], args.baseline)
+            line += " -> %.2f mV after removing" % (1000 * baseline_rms(clean, args.baseline).mean())
+            line += ", ".join(" %.1f MHz" % (f / 1e6) for f in peaks[:, 0])
+        print(line)
+
+    if args.plot:
+        import matplotlib.pyplot as plt
+        for ichan, psd in spectra.items():
+            plt.semilogy(freqs / 1e6, psd, label="CH%i" % (ichan + 1))
+        plt.xlabel("Frequency [MHz]")
+        plt.ylabel("PSD [V$^2$/Hz]")
+        plt.legend()
+        plt.grid(True)
+        plt.show()
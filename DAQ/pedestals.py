@@ -0,0 +1,195 @@
+# pedestals.py
+# Per-channel pedestal (baseline) calibration kept across runs.
+#
+# conversion.py feeds the baseline window of every event into a
+# PedestalAccumulator while it converts, so the pedestals of a run cost no
+# extra pass over the data. Mean and RMS are merged event by event with the
+# parallel-variance update (count/mean/M2, as dqm.RunningMoments), and
+# "noise" is the mean RMS inside one event, without the event-to-event drift.
+# The results go into the pedestals table of the run catalog, keyed by run,
+# sequence and scope channel.
+#
+# Downstream analyses take smoothed values from the neighbouring runs instead
+# of estimating the baseline themselves:
+#
+#   peds = smoothed_pedestals(run)        # {channel: {"mean", "rms", "noise", ...}}
+#   cuts = thresholds(run, nsigma=5)      # {channel: volts} hit cut above the event baseline
+#
+#   python pedestals.py --first 1 --last 280          # backfill from converted files
+#   python pedestals.py --run 120 --nsigma 5          # show smoothed pedestals/thresholds
+
+import math
+
+import numpy as np
+
+import constants
+
+
+BASELINE_SAMPLES = 100      # same window as dqm.py and runsummary.py
+CHUNK_EVENTS = 200
+SMOOTHING_RUNS = 5          # runs on each side used for the smoothed pedestal
+SMOOTHING_SECONDS = 3600.   # time constant of the weights
+DEFAULT_NSIGMA = 5.
+
+
+class PedestalAccumulator:
+    # streaming baseline statistics of all channels of one run
+
+    def __init__(self, channels):
+        self.channels = list(channels)
+        nchan = len(self.channels)
+        self.n = np.zeros(nchan)
+        self.mean = np.zeros(nchan)
+        self.m2 = np.zeros(nchan)
+        self.noise_sum = np.zeros(nchan)
+        self.events = 0
+
+    def update(self, frames, baseline_samples=BASELINE_SAMPLES):
+        # frames: (nchan, points) or (events, nchan, points) in volts
+        base = np.asarray(frames, dtype=np.float64)[..., :baseline_samples]
+        if base.ndim == 2:
+            base = base[None]
+        mean_b = base.mean(axis=(0, 2))
+        m2_b = ((base - mean_b[None, :, None]) ** 2).sum(axis=(0, 2))
+        self._merge(base.shape[0] * base.shape[2], mean_b, m2_b)
+        self.noise_sum += base.std(axis=2).sum(axis=0)
+        self.events += base.shape[0]
+
+    def update_moments(self, mean_b, rms_b, n_b):
+        # one event given its per-channel window mean/RMS (roi.find_roi)
+        self._merge(n_b, mean_b, n_b * rms_b ** 2)
+        self.noise_sum += rms_b
+        self.events += 1
+
+    def _merge(self, n_b, mean_b, m2_b):
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / n
+        self.n = n
+
+    def rows(self):
+        events = max(self.events, 1)
+        return [{"channel": ch, "mean": float(self.mean[i]),
+                 "rms": float(math.sqrt(self.m2[i] / self.n[i])) if self.n[i] else float("nan"),
+                 "noise": float(self.noise_sum[i] / events), "events": self.events}
+                for i, ch in enumerate(self.channels)]
+
+
+def measure_run(run, converted_path=constants.CONVERTED_PATH, sequence=-1):
+    # pedestals of an already converted run, streamed in chunks
+    import uproot as ur
+    label = "%i" % run if sequence < 0 else "%i_%i" % (run, sequence)
+    filepath = "%s/converted_run%s.root" % (converted_path, label)
+    with ur.open(filepath) as f:
+        # channel[] has one slot per scope channel, only the converted ones hold data
+        nslots = f["pulse"]["channel"].array(entry_stop=1, library="np").shape[1]
+        slots = list(range(nslots))
+        if "channel_map" in f:
+            slots = [k for k, c in enumerate(f["channel_map"]["converted"].array(library="np")[0]) if c]
+    accumulator = PedestalAccumulator([k + 1 for k in slots])
+    for chunk in ur.iterate("%s:pulse" % filepath, ["channel"], step_size=CHUNK_EVENTS, library="np"):
+        accumulator.update(chunk["channel"][:, slots])
+    return accumulator.rows()
+
+
+def merge_sequences(rows):
+    # one row per channel from the rows of several sequences of a run
+    merged = {}
+    for r in rows:
+        n_b = r["events"] or 0
+        m = merged.setdefault(r["channel"], {"channel": r["channel"], "run": r["run"], "time": r["time"],
+                                             "run_time": r.get("run_time"),
+                                             "events": 0, "mean": 0., "m2": 0., "noise_sum": 0.})
+        n = m["events"] + n_b
+        if n_b == 0:
+            continue
+        delta = r["mean"] - m["mean"]
+        m["mean"] += delta * n_b / n
+        m["m2"] += n_b * r["rms"] ** 2 + delta ** 2 * m["events"] * n_b / n
+        m["noise_sum"] += n_b * r["noise"]
+        m["events"] = n
+        m["time"] = max(m["time"], r["time"])
+    for m in merged.values():
+        events = max(m["events"], 1)
+        m["rms"] = math.sqrt(m.pop("m2") / events)
+        m["noise"] = m.pop("noise_sum") / events
+    return [merged[ch] for ch in sorted(merged)]
+
+
+def smoothed_pedestals(run, catalog=None, window=SMOOTHING_RUNS, tau=SMOOTHING_SECONDS):
+    # {channel: pedestal} from the runs around `run`, weighted by the distance
+    # of the times the runs were taken (runs.time, exp(-|dt|/tau)) and event
+    # count; runs without a recorded pedestal take the neighbouring ones. Runs
+    # missing from the runs table fall back to the pedestal record time.
+    from runcatalog import RunCatalog
+    own = catalog is None
+    catalog = catalog or RunCatalog()
+    try:
+        rows = catalog.pedestals(first=run - window, last=run + window)
+        reference = catalog.get_run(run)
+    finally:
+        if own:
+            catalog.close()
+    by_run = {}
+    for r in rows:
+        by_run.setdefault(r["run"], []).append(r)
+    runs = [merge_sequences(v) for v in by_run.values()]
+    if not runs:
+        return {}
+    def taken(r):
+        return r["run_time"] if r.get("run_time") else r["time"]
+
+    if reference and reference["time"]:
+        t0 = reference["time"]
+    else:
+        t0 = taken(min(rows, key=lambda r: abs(r["run"] - run)))
+    out = {}
+    for channel in sorted(set(r["channel"] for rr in runs for r in rr)):
+        picks = [r for rr in runs for r in rr if r["channel"] == channel]
+        w = np.array([r["events"] * math.exp(-abs(taken(r) - t0) / tau) for r in picks])
+        if w.sum() <= 0:
+            w = np.ones(len(picks))
+        w = w / w.sum()
+        out[channel] = {key: float(np.dot(w, [r[key] for r in picks])) for key in ("mean", "rms", "noise")}
+        out[channel]["runs"] = sorted(r["run"] for r in picks)
+    return out
+
+
+def thresholds(run, nsigma=DEFAULT_NSIGMA, catalog=None, minimum=0.):
+    # {channel: volts} hit cut on the baseline-subtracted amplitude,
+    # nsigma * RMS but at least `minimum`; the absolute level is pedestal + cut
+    return {ch: max(nsigma * p["rms"], minimum)
+            for ch, p in smoothed_pedestals(run, catalog).items()}
+
+
+if __name__ == "__main__":
+    import argparse
+    from runcatalog import RunCatalog
+
+    parser = argparse.ArgumentParser(description='Measure or show per-channel pedestals of runs.')
+    parser.add_argument('--first', type=int, default=None, help='measure runs first..last from the converted files')
+    parser.add_argument('--last', type=int, default=None)
+    parser.add_argument('--convertedPath', type=str, default=constants.CONVERTED_PATH)
+    parser.add_argument('--run', type=int, default=None, help='show the smoothed pedestals around this run')
+    parser.add_argument('--nsigma', type=float, default=DEFAULT_NSIGMA)
+    args = parser.parse_args()
+
+    with RunCatalog() as catalog:
+        if args.first is not None and args.last is not None:
+            for run in range(args.first, args.last + 1):
+                try:
+                    rows = measure_run(run, args.convertedPath)
+                except (OSError, KeyError, ValueError) as e:
+                    print("Run %i: %s" % (run, e))
+                    continue
+                catalog.record_pedestals(run, rows)
+                print("Run %i: " % run + "  ".join("C%i %.2f+-%.2f mV" % (r["channel"], 1000 * r["mean"], 1000 * r["rms"])
+                                                   for r in rows))
+        if args.run is not None:
+            peds = smoothed_pedestals(args.run, catalog)
+            print("Run %i, smoothed over runs %s" % (args.run, sorted(set(r for p in peds.values() for r in p["runs"]))))
+            for ch, p in peds.items():
+                print("\tC%i pedestal %.2f mV  rms %.2f mV  noise %.2f mV  cut(%g sigma) %.2f mV  level %.2f mV" % (
+                    ch, 1000 * p["mean"], 1000 * p["rms"], 1000 * p["noise"], args.nsigma,
+                    1000 * args.nsigma * p["rms"], 1000 * (p["mean"] + args.nsigma * p["rms"])))
@@ -0,0 +1,129 @@
+# preprocess.py
+# Sharded preprocessing of one run with NetScopeStandaloneDat2Root.
+#
+# script_FCFD.sh runs one single-threaded NetScopeStandaloneDat2Root per run.
+# Here the events of converted_run{N}.root are split into K contiguous ranges
+# and K processes run at the same time, each with --start_evt/--N_evts and its
+# own shard file. The shards are merged with hadd in event order into the
+# usual out_run{N}.root, after checking that every shard holds exactly its
+# range and that the merged file holds every event.
+#
+#   python preprocess.py --runNumber 12 --shards 8
+#   python preprocess.py --first 1 --last 70 --shards 8
+
+import os
+import shutil
+import subprocess
+import time
+
+import constants
+
+
+DAT2ROOT = "/home/arcadia/Documents/Motors_automation_test/TimingDAQ/NetScopeStandaloneDat2Root"
+CONFIG = "/home/arcadia/Documents/Motors_automation_test/TimingDAQ/LecroyScope_v11.config"
+MIN_EVENTS_PER_SHARD = 200
+
+
+def count_events(filepath, tree="pulse"):
+    import uproot as ur
+    with ur.open(filepath) as f:
+        return f[tree].num_entries
+
+
+def shard_ranges(n_events, shards):
+    # contiguous [start, stop) ranges; DatAnalyzer's N_evts is the absolute
+    # index where a process stops (i_aux < N_evts), not a count
+    shards = max(1, min(shards, n_events // MIN_EVENTS_PER_SHARD or 1))
+    edges = [round(i * n_events / shards) for i in range(shards + 1)]
+    return [(edges[i], edges[i + 1]) for i in range(shards) if edges[i + 1] > edges[i]]
+
+
+def dat2root_command(input_file, output_file, start=None, stop=None, config=CONFIG):
+    cmd = [DAT2ROOT, "--input_file=%s" % input_file, "--config=%s" % config,
+           "--output_file=%s" % output_file, "--correctForTimeOffsets=true"]
+    if start is not None:
+        cmd += ["--start_evt=%i" % start, "--N_evts=%i" % stop]
+    return cmd
+
+
+def preprocess_run(run, shards=os.cpu_count() or 1, converted_path=constants.CONVERTED_PATH,
+                   preprocessed_path=constants.PREPROCESSED_PATH, config=CONFIG, keep_shards=False):
+    # returns the merged out_run{N}.root path, raises RuntimeError on failure
+    input_file = "%s/converted_run%i.root" % (converted_path, run)
+    output_file = "%s/out_run%i.root" % (preprocessed_path, run)
+    n_events = count_events(input_file)
+    if n_events == 0:
+        raise RuntimeError("Run %i: %s has no events, nothing to preprocess" % (run, input_file))
+    ranges = shard_ranges(n_events, shards)
+    start = time.time()
+
+    if len(ranges) == 1:
+        subprocess.run(dat2root_command(input_file, output_file, config=config), check=True,
+                       stdout=subprocess.DEVNULL)
+    else:
+        shard_dir = "%s/shards_run%i" % (preprocessed_path, run)
+        os.makedirs(shard_dir, exist_ok=True)
+        shard_files = ["%s/out_run%i_%i.root" % (shard_dir, run, i) for i in range(len(ranges))]
+        processes = []
+        for (first, stop), shard_file in zip(ranges, shard_files):
+            log = open(shard_file.replace(".root", ".log"), "w")
+            processes.append((subprocess.Popen(dat2root_command(input_file, shard_file, first, stop, config),
+                                               stdout=log, stderr=subprocess.STDOUT), log))
+        failed = []
+        for i, (process, log) in enumerate(processes):
+            if process.wait() != 0:
+                failed.append(i)
+            log.close()
+        if failed:
+            raise RuntimeError("Run %i: shards %s failed, logs in %s" % (run, failed, shard_dir))
+
+        for (first, stop), shard_file in zip(ranges, shard_files):
+            n_shard = count_events(shard_file)
+            if n_shard != stop - first:
+                raise RuntimeError("Run %i: shard %s has %i events, expected %i (%i-%i)"
+                                   % (run, shard_file, n_shard, stop - first, first, stop))
+        # hadd keeps the order of its inputs, so events stay in run order
+        subprocess.run(["hadd", "-f", "-k", output_file] + shard_files, check=True,
+                       stdout=subprocess.DEVNULL)
+        if not keep_shards:
+            shutil.rmtree(shard_dir)
+
+    n_out = count_events(output_file)
+    if n_out != n_events:
+        raise RuntimeError("Run %i: %s has %i events, converted run has %i"
+                           % (run, output_file, n_out, n_events))
+    print("Run %i: %i events in %i shard(s), %0.1f s -> %s"
+          % (run, n_events, len(ranges), time.time() - start, output_file))
+    return output_file
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Preprocess runs with several NetScopeStandaloneDat2Root processes each.')
+    parser.add_argument('--runNumber', type=int, default=None)
+    parser.add_argument('--first', type=int, default=None, help='first run of a range')
+    parser.add_argument('--last', type=int, default=None, help='last run of a range (inclusive)')
+    parser.add_argument('--shards', type=int, default=os.cpu_count() or 1, help='processes per run')
+    parser.add_argument('--convertedPath', type=str, default=constants.CONVERTED_PATH)
+    parser.add_argument('--preprocessedPath', type=str, default=constants.PREPROCESSED_PATH)
+    parser.add_argument('--config', type=str, default=CONFIG)
+    parser.add_argument('--keepShards', action='store_true')
+    args = parser.parse_args()
+
+    if args.runNumber is not None:
+        runs = [args.runNumber]
+    elif args.first is not None and args.last is not None:
+        runs = range(args.first, args.last + 1)
+    else:
+        parser.error("give --runNumber or --first/--last")
+
+    failures = 0
+    for run in runs:
+        try:
+            preprocess_run(run, args.shards, args.convertedPath, args.preprocessedPath, args.config, args.keepShards)
+        except (RuntimeError, subprocess.CalledProcessError, OSError) as e:
+            print("Run %i failed: %s" % (run, e))
+            failures += 1
+    if failures:
+        raise SystemExit(1)
@@ -0,0 +1,97 @@
+# roi.py
+# Zero-suppressed region-of-interest (ROI) storage for converted runs.
+#
+# For every event and channel only the raw ADC codes in a window around the
+# pulse are kept, together with the baseline mean/RMS of the full baseline
+# window. Channels without a hit are dropped entirely (roi_start = -1,
+# roi_length = 0).
+# The kept samples of an event are concatenated in roi_adc; roi_offset,
+# roi_start and roi_length locate every channel inside it, so
+#
+#     volts = vertical_gain[ch] * roi_adc[off:off+len] - vertical_offset[ch]
+#     sample index = roi_start[ch] + arange(len)
+#
+# reproduces exactly the values the full converter writes to channel[ch].
+
+import numpy as np
+
+
+DEFAULT_BASELINE_SAMPLES = 100
+DEFAULT_THRESHOLD = 0.1     # V above baseline, same cut as analysis_280.py
+DEFAULT_PRE_SAMPLES = 20
+DEFAULT_POST_SAMPLES = 40
+
+
+def find_roi(adc, vertical_gains, vertical_offsets,
+             baseline_samples=DEFAULT_BASELINE_SAMPLES,
+             threshold=DEFAULT_THRESHOLD,
+             pre_samples=DEFAULT_PRE_SAMPLES,
+             post_samples=DEFAULT_POST_SAMPLES):
+    # adc: (nchan, points_per_frame) raw codes of one event
+    # returns baseline mean/rms in volts and [start, stop) of the kept window
+    # (an empty window when no sample deviates more than threshold, stored by
+    # pack_event as roi_start = -1, roi_length = 0)
+    volts = vertical_gains[:, None] * adc - vertical_offsets[:, None]
+    baseline = volts[:, :baseline_samples]
+    baseline_mean = baseline.mean(axis=1)
+    baseline_rms = baseline.std(axis=1)
+
+    over = np.abs(volts - baseline_mean[:, None]) > threshold
+    hit = over.any(axis=1)
+    npoints = adc.shape[1]
+    first = np.argmax(over, axis=1)
+    last = npoints - 1 - np.argmax(over[:, ::-1], axis=1)
+    start = np.where(hit, np.maximum(first - pre_samples, 0), 0)
+    stop = np.where(hit, np.minimum(last + post_samples + 1, npoints), 0)
+    return baseline_mean, baseline_rms, start, stop
+
+
+def pack_event(adc, start, stop, roi_adc, roi_start, roi_length, roi_offset):
+    # copies the kept windows of one event into the preallocated tree buffers
+    # and returns the number of samples written to roi_adc
+    n_roi = 0
+    for ichan in range(adc.shape[0]):
+        length = int(stop[ichan] - start[ichan])
+        roi_offset[ichan] = n_roi
+        roi_length[ichan] = length
+        roi_start[ichan] = start[ichan] if length else -1
+        if length:
+            roi_adc[n_roi:n_roi + length] = adc[ichan, start[ichan]:stop[ichan]]
+            n_roi += length
+    return n_roi
+
+
+def read_roi_run(filepath, branches=None):
+    # loads a converted_roi_run{N}.root file with uproot
+    # returns (events, config) as dicts of numpy arrays
+    import uproot as ur
+
+    with ur.open(filepath) as f:
+        events = f["pulse"].arrays(branches, library="np")
+        config = f["roi_config"].arrays(library="np")
+    config = {key: value[0] for key, value in config.items()}
+    return events, config
+
+
+def reconstruct(events, config, i_event, ichan):
+    # returns (sample indices, volts) of the kept window of one channel,
+    # both empty when the channel was dropped for this event
+    length = int(events["roi_length"][i_event][ichan])
+    if length == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+    offset = int(events["roi_offset"][i_event][ichan])
+    adc = events["roi_adc"][i_event][offset:offset + length]
+    volts = (config["vertical_gain"][ichan] * adc.astype(np.float64)
+             - config["vertical_offset"][ichan]).astype(np.float32)
+    samples = int(events["roi_start"][i_event][ichan]) + np.arange(length)
+    return samples, volts
+
+
+def to_dense(events, config, i_event, ichan):
+    # full-length frame with the dropped samples filled by the baseline mean,
+    # for code written against the full channel[ch][points] layout
+    frame = np.full(int(config["points_per_frame"]),
+                    events["baseline_mean"][i_event][ichan], dtype=np.float32)
+    samples, volts = reconstruct(events, config, i_event, ichan)
+    frame[samples] = volts
+    return frame
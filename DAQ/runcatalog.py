@@ -0,0 +1,161 @@
+# runcatalog.py
+# Run catalog: one SQLite file that records, for every run, when it was taken
+# and where the stages were (plus laser power), so analyses can look runs up
+# by coordinates instead of parsing log files or folder names.
+
+import os
+import sqlite3
+import time
+
+import constants
+
+
+RUN_COLUMNS = ["run", "time", "x", "y", "z", "power", "status"]
+MEASUREMENT_COLUMNS = ["run", "channel", "parameter", "mean", "sdev", "min", "max", "num", "time"]
+PEDESTAL_COLUMNS = ["run", "sequence", "channel", "mean", "rms", "noise", "events", "time"]
+SKIM_COLUMNS = ["run", "selection", "events", "passed", "time"]
+
+
+class RunCatalog:
+
+    def __init__(self, path=constants.CATALOG_PATH):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several scan/analysis processes may share the file
+        self.db = sqlite3.connect(path, timeout=30)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""CREATE TABLE IF NOT EXISTS runs (
+            run INTEGER PRIMARY KEY, time REAL, x REAL, y REAL, z REAL,
+            power REAL, status TEXT)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS runs_position ON runs (power, z, x)")
+        # scope-side measurement statistics (acquisition.py --measureOnly)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS measurements (
+            run INTEGER, channel INTEGER, parameter TEXT, mean REAL, sdev REAL,
+            min REAL, max REAL, num REAL, time REAL,
+            PRIMARY KEY (run, channel, parameter))""")
+        # baseline mean/RMS per scope channel, filled while converting (pedestals.py)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS pedestals (
+            run INTEGER, sequence INTEGER, channel INTEGER, mean REAL, rms REAL,
+            noise REAL, events INTEGER, time REAL,
+            PRIMARY KEY (run, sequence, channel))""")
+        # events passing a skim selection (skim.py), for efficiency maps
+        self.db.execute("""CREATE TABLE IF NOT EXISTS skims (
+            run INTEGER, selection TEXT, events INTEGER, passed INTEGER, time REAL,
+            PRIMARY KEY (run, selection))""")
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def record_run(self, run, x=None, y=None, z=None, power=None, status=None, timestamp=None):
+        # inserts or updates a run; None leaves an existing value untouched,
+        # a new run gets the current time and status "taken" unless given
+        created = self.db.execute("INSERT OR IGNORE INTO runs (run) VALUES (?)", (run,)).rowcount > 0
+        if created:
+            timestamp = timestamp or time.time()
+            status = status or "taken"
+        values = {"time": timestamp, "x": x, "y": y, "z": z, "power": power, "status": status}
+        for column, value in values.items():
+            if value is not None:
+                self.db.execute("UPDATE runs SET %s = ? WHERE run = ?" % column, (value, run))
+        self.db.commit()
+
+    def get_run(self, run):
+        row = self.db.execute("SELECT * FROM runs WHERE run = ?", (run,)).fetchone()
+        return dict(row) if row else None
+
+    def runs(self, first=None, last=None, **equal):
+        # e.g. runs(z=85250), runs(first=1, last=70)
+        query = "SELECT * FROM runs WHERE 1"
+        params = []
+        if first is not None:
+            query += " AND run >= ?"
+            params.append(first)
+        if last is not None:
+            query += " AND run <= ?"
+            params.append(last)
+        for column, value in equal.items():
+            if column not in RUN_COLUMNS:
+                raise ValueError("Unknown run catalog column: %s" % column)
+            query += " AND %s = ?" % column
+            params.append(value)
+        return [dict(row) for row in self.db.execute(query + " ORDER BY run", params)]
+
+    def record_measurements(self, run, rows, timestamp=None):
+        # rows: dicts with channel, parameter and the statistics of scopemeasure.py
+        timestamp = timestamp or time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run, r["channel"], r["parameter"], r.get("mean"), r.get("sdev"), r.get("min"),
+              r.get("max"), r.get("num"), timestamp) for r in rows])
+        self.db.commit()
+
+    def measurements(self, first=None, last=None, parameter=None):
+        # measurement rows joined with the run coordinates
+        query = ("SELECT m.*, r.x, r.y, r.z, r.power FROM measurements m "
+                 "LEFT JOIN runs r ON r.run = m.run WHERE 1")
+        params = []
+        if first is not None:
+            query += " AND m.run >= ?"
+            params.append(first)
+        if last is not None:
+            query += " AND m.run <= ?"
+            params.append(last)
+        if parameter is not None:
+            query += " AND m.parameter = ?"
+            params.append(parameter)
+        return [dict(row) for row in self.db.execute(query + " ORDER BY m.run, m.channel", params)]
+
+    def record_pedestals(self, run, rows, sequence=-1, timestamp=None):
+        # rows: dicts with channel, mean, rms, noise, events (PedestalAccumulator.rows)
+        timestamp = timestamp or time.time()
+        self.db.executemany(
+            "INSERT OR REPLACE INTO pedestals VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            [(run, sequence, r["channel"], r["mean"], r["rms"], r.get("noise"), r.get("events"), timestamp)
+             for r in rows])
+        self.db.commit()
+
+    def pedestals(self, first=None, last=None, channel=None):
+        # pedestal rows with the time the run was taken (run_time, None if the
+        # run is not in the catalog); "time" is when the pedestal was recorded
+        query = ("SELECT p.*, r.time AS run_time FROM pedestals p "
+                 "LEFT JOIN runs r ON r.run = p.run WHERE 1")
+        params = []
+        if first is not None:
+            query += " AND p.run >= ?"
+            params.append(first)
+        if last is not None:
+            query += " AND p.run <= ?"
+            params.append(last)
+        if channel is not None:
+            query += " AND p.channel = ?"
+            params.append(channel)
+        return [dict(row) for row in self.db.execute(query + " ORDER BY p.run, p.sequence, p.channel", params)]
+
+    def record_skim(self, run, selection, events, passed, timestamp=None):
+        self.db.execute("INSERT OR REPLACE INTO skims VALUES (?, ?, ?, ?, ?)",
+                        (run, selection, int(events), int(passed), timestamp or time.time()))
+        self.db.commit()
+
+    def skims(self, first=None, last=None, selection=None):
+        # skim pass counts joined with the run coordinates
+        query = ("SELECT s.*, r.x, r.y, r.z, r.power FROM skims s "
+                 "LEFT JOIN runs r ON r.run = s.run WHERE 1")
+        params = []
+        if first is not None:
+            query += " AND s.run >= ?"
+            params.append(first)
+        if last is not None:
+            query += " AND s.run <= ?"
+            params.append(last)
+        if selection is not None:
+            query += " AND s.selection = ?"
+            params.append(selection)
+        return [dict(row) for row in self.db.execute(query + " ORDER BY s.run", params)]
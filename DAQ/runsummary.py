@@ -0,0 +1,290 @@
+# runsummary.py
+# Per-run, per-channel summary table computed once from the converted runs.
+#
+# One row per (run, channel) with amplitude statistics, hit fraction, the
+# plateau mean used by analysis_280.py, baseline mean/RMS and, when the
+# preprocessed out_run{N}.root exists, CFD timing mean/sigma relative to CH1.
+# Rows are keyed by run, X, Z and laser power from the run catalog and stored
+# in one Parquet file. Each row remembers the size and mtime of its source
+# files (converted and preprocessed) and is recomputed automatically when
+# either changes or the preprocessed file appears.
+#
+# With use_pedestals the hit cut is nsigma x the smoothed pedestal RMS of
+# every channel (pedestals.py) instead of the fixed THRESHOLD; rows remember
+# the nsigma they were built with (pedestal_nsigma, NaN for the fixed cut),
+# and runs built with another setting are recomputed.
+#
+#   python runsummary.py --first 1 --last 280 --jobs 8 --usePedestals
+#   df = runsummary.load_summary(columns=["run", "x", "z", "channel", "plateau_mean"])
+
+import os
+import time
+
+import numpy as np
+
+import constants
+
+
+THRESHOLD = 0.1         # V, same cut as analysis_280.py
+EDGE_SAMPLES = 10       # samples dropped on both sides of the plateau
+BASELINE_SAMPLES = 100
+CFD_BRANCH = "LP2_20"
+CHUNK_EVENTS = 500
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+KEY_COLUMNS = ["run", "channel", "power", "z", "x", "y"]
+
+
+def converted_file(run, converted_path=constants.CONVERTED_PATH):
+    return "%s/converted_run%i.root" % (converted_path, run)
+
+
+def preprocessed_file(run, preprocessed_path=constants.PREPROCESSED_PATH):
+    return "%s/out_run%i.root" % (preprocessed_path, run)
+
+
+def source_signature(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return int(stat.st_size), float(stat.st_mtime)
+
+
+def run_signature(run, converted_path=constants.CONVERTED_PATH, preprocessed_path=constants.PREPROCESSED_PATH):
+    # (size, mtime) of converted_run{N}.root and of out_run{N}.root, None for a missing file
+    return (source_signature(converted_file(run, converted_path)),
+            source_signature(preprocessed_file(run, preprocessed_path)))
+
+
+def plateau_means(frames, threshold=THRESHOLD, edge=EDGE_SAMPLES):
+    # analysis_280.py: mean of the samples between the first and last sample
+    # over threshold, minus edge samples on each side; NaN without a plateau
+    over = frames > threshold
+    npoints = frames.shape[1]
+    has_hit = over.any(axis=1)
+    first = np.argmax(over, axis=1) + edge
+    last = npoints - 1 - np.argmax(over[:, ::-1], axis=1) - edge
+    idx = np.arange(npoints)[None, :]
+    window = (idx >= first[:, None]) & (idx < last[:, None]) & has_hit[:, None]
+    counts = window.sum(axis=1)
+    sums = np.where(window, frames, 0.).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def channel_values(values, nslots, default):
+    # one value per slot of channel[] from a number, a sequence in slot order
+    # or a {scope channel: value} dict (C{n} is slot n-1, see conversion.py)
+    if isinstance(values, dict):
+        return np.array([values.get(slot + 1, default) for slot in range(nslots)], dtype=float)
+    return np.array(np.broadcast_to(values, nslots), dtype=float)
+
+
+def summarize_run(run, converted_path=constants.CONVERTED_PATH,
+                  preprocessed_path=constants.PREPROCESSED_PATH, threshold=THRESHOLD, pedestals=None):
+    # returns one dict per channel. threshold is the hit cut on the amplitude
+    # above the event baseline (one value, one per slot or e.g.
+    # pedestals.thresholds(run)); the plateau starts where the waveform is
+    # over pedestal + threshold, pedestals being e.g.
+    # pedestals.smoothed_pedestals(run) (pedestal 0 V without them, as
+    # analysis_280.py)
+    import uproot as ur
+
+    source = converted_file(run, converted_path)
+    cuts = levels = None
+    amplitudes, plateaus, baselines, noises = [], [], [], []
+    for chunk in ur.iterate("%s:pulse" % source, ["channel"], step_size=CHUNK_EVENTS, library="np"):
+        frames = chunk["channel"]
+        base = frames[:, :, :BASELINE_SAMPLES]
+        baseline = base.mean(axis=2)
+        amplitudes.append(frames.max(axis=2) - baseline)
+        baselines.append(baseline)
+        noises.append(base.std(axis=2))
+        if cuts is None:
+            cuts = channel_values(threshold, frames.shape[1], THRESHOLD)
+            means = {ch: p["mean"] for ch, p in (pedestals or {}).items()}
+            levels = cuts + channel_values(means, frames.shape[1], 0.)
+        plateaus.append(np.stack([plateau_means(frames[:, c, :], levels[c])
+                                  for c in range(frames.shape[1])], axis=1))
+    amplitude = np.concatenate(amplitudes)
+    plateau = np.concatenate(plateaus)
+    baseline = np.concatenate(baselines)
+    noise = np.concatenate(noises)
+
+    pre_signature = source_signature(preprocessed_file(run, preprocessed_path))
+    cfd = None
+    pre = preprocessed_file(run, preprocessed_path)
+    if pre_signature is not None:
+        with ur.open(pre) as f:
+            if CFD_BRANCH in f["pulse"]:
+                cfd = f["pulse"][CFD_BRANCH].array(library="np")
+
+    signature = source_signature(source)
+    rows = []
+    for ichan in range(amplitude.shape[1]):
+        amp = amplitude[:, ichan]
+        hits = amp > cuts[ichan]
+        row = {
+            "run": run,
+            "channel": ichan,
+            "n_events": amp.size,
+            "hit_fraction": float(hits.mean()) if amp.size else np.nan,
+            "amp_mean": float(amp.mean()),
+            "amp_median": float(np.median(amp)),
+            "amp_rms": float(amp.std()),
+            "hit_amp_mean": float(amp[hits].mean()) if hits.any() else np.nan,
+            "plateau_mean": float(np.nanmean(plateau[:, ichan])) if np.isfinite(plateau[:, ichan]).any() else np.nan,
+            "baseline_mean": float(baseline[:, ichan].mean()),
+            "baseline_rms": float(noise[:, ichan].mean()),
+            "cfd_mean": np.nan,
+            "cfd_sigma": np.nan,
+            "source_size": signature[0],
+            "source_mtime": signature[1],
+            "preprocessed_size": pre_signature[0] if pre_signature else np.nan,
+            "preprocessed_mtime": pre_signature[1] if pre_signature else np.nan,
+            "summary_time": time.time(),
+        }
+        for q, value in zip(QUANTILES, np.quantile(amp, QUANTILES)):
+            row["amp_q%02i" % int(100 * q)] = float(value)
+        if cfd is not None and ichan < cfd.shape[1]:
+            dt = cfd[:, ichan] - cfd[:, 0]
+            good = hits & (cfd[:, ichan] != 0) & np.isfinite(dt)
+            if ichan > 0 and good.sum() > 1:
+                row["cfd_mean"] = float(dt[good].mean())
+                row["cfd_sigma"] = float(dt[good].std())
+        rows.append(row)
+    return rows
+
+
+def _summarize_job(job):
+    run, converted_path, preprocessed_path, nsigma = job
+    try:
+        if nsigma is None:
+            rows = summarize_run(run, converted_path, preprocessed_path)
+        else:
+            import pedestals
+            # channels without a recorded pedestal keep the fixed THRESHOLD
+            rows = summarize_run(run, converted_path, preprocessed_path,
+                                 threshold=pedestals.thresholds(run, nsigma),
+                                 pedestals=pedestals.smoothed_pedestals(run))
+        for row in rows:
+            row["pedestal_nsigma"] = np.nan if nsigma is None else float(nsigma)
+        return run, rows, None
+    except Exception as e:
+        return run, [], str(e)
+
+
+def load_summary(path=constants.SUMMARY_PATH, columns=None, filters=None):
+    # columns/filters are passed to pyarrow, so only the needed columns/rows
+    # are read, e.g. filters=[("channel", "==", 3)]
+    import pandas as pd
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path, columns=columns, filters=filters)
+
+
+def stale_runs(runs, summary, converted_path=constants.CONVERTED_PATH,
+               preprocessed_path=constants.PREPROCESSED_PATH, nsigma=None):
+    # runs whose converted or preprocessed file changed (or appeared) since
+    # they were summarized, or that were summarized with another hit cut
+    # (nsigma of the pedestal cut, None for the fixed THRESHOLD)
+    known = {}
+    if len(summary) and "pedestal_nsigma" in summary:
+        first_rows = summary.drop_duplicates("run")
+
+        def signature(size, mtime):
+            return None if np.isnan(size) else (int(size), float(mtime))
+        known = {run: (signature(*source), signature(*pre), None if np.isnan(cut) else float(cut))
+                 for run, source, pre, cut in zip(
+                     first_rows["run"], zip(first_rows["source_size"], first_rows["source_mtime"]),
+                     zip(first_rows["preprocessed_size"], first_rows["preprocessed_mtime"]),
+                     first_rows["pedestal_nsigma"])}
+    cut = None if nsigma is None else float(nsigma)
+    stale = []
+    for run in runs:
+        signature = run_signature(run, converted_path, preprocessed_path)
+        if signature[0] is not None and known.get(run) != signature + (cut,):
+            stale.append(run)
+    return stale
+
+
+def update_summary(runs, path=constants.SUMMARY_PATH, converted_path=constants.CONVERTED_PATH,
+                   preprocessed_path=constants.PREPROCESSED_PATH, catalog_path=constants.CATALOG_PATH,
+                   jobs=1, use_pedestals=False, nsigma=None):
+    # recomputes the stale runs, refreshes the catalog keys and rewrites the
+    # file; use_pedestals cuts on nsigma (default pedestals.DEFAULT_NSIGMA)
+    # x the smoothed pedestal RMS instead of the fixed THRESHOLD
+    import pandas as pd
+    from runcatalog import RunCatalog
+
+    if use_pedestals and nsigma is None:
+        import pedestals
+        nsigma = pedestals.DEFAULT_NSIGMA
+    if not use_pedestals:
+        nsigma = None
+    summary = load_summary(path)
+    stale = stale_runs(runs, summary, converted_path, preprocessed_path, nsigma)
+    new_rows = []
+    work = [(run, converted_path, preprocessed_path, nsigma) for run in stale]
+    if jobs > 1 and len(work) > 1:
+        from multiprocessing import Pool
+        with Pool(jobs) as pool:
+            results = pool.map(_summarize_job, work)
+    else:
+        results = [_summarize_job(job) for job in work]
+    for run, rows, error in results:
+        if error:
+            print("Run %i: summary failed (%s)" % (run, error))
+        new_rows += rows
+
+    if new_rows:
+        fresh = pd.DataFrame(new_rows)
+        if len(summary):
+            summary = summary[~summary["run"].isin(fresh["run"])]
+            summary = pd.concat([summary, fresh], ignore_index=True)
+        else:
+            summary = fresh
+
+    if len(summary) and os.path.exists(catalog_path):
+        with RunCatalog(catalog_path) as catalog:
+            keys = {r["run"]: r for r in catalog.runs()}
+        for column in ["x", "y", "z", "power"]:
+            values = [keys.get(run, {}).get(column) for run in summary["run"]]
+            summary[column] = [np.nan if v is None else float(v) for v in values]
+    for column in ["x", "y", "z", "power"]:
+        if column not in summary:
+            summary[column] = np.nan
+
+    if new_rows or len(summary):
+        summary = summary.sort_values(KEY_COLUMNS[2:] + KEY_COLUMNS[:2]).reset_index(drop=True)
+        tmp = path + ".tmp"
+        summary.to_parquet(tmp, index=False)
+        os.replace(tmp, path)
+    print("Summary: %i runs recomputed, %i rows in %s" % (len(stale), len(summary), path))
+    return summary
+
+
+def campaign_grid(summary, value, channel, power=None):
+    # (z values, x values, 2D array [z, x]) of one statistic for plotting
+    rows = summary[summary["channel"] == channel]
+    if power is not None:
+        rows = rows[rows["power"] == power]
+    table = rows.pivot_table(index="z", columns="x", values=value, aggfunc="mean")
+    return table.index.to_numpy(), table.columns.to_numpy(), table.to_numpy()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Update the per-run summary table.')
+    parser.add_argument('--first', metavar='first', type=int, required=True, help='first run')
+    parser.add_argument('--last', metavar='last', type=int, required=True, help='last run (inclusive)')
+    parser.add_argument('--jobs', metavar='jobs', type=int, default=1, help='parallel processes')
+    parser.add_argument('--convertedPath', metavar='convertedPath', type=str, default=constants.CONVERTED_PATH)
+    parser.add_argument('--summary', metavar='summary', type=str, default=constants.SUMMARY_PATH)
+    parser.add_argument('--usePedestals', action='store_true', help='hit cut from the smoothed pedestals instead of THRESHOLD')
+    parser.add_argument('--nsigma', metavar='nsigma', type=float, default=None, help='pedestal RMS multiple of the hit cut')
+    args = parser.parse_args()
+
+    update_summary(range(args.first, args.last + 1), path=args.summary,
+                   converted_path=args.convertedPath, jobs=args.jobs,
+                   use_pedestals=args.usePedestals, nsigma=args.nsigma)
@@ -0,0 +1,82 @@
+# scopemeasure.py
+# Scope-side parameter measurements for fast scans (acquisition.py --measureOnly).
+#
+# Instead of saving, copying and converting full sequences, the scope's own
+# measurement engine (app.Measure.P1..P12) computes amplitude, area, ... on the
+# selected channels over every segment of the sequence. After the sequence only
+# the summary statistics (mean, sdev, min, max, number of measured segments)
+# are read back, all parameters in one VBS query, and stored in the run catalog.
+#
+# The measurement setup is a list of scopesession settings, so it is cached and
+# only sent when it changes like the rest of the scope configuration.
+
+from collections import namedtuple
+
+from scopesession import vbs, VBS_SEPARATOR
+
+
+Measurement = namedtuple("Measurement", ["slot", "channel", "parameter"])
+
+DEFAULT_PARAMETERS = ["Amplitude", "Area", "Maximum"]
+DEFAULT_CHANNELS = [2, 4, 6]        # scope channels (C2, C4, C6: analog outputs)
+STATISTICS = ["mean", "sdev", "min", "max", "num"]
+MAX_SLOTS = 12
+
+
+def plan(channels=DEFAULT_CHANNELS, parameters=DEFAULT_PARAMETERS):
+    # one measurement slot P1..P12 per (channel, parameter)
+    measurements = [Measurement(0, c, p) for c in channels for p in parameters]
+    if len(measurements) > MAX_SLOTS:
+        raise ValueError("%i measurements requested, the scope has %i slots" % (len(measurements), MAX_SLOTS))
+    return [m._replace(slot=i + 1) for i, m in enumerate(measurements)]
+
+
+def settings(measurements):
+    # scopesession settings that configure the measurement slots
+    out = [
+        vbs("measure_mode", 'app.Measure.MeasureMode = "MyMeasure"', "app.Measure.MeasureMode", "MyMeasure"),
+        vbs("measure_show", "app.Measure.ShowMeasure = True", "app.Measure.ShowMeasure", "-1"),
+        vbs("measure_stats", "app.Measure.StatsOn = True", "app.Measure.StatsOn", "-1"),
+    ]
+    for m in measurements:
+        p = "app.Measure.P%i" % m.slot
+        out.append(vbs("measure_p%i_view" % m.slot, "%s.View = True" % p, "%s.View" % p, "-1"))
+        out.append(vbs("measure_p%i_param" % m.slot, '%s.ParamEngine = "%s"' % (p, m.parameter),
+                       "%s.ParamEngine" % p, m.parameter))
+        out.append(vbs("measure_p%i_source" % m.slot, '%s.Source1 = "C%i"' % (p, m.channel),
+                       "%s.Source1" % p, "C%i" % m.channel))
+    return out
+
+
+def clear(scope):
+    # statistics restart with the next acquisition
+    scope.write(r"""vbs 'app.Measure.ClearSweeps' """)
+
+
+def read_statistics(scope, measurements):
+    # one query for all statistics of all slots; returns one dict per measurement
+    terms = ['app.Measure.P%i.Statistics("%s").Result.Value' % (m.slot, s)
+             for m in measurements for s in STATISTICS]
+    answer = scope.query(r"""vbs? 'return = %s' """ % (' & "%s" & ' % VBS_SEPARATOR).join(terms))
+    answer = answer.strip()
+    if answer.upper().startswith("VBS "):
+        answer = answer[4:]
+    values = answer.strip().strip('"').split(VBS_SEPARATOR)
+    rows = []
+    for i, m in enumerate(measurements):
+        row = {"channel": m.channel, "parameter": m.parameter}
+        for j, s in enumerate(STATISTICS):
+            k = i * len(STATISTICS) + j
+            try:
+                row[s] = float(values[k])
+            except (IndexError, ValueError):
+                row[s] = None
+        rows.append(row)
+    return rows
+
+
+def describe(rows):
+    return "\n".join("\tC%i %-10s mean %.4g  sdev %.3g  (%s segments)" % (
+        r["channel"], r["parameter"], r["mean"] if r["mean"] is not None else float("nan"),
+        r["sdev"] if r["sdev"] is not None else float("nan"),
+        "%i" % r["num"] if r["num"] is not None else "?") for r in rows)
@@ -0,0 +1,168 @@
+# scopesession.py
+# Scope configuration cache for acquisition.py.
+#
+# Every acquisition.py process describes the settings it wants as a list of
+# Setting entries. The last applied settings are kept in a small JSON state
+# file next to the run number file, so a new process only writes the settings
+# that differ from the cache. The cache is checked against the scope once per
+# process (on the first apply()) and whenever something has to be written,
+# with one batched SCPI query and one batched VBS query instead of one round
+# trip per setting, so a scope changed by hand or power-cycled between runs is
+# caught before the next run. Later apply() calls of the same process (e.g. a
+# new sequence size) trust the cache for the settings that did not change.
+
+import json
+import os
+import time
+from collections import namedtuple
+
+
+# kind: "scpi" or "vbs"; query: read-back expression, None when the setting
+# cannot be read back (trusted from the cache); match: how the answer is
+# compared with expected ("prefix" tokens, "all" value tokens, "number")
+Setting = namedtuple("Setting", ["name", "command", "kind", "query", "expected", "match"])
+
+PRE_CONFIGURE = ["STOP", "*CLS"]
+VBS_SEPARATOR = "|"
+
+
+def scpi(name, command, query=None, expected=None, match="prefix"):
+    return Setting(name, command, "scpi", query, expected, match)
+
+
+def vbs(name, command, query=None, expected=None, match="prefix"):
+    return Setting(name, r"""vbs '%s' """ % command, "vbs", query, expected, match)
+
+
+def _strip_header(response):
+    # tolerate answers sent with COMM_HEADER still on, e.g. "BWL OFF"
+    response = response.strip().strip('"')
+    if " " in response and not response[0].isdigit():
+        response = response.split(" ", 1)[1]
+    return response.strip()
+
+
+def matches(setting, response):
+    if setting.query is None:
+        return True
+    response = _strip_header(response).upper()
+    expected = str(setting.expected).upper()
+    if setting.match == "number":
+        try:
+            return abs(float(response) - float(expected)) <= 1e-6 * max(abs(float(expected)), 1e-12)
+        except ValueError:
+            return False
+    tokens = [t.strip() for t in response.split(",")]
+    wanted = [t.strip() for t in expected.split(",")]
+    if setting.match == "all":
+        # e.g. BWL answers "C1,OFF,C2,OFF,..." for a single expected "OFF"
+        values = [t for t in tokens if not (t.startswith("C") and t[1:].isdigit())]
+        return bool(values) and all(v == wanted[0] for v in values)
+    if len(tokens) < len(wanted):
+        return False
+    for got, want in zip(tokens, wanted):
+        try:
+            if float(got) != float(want):
+                return False
+        except ValueError:
+            if got != want:
+                return False
+    return True
+
+
+class ScopeSession:
+
+    def __init__(self, scope, state_file):
+        self.scope = scope
+        self.state_file = state_file
+        self.state = self._load_state()
+        self.last_setup = None
+        self.verified = False       # the cache is not trusted before one verify per process
+
+    def _load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"applied": {}}
+
+    def _save_state(self):
+        tmp = self.state_file + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.state, f, indent=1)
+        os.replace(tmp, self.state_file)
+
+    def remember(self, key, value):
+        # keeps other per-scope values (e.g. the last trigger rate) across runs
+        self.state[key] = value
+        self._save_state()
+
+    def invalidate(self):
+        self.state = {"applied": {}}
+
+    def verify(self, settings):
+        # returns the names of the settings whose read-back does not match,
+        # using at most one SCPI and one VBS query
+        mismatched = []
+        n_queries = 0
+        scpi_settings = [s for s in settings if s.kind == "scpi" and s.query]
+        if scpi_settings:
+            answer = self.scope.query(";".join(s.query for s in scpi_settings))
+            n_queries += 1
+            answers = answer.strip().split(";")
+            for i, s in enumerate(scpi_settings):
+                if i >= len(answers) or not matches(s, answers[i]):
+                    mismatched.append(s.name)
+        vbs_settings = [s for s in settings if s.kind == "vbs" and s.query]
+        if vbs_settings:
+            expression = (' & "%s" & ' % VBS_SEPARATOR).join(s.query for s in vbs_settings)
+            answer = self.scope.query(r"""vbs? 'return = %s' """ % expression)
+            n_queries += 1
+            answers = _strip_header(answer).split(VBS_SEPARATOR)
+            for i, s in enumerate(vbs_settings):
+                if i >= len(answers) or not matches(s, answers[i]):
+                    mismatched.append(s.name)
+        return mismatched, n_queries
+
+    def apply(self, settings, force=False):
+        # sends only the settings that differ from the cache (or the scope),
+        # returns the list of names that were written
+        start = time.time()
+        applied = self.state.get("applied", {})
+        if force:
+            applied = {}
+
+        diff = [s for s in settings if applied.get(s.name) != s.command]
+        n_queries = 0
+        if not self.verified or diff:
+            cached_ok = [s for s in settings if s not in diff]
+            mismatched, n_queries = self.verify(cached_ok)
+            diff += [s for s in cached_ok if s.name in mismatched]
+            self.verified = True
+
+        writes = []
+        if diff:
+            writes = PRE_CONFIGURE + [s.command for s in diff]
+            for command in writes:
+                self.scope.write(command)
+            for s in diff:
+                applied[s.name] = s.command
+
+        self.state["applied"] = applied
+        self.last_setup = {
+            "seconds": time.time() - start,
+            "writes": len(writes),
+            "queries": n_queries,
+            "changed": [s.name for s in diff],
+        }
+        self.state["last_setup"] = self.last_setup
+        self._save_state()
+        return self.last_setup["changed"]
+
+    def describe_last_setup(self):
+        if self.last_setup is None:
+            return "Scope setup not applied yet."
+        changed = ", ".join(self.last_setup["changed"]) or "nothing changed"
+        return "Scope setup took %0.1f ms (%i writes, %i queries): %s" % (
+            1000 * self.last_setup["seconds"], self.last_setup["writes"],
+            self.last_setup["queries"], changed)
@@ -0,0 +1,177 @@
+# sequencing.py
+# Event-rate-aware multi-sequence runs for acquisition.py.
+#
+# A run with a target event count is split into several sequences. Each
+# sequence is sized from the measured trigger rate so that it fits in scope
+# memory and takes about max_seconds to acquire. While sequence k+1 is being
+# acquired, sequence k is copied from the scope share and converted in a
+# background thread. The run stops early once the relative uncertainty on the
+# mean hit amplitude of one channel drops below the requested target.
+
+import math
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from dqm import RunningMoments
+
+
+DEFAULT_MIN_SEGMENTS = 50
+DEFAULT_MAX_SEGMENTS = 5000
+DEFAULT_MAX_SECONDS = 10.
+BASELINE_SAMPLES = 100
+
+
+class SequencePlanner:
+
+    def __init__(self, target_events, rate_estimate=None,
+                 min_segments=DEFAULT_MIN_SEGMENTS, max_segments=DEFAULT_MAX_SEGMENTS,
+                 max_seconds=DEFAULT_MAX_SECONDS, target_rel_error=0., min_hits=20):
+        self.target_events = target_events
+        self.rate = rate_estimate
+        self.min_segments = min_segments
+        self.max_segments = max_segments
+        self.max_seconds = max_seconds
+        self.target_rel_error = target_rel_error
+        self.min_hits = min_hits
+        self.collected = 0
+        self.amplitude = RunningMoments()
+        self.n_converted = 0
+
+    def update_rate(self, n_events, duration):
+        self.collected += n_events
+        if duration > 0:
+            self.rate = n_events / duration
+        return self.rate
+
+    def add_amplitudes(self, n_events, hit_amplitudes):
+        self.n_converted += n_events
+        self.amplitude.update(hit_amplitudes)
+
+    def relative_error(self):
+        if self.amplitude.n < 2 or self.amplitude.mean == 0:
+            return float("inf")
+        sem = self.amplitude.rms() / math.sqrt(self.amplitude.n)
+        return abs(sem / self.amplitude.mean)
+
+    def target_reached(self):
+        if self.collected >= self.target_events:
+            return True
+        return (self.target_rel_error > 0 and self.amplitude.n >= self.min_hits
+                and self.relative_error() <= self.target_rel_error)
+
+    def events_still_needed(self):
+        # events still needed for the statistical target, extrapolated from
+        # the hit fraction and spread seen so far
+        remaining = self.target_events - self.collected
+        if self.target_rel_error <= 0 or self.amplitude.n < self.min_hits or self.n_converted == 0:
+            return remaining
+        cv = self.amplitude.rms() / abs(self.amplitude.mean) if self.amplitude.mean else float("inf")
+        hits_needed = (cv / self.target_rel_error) ** 2 - self.amplitude.n
+        hit_fraction = self.amplitude.n / self.n_converted
+        if not math.isfinite(hits_needed) or hit_fraction <= 0:
+            return remaining
+        # events already acquired but not converted yet count towards it
+        pending = self.collected - self.n_converted
+        return min(remaining, max(int(math.ceil(hits_needed / hit_fraction)) - pending, 0))
+
+    def next_size(self):
+        n = self.max_segments
+        if self.rate:
+            n = int(self.rate * self.max_seconds)
+        n = max(self.min_segments, min(n, self.max_segments))
+        n = min(n, max(self.events_still_needed(), self.min_segments))
+        return max(1, min(n, self.target_events - self.collected))
+
+    def wait_seconds(self, n_events):
+        # WAIT argument: three times the expected duration, at least 10 s
+        if not self.rate:
+            return 600
+        return max(10, int(3 * n_events / self.rate) + 1)
+
+
+def hit_amplitudes(filepath, ichan, threshold):
+    import uproot as ur
+
+    with ur.open(filepath) as f:
+        frames = f["pulse"]["channel"].array(library="np")[:, ichan, :]
+    amplitude = frames.max(axis=1) - frames[:, :BASELINE_SAMPLES].mean(axis=1)
+    return frames.shape[0], amplitude[amplitude > threshold]
+
+
+class SequenceWorker:
+    # copies and converts finished sequences in a background thread
+
+    def __init__(self, run_number, waveforms_path, raw_data_path, converted_path,
+                 stat_channel, threshold, skip_channels=""):
+        self.run_number = run_number
+        self.waveforms_path = waveforms_path
+        self.raw_data_path = raw_data_path
+        self.converted_path = converted_path
+        self.stat_channel = stat_channel
+        self.threshold = threshold
+        self.skip_channels = skip_channels      # "7,8": neither copied nor converted
+        self.thread = None
+        self.result = None
+        self.parts = []
+        self.failed = []        # (sequence, error) of the sequences that were not converted
+
+    def submit(self, sequence, event_offset):
+        # waits for the previous sequence, starts this one and returns the
+        # (events, hit amplitudes) of the previous one
+        previous = self.wait()
+        self.thread = threading.Thread(target=self._process, args=(sequence, event_offset))
+        self.thread.start()
+        return previous
+
+    def wait(self):
+        # returns (events, hit amplitudes) of the running sequence, None if idle
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        result, self.result = self.result, None
+        return result
+
+    def _process(self, sequence, event_offset):
+        # runs in the worker thread: any error ends up in self.failed, the
+        # acquisition loop checks it after every submit()/wait()
+        try:
+            self.result = self._convert(sequence, event_offset)
+        except Exception as e:
+            print("Sequence %i not converted: %s" % (sequence, e))
+            self.failed.append((sequence, str(e)))
+            self.result = (0, [])
+
+    def _convert(self, sequence, event_offset):
+        start = time.time()
+        import conversion
+        trace = "Trace%i_%i" % (self.run_number, sequence)
+        skip = conversion.parse_channels(self.skip_channels)
+        for filepath in conversion.find_channels(self.waveforms_path, trace, skip).values():
+            shutil.copy(filepath, self.raw_data_path)
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "conversion.py")
+        proc = subprocess.run([sys.executable, script, "--runNumber", str(self.run_number),
+                               "--sequence", str(sequence), "--eventOffset", str(event_offset),
+                               "--skipChannels", self.skip_channels],
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError("conversion.py exited with %i:\n%s" % (proc.returncode, proc.stderr))
+        part = "%s/converted_run%i_%i.root" % (self.converted_path, self.run_number, sequence)
+        self.parts.append(part)
+        result = hit_amplitudes(part, self.stat_channel, self.threshold)
+        print("\tSequence %i copied and converted in %0.1f s" % (sequence, time.time() - start))
+        return result
+
+    def merge(self):
+        # concatenates the converted sequences, in order, into converted_run{N}.root
+        self.wait()
+        output = "%s/converted_run%i.root" % (self.converted_path, self.run_number)
+        if not self.parts:
+            return None
+        subprocess.run(["hadd", "-f", output] + self.parts, check=True, capture_output=True)
+        for part in self.parts:
+            os.remove(part)
+        return output
@@ -0,0 +1,218 @@
+# skim.py
+# Hit-event skims of converted runs.
+#
+# A cheap selection is applied once per run and only the passing events are
+# written to skim_run{N}.root, with their original i_evt and entry number in
+# converted_run{N}.root, so later iterations of an analysis read a small
+# fraction of the data. The number of events and passing events of every run
+# goes into the skims table of the run catalog, which gives efficiency maps
+# over the scan positions without opening any file.
+#
+# A selection is a comma separated list of cuts on scope channels, all of
+# which must pass (or any of them with match="any"):
+#
+#   amp:6>0.1       sample over 0.1 V above the baseline on C6
+#   amp:6>5sigma    same, over 5 x the pedestal RMS of C6 (pedestals.py)
+#   cfd:6=10:20     CFD time of C6 (out_run{N}.root, LP2_20) within [10, 20) ns
+#
+#   python skim.py --first 1 --last 280 --select "amp:6>0.1" --jobs 8
+#   events = load_skim(120, ["channel", "i_evt"])
+#   eff = efficiency_table("amp:6>0.1", first=1, last=280)
+
+import os
+import re
+import time
+from collections import namedtuple
+
+import numpy as np
+
+import constants
+
+
+SKIM_PATH = constants.SKIM_PATH
+CFD_BRANCH = "LP2_20"
+BASELINE_SAMPLES = 100
+CHUNK_EVENTS = 500
+COPY_BRANCHES = ["i_evt", "segment_time", "channel", "time", "timeoffsets"]
+
+Cut = namedtuple("Cut", ["kind", "channel", "low", "high", "nsigma"])
+
+_CUT = re.compile(r"^(amp|cfd):C?(\d+)(?:>([-+.\deE]+)(sigma)?|=([-+.\deE]+):([-+.\deE]+))$")
+
+
+def parse_selection(text):
+    cuts = []
+    for term in text.replace(" ", "").split(","):
+        match = _CUT.match(term)
+        if not match:
+            raise ValueError("Cannot parse cut %r (amp:6>0.1, amp:6>5sigma or cfd:6=10:20)" % term)
+        kind, channel, low, sigma, window_low, window_high = match.groups()
+        if kind == "amp" and low is not None:
+            cuts.append(Cut(kind, int(channel), float(low) if not sigma else None, None,
+                            float(low) if sigma else None))
+        elif kind == "cfd" and window_low is not None:
+            cuts.append(Cut(kind, int(channel), float(window_low), float(window_high), None))
+        else:
+            raise ValueError("Cut %r: amp takes '>value', cfd takes '=low:high'" % term)
+    return cuts
+
+
+def skim_file(run, skim_path=SKIM_PATH):
+    return "%s/skim_run%i.root" % (skim_path, run)
+
+
+def _channel_ids(f):
+    # converted scope channels; C{n} is index n-1 of channel[] (conversion.py channel_map)
+    nslots = f["pulse"]["channel"].array(entry_stop=1, library="np").shape[1]
+    if "channel_map" in f:
+        converted = f["channel_map"]["converted"].array(library="np")[0]
+        return [k + 1 for k in range(nslots) if converted[k]]
+    return list(range(1, nslots + 1))
+
+
+def skim_run(run, selection, match="all", converted_path=constants.CONVERTED_PATH,
+             preprocessed_path=constants.PREPROCESSED_PATH, skim_path=SKIM_PATH):
+    # writes skim_run{N}.root and returns (events, passed)
+    import uproot as ur
+
+    cuts = parse_selection(selection) if isinstance(selection, str) else list(selection)
+    source = "%s/converted_run%i.root" % (converted_path, run)
+    with ur.open(source) as f:
+        ids = _channel_ids(f)
+        branches = [b for b in COPY_BRANCHES if b in f["pulse"]]
+        channel_map = f["channel_map"].arrays(["channel_id", "converted"], library="np") if "channel_map" in f else None
+
+    thresholds = {}
+    if any(c.nsigma is not None for c in cuts):
+        import pedestals
+        peds = pedestals.smoothed_pedestals(run)
+        for c in cuts:
+            if c.nsigma is not None:
+                if c.channel not in peds:
+                    raise ValueError("Run %i: no pedestal of C%i for %s" % (run, c.channel, selection))
+                # the cut is on the amplitude above the event baseline
+                thresholds[c] = c.nsigma * peds[c.channel]["rms"]
+    cfd = None
+    if any(c.kind == "cfd" for c in cuts):
+        with ur.open("%s/out_run%i.root" % (preprocessed_path, run)) as f:
+            cfd = f["pulse"][CFD_BRANCH].array(library="np")
+
+    entries, kept = [], {b: [] for b in branches}
+    n_events = 0
+    for chunk in ur.iterate("%s:pulse" % source, branches, step_size=CHUNK_EVENTS, library="np"):
+        frames = chunk["channel"]
+        n = frames.shape[0]
+        results = []
+        for c in cuts:
+            if c.channel not in ids:
+                raise ValueError("Run %i: C%i was not converted" % (run, c.channel))
+            k = c.channel - 1
+            if c.kind == "amp":
+                wave = frames[:, k, :]
+                amplitude = wave.max(axis=1) - wave[:, :BASELINE_SAMPLES].mean(axis=1)
+                results.append(amplitude > thresholds.get(c, c.low))
+            else:
+                t = cfd[n_events:n_events + n, k]
+                results.append((t >= c.low) & (t < c.high) & (t != 0))
+        passed = np.logical_and.reduce(results) if match == "all" else np.logical_or.reduce(results)
+        entries.append(n_events + np.flatnonzero(passed))
+        for b in branches:
+            kept[b].append(chunk[b][passed])
+        n_events += n
+    if n_events == 0:
+        raise ValueError("Run %i: no events in %s" % (run, source))
+    if cfd is not None and len(cfd) != n_events:
+        raise ValueError("Run %i: %i preprocessed events for %i converted" % (run, len(cfd), n_events))
+
+    os.makedirs(skim_path, exist_ok=True)
+    output = skim_file(run, skim_path)
+    tmp = output + ".tmp"
+    with ur.recreate(tmp) as out:
+        tree = {b: np.concatenate(kept[b]) for b in branches}
+        tree["entry"] = np.concatenate(entries).astype(np.uint32)
+        out["pulse"] = tree
+        if channel_map is not None:
+            out["channel_map"] = channel_map
+        out["selection"] = selection if isinstance(selection, str) else repr(cuts)
+    os.replace(tmp, output)
+    return n_events, len(tree["entry"])
+
+
+def _skim_job(job):
+    run, selection, match, converted_path, preprocessed_path, skim_path = job
+    try:
+        return run, skim_run(run, selection, match, converted_path, preprocessed_path, skim_path), None
+    except Exception as e:
+        return run, None, str(e)
+
+
+def skim_runs(runs, selection, match="all", converted_path=constants.CONVERTED_PATH,
+              preprocessed_path=constants.PREPROCESSED_PATH, skim_path=SKIM_PATH, jobs=1):
+    # skims several runs in parallel and records the pass counts in the catalog
+    from runcatalog import RunCatalog
+    parse_selection(selection)      # fail before starting the workers
+    work = [(run, selection, match, converted_path, preprocessed_path, skim_path) for run in runs]
+    if jobs > 1 and len(work) > 1:
+        from multiprocessing import Pool
+        with Pool(jobs) as pool:
+            results = pool.map(_skim_job, work)
+    else:
+        results = [_skim_job(job) for job in work]
+    label = selection if match == "all" else "any(%s)" % selection
+    with RunCatalog() as catalog:
+        for run, counts, error in results:
+            if error:
+                print("Run %i: skim failed (%s)" % (run, error))
+                continue
+            catalog.record_skim(run, label, counts[0], counts[1])
+            print("Run %i: %i / %i events pass %s" % (run, counts[1], counts[0], label))
+    return results
+
+
+def load_skim(run, branches=None, skim_path=SKIM_PATH):
+    # {branch: array} of the passing events of one run
+    import uproot as ur
+    with ur.open(skim_file(run, skim_path)) as f:
+        return f["pulse"].arrays(branches, library="np")
+
+
+def efficiency_table(selection, first=None, last=None):
+    # pass fraction per run with its binomial error and the run coordinates
+    import pandas as pd
+    from runcatalog import RunCatalog
+    with RunCatalog() as catalog:
+        table = pd.DataFrame(catalog.skims(first, last, selection))
+    if len(table):
+        table["efficiency"] = table["passed"] / table["events"].clip(lower=1)
+        table["efficiency_err"] = np.sqrt(table["efficiency"] * (1 - table["efficiency"])
+                                          / table["events"].clip(lower=1))
+    return table
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write hit-event skims of converted runs.')
+    parser.add_argument('--runNumber', type=int, default=None)
+    parser.add_argument('--first', type=int, default=None, help='first run of a range')
+    parser.add_argument('--last', type=int, default=None, help='last run of a range (inclusive)')
+    parser.add_argument('--select', type=str, required=True, help='cuts, e.g. "amp:6>0.1" or "amp:2>5sigma,cfd:2=10:20"')
+    parser.add_argument('--any', action='store_true', help='keep events passing any cut instead of all')
+    parser.add_argument('--jobs', type=int, default=1, help='parallel processes')
+    parser.add_argument('--convertedPath', type=str, default=constants.CONVERTED_PATH)
+    parser.add_argument('--preprocessedPath', type=str, default=constants.PREPROCESSED_PATH)
+    parser.add_argument('--skimPath', type=str, default=SKIM_PATH)
+    args = parser.parse_args()
+
+    if args.runNumber is not None:
+        runs = [args.runNumber]
+    elif args.first is not None and args.last is not None:
+        runs = range(args.first, args.last + 1)
+    else:
+        parser.error("give --runNumber or --first/--last")
+    start = time.time()
+    results = skim_runs(runs, args.select, "any" if args.any else "all", args.convertedPath,
+                        args.preprocessedPath, args.skimPath, args.jobs)
+    done = [c for _, c, e in results if not e]
+    print("%i runs skimmed in %0.1f s, %i / %i events kept" % (
+        len(done), time.time() - start, sum(c[1] for c in done), sum(c[0] for c in done)))
@@ -0,0 +1,203 @@
+# templates.py
+# Average pulse templates and template-fit amplitude/timing of all events.
+#
+# For every channel of a run, the hit events are aligned on their leading
+# edge with a sub-sample shift, normalized and averaged on an upsampled grid
+# (upsample points per sample). Each event is then fitted with
+# y(t) = A * T(t - s) by a linearized least-squares shift (Gauss-Newton on s,
+# linear in A), solved for all events at once with batched 2x2 normal
+# equations. This replaces the per-event gaus/pol fits of DatAnalyzer for
+# amplitude and time at vectorized cost; the template is refined with the
+# fitted times a few times.
+#
+#   t, frames = noise.load_channel("converted_run12.root", 3)
+#   result = template_timing(t, frames)
+#   result["time"], result["amplitude"], result["chi2"]
+
+import numpy as np
+
+
+UPSAMPLE = 10
+PRE_SAMPLES = 20        # template window before the leading edge
+POST_SAMPLES = 40       # and after it
+BASELINE_SAMPLES = 100
+HIT_THRESHOLD = 0.1     # V
+EDGE_FRACTION = 0.5
+TEMPLATE_ITERATIONS = 2
+FIT_ITERATIONS = 4
+MAX_STEP = 1.           # samples per Gauss-Newton step
+
+
+def interpolate_frames(frames, positions):
+    # frames (events, points) at fractional sample positions (events, k),
+    # linear interpolation, NaN outside the frame
+    npoints = frames.shape[1]
+    i0 = np.floor(positions).astype(np.int64)
+    frac = positions - i0
+    valid = (i0 >= 0) & (i0 + 1 < npoints)
+    i0 = np.clip(i0, 0, npoints - 2)
+    rows = np.arange(frames.shape[0])[:, None]
+    values = frames[rows, i0] * (1 - frac) + frames[rows, i0 + 1] * frac
+    return np.where(valid, values, np.nan)
+
+
+def leading_edge_times(frames, fraction=EDGE_FRACTION):
+    # fractional sample where each pulse first crosses fraction * its maximum
+    # on the way up to the maximum (a simple CFD); also returns the maxima
+    npoints = frames.shape[1]
+    peak = np.argmax(frames, axis=1)
+    amplitude = frames[np.arange(len(frames)), peak]
+    level = fraction * amplitude
+    idx = np.arange(npoints)[None, :]
+    below = (frames < level[:, None]) & (idx < peak[:, None])
+    has_below = below.any(axis=1)
+    last_below = npoints - 1 - np.argmax(below[:, ::-1], axis=1)
+    j = np.where(has_below, last_below, np.maximum(peak - 1, 0))
+    j = np.clip(j, 0, npoints - 2)
+    rows = np.arange(len(frames))
+    y0, y1 = frames[rows, j], frames[rows, j + 1]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(y1 != y0, (level - y0) / (y1 - y0), 0.)
+    return j + np.clip(frac, 0., 1.), amplitude
+
+
+class Template:
+
+    def __init__(self, tau, values, n_events):
+        # tau: offsets in samples from the reference edge, values: normalized shape
+        self.tau = tau
+        self.values = values
+        self.derivative = np.gradient(values, tau)
+        self.n_events = n_events
+
+    def evaluate(self, x):
+        # template and its derivative at offsets x (samples), 0 outside
+        return (np.interp(x, self.tau, self.values, left=0., right=0.),
+                np.interp(x, self.tau, self.derivative, left=0., right=0.))
+
+    def save(self, path, **attrs):
+        np.savez(path, tau=self.tau, values=self.values, n_events=self.n_events, **attrs)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["tau"], data["values"], int(data["n_events"]))
+
+
+def average_template(frames, times, amplitudes, upsample=UPSAMPLE, pre=PRE_SAMPLES, post=POST_SAMPLES):
+    # mean of the normalized pulses sampled at time + tau
+    tau = np.arange(-pre * upsample, post * upsample + 1) / upsample
+    shapes = interpolate_frames(frames, times[:, None] + tau[None, :]) / amplitudes[:, None]
+    values = np.nanmean(shapes, axis=0)
+    peak = np.nanmax(values) if np.isfinite(values).any() else np.nan
+    if not peak > 0:
+        raise ValueError("Average pulse of %i events has no positive peak, cannot normalize the template" % len(frames))
+    values = np.nan_to_num(values / peak)
+    return Template(tau, values, len(frames))
+
+
+def fit_template(frames, template, times, amplitudes, pre=PRE_SAMPLES, post=POST_SAMPLES,
+                 iterations=FIT_ITERATIONS, noise=None):
+    # Gauss-Newton fit of y = A*T(k - s) around the initial (s, A) of every
+    # event, over the samples k in [s - pre, s + post]. Linearized around s:
+    # y = A*T + c*(-T') with c = A*ds, solved for (A, c) in one batched 2x2 solve.
+    # Returns times (samples), amplitudes and chi2/ndf (noise in V, else RMS residual^2)
+    frames = np.asarray(frames, dtype=np.float64)
+    npoints = frames.shape[1]
+    rows = np.arange(len(frames))[:, None]
+    s = np.asarray(times, dtype=np.float64).copy()
+    A = np.asarray(amplitudes, dtype=np.float64).copy()
+    offsets = np.arange(-pre, post + 1)
+    for _ in range(iterations):
+        k = np.round(s).astype(np.int64)[:, None] + offsets[None, :]
+        inside = (k >= 0) & (k < npoints)
+        y = np.where(inside, frames[rows, np.clip(k, 0, npoints - 1)], 0.)
+        T, D = template.evaluate(k - s[:, None])
+        T, D = T * inside, -D * inside
+        a11, a12, a22 = (T * T).sum(1), (T * D).sum(1), (D * D).sum(1)
+        b1, b2 = (T * y).sum(1), (D * y).sum(1)
+        det = a11 * a22 - a12 ** 2
+        ok = det > 1e-12 * np.maximum(a11 * a22, 1e-30)
+        det = np.where(ok, det, 1.)
+        A_new = (a22 * b1 - a12 * b2) / det
+        c = (a11 * b2 - a12 * b1) / det
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ds = np.where(ok & (A_new != 0), c / A_new, 0.)
+        A = np.where(ok, A_new, A)
+        s = s + np.clip(ds, -MAX_STEP, MAX_STEP)
+
+    k = np.round(s).astype(np.int64)[:, None] + offsets[None, :]
+    inside = (k >= 0) & (k < npoints)
+    y = np.where(inside, frames[rows, np.clip(k, 0, npoints - 1)], 0.)
+    T, _ = template.evaluate(k - s[:, None])
+    residual = (y - A[:, None] * T) * inside
+    ndf = np.maximum(inside.sum(1) - 2, 1)
+    chi2 = (residual ** 2).sum(1) / ndf
+    if noise is not None:
+        chi2 = chi2 / np.asarray(noise) ** 2
+    return s, A, chi2
+
+
+def template_timing(t, frames, hit_threshold=HIT_THRESHOLD, baseline=BASELINE_SAMPLES,
+                    upsample=UPSAMPLE, pre=PRE_SAMPLES, post=POST_SAMPLES,
+                    template_iterations=TEMPLATE_ITERATIONS, template=None):
+    # full chain for one channel: baseline subtraction, template from the hit
+    # events (unless one is given), fit of every event; times in seconds on the
+    # time axis of the event, NaN for events below threshold
+    frames = np.asarray(frames, dtype=np.float64)
+    t = np.broadcast_to(np.asarray(t, dtype=np.float64), frames.shape)
+    base = frames[:, :baseline]
+    frames = frames - base.mean(axis=1, keepdims=True)
+    noise = base.std(axis=1)
+    dt = float(np.median(np.diff(t[0])))
+
+    edge, amplitude = leading_edge_times(frames)
+    hits = amplitude > hit_threshold
+    if template is None:
+        if hits.sum() < 2:
+            raise ValueError("Not enough hits above %.3f V to build a template" % hit_threshold)
+        template = average_template(frames[hits], edge[hits], amplitude[hits], upsample, pre, post)
+        for _ in range(template_iterations):
+            s, A, _ = fit_template(frames[hits], template, edge[hits], amplitude[hits], pre, post)
+            good = np.isfinite(s) & (A > 0)
+            if good.sum() < 2:
+                break       # keep the previous template
+            template = average_template(frames[hits][good], s[good], A[good], upsample, pre, post)
+
+    s, A, chi2 = fit_template(frames, template, edge, amplitude, pre, post, noise=noise)
+    # sample position -> seconds on the per-event time axis
+    times = t[:, 0] + s * dt
+    return {
+        "template": template,
+        "hit": hits,
+        "time": np.where(hits, times, np.nan),
+        "amplitude": np.where(hits, A, np.nan),
+        "chi2": np.where(hits, chi2, np.nan),
+        "edge_time": np.where(hits, t[:, 0] + edge * dt, np.nan),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    import noise as noise_tools
+
+    parser = argparse.ArgumentParser(description='Template-fit amplitude and timing of one or more channels.')
+    parser.add_argument('file', type=str, help='converted_run{N}.root')
+    parser.add_argument('--channels', type=int, nargs='+', default=[1, 3, 5])
+    parser.add_argument('--threshold', type=float, default=HIT_THRESHOLD)
+    parser.add_argument('--output', type=str, default=None, help='.npz with per-event results and templates')
+    args = parser.parse_args()
+
+    results = {}
+    for ichan in args.channels:
+        t, frames = noise_tools.load_channel(args.file, ichan)
+        r = template_timing(t, frames, hit_threshold=args.threshold)
+        print("CH%i: %i/%i hits, amplitude %.4f V, template from %i events, median chi2/ndf %.2f" % (
+            ichan + 1, r["hit"].sum(), len(frames), np.nanmean(r["amplitude"]),
+            r["template"].n_events, np.nanmedian(r["chi2"])))
+        for key in ["time", "amplitude", "chi2"]:
+            results["%s_%i" % (key, ichan)] = r[key]
+        results["template_tau_%i" % ichan] = r["template"].tau
+        results["template_%i" % ichan] = r["template"].values
+    if args.output:
+        np.savez(args.output, **results)
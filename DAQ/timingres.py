@@ -0,0 +1,207 @@
+# timingres.py
+# Channel-pair time resolution over whole scans.
+#
+# For every run the per-event timestamps of DatAnalyzer's out_run{N}.root
+# (LP2_xx CFD times by default, or any (events, channels) time branch) are
+# combined into dt = t[a] - t[b] for each requested channel pair. The core of
+# each dt distribution is fitted robustly (iterated +-2 sigma truncated
+# moments, corrected for the truncation) and bootstrap resampling gives the
+# errors on mean and sigma. Runs are processed in parallel and the results are
+# keyed by the run catalog coordinates, so resolution vs position for a scan
+# is one call:
+#
+#   python timingres.py --first 1 --last 280 --pairs 2-0 4-0 6-0 2-1 --jobs 8
+#   table = scan_resolution(range(1, 281), [(2, 0), (4, 0)])
+#   z, x, sigma = resolution_grid(table, (2, 0))
+
+import os
+
+import numpy as np
+
+import constants
+
+
+TIME_BRANCH = "LP2_20"
+AMP_BRANCH = "amp"
+HIT_AMPLITUDE = 30.     # same units as the amp branch (mV), |ConstantThreshold|
+CORE_NSIGMA = 2.
+CORE_ITERATIONS = 6
+BOOTSTRAP = 200
+TIME_TO_PS = 1000.      # DatAnalyzer times are in ns
+RESULTS_PATH = constants.BASE_PATH + "/TimingResolution.csv"
+
+
+def _truncated_sigma_factor(nsigma):
+    # std of a unit Gaussian truncated at +-nsigma
+    from math import erf, exp, pi, sqrt
+    phi = exp(-0.5 * nsigma ** 2) / sqrt(2 * pi)
+    mass = erf(nsigma / sqrt(2))
+    return sqrt(1 - 2 * nsigma * phi / mass)
+
+
+def core_gaussian(dt, nsigma=CORE_NSIGMA, iterations=CORE_ITERATIONS):
+    # robust mean/sigma of the Gaussian core along the last axis; dt may be
+    # (n,) or (samples, n) with NaN for missing entries. Starts from median and
+    # MAD and iterates truncated moments inside mean +- nsigma*sigma
+    dt = np.asarray(dt, dtype=np.float64)
+    squeeze = dt.ndim == 1
+    dt = np.atleast_2d(dt)
+    valid = np.isfinite(dt)
+    mean = np.nanmedian(dt, axis=1)
+    sigma = 1.4826 * np.nanmedian(np.abs(dt - mean[:, None]), axis=1)
+    factor = _truncated_sigma_factor(nsigma)
+    counts = valid.sum(axis=1)
+    for _ in range(iterations):
+        window = valid & (np.abs(dt - mean[:, None]) <= nsigma * sigma[:, None])
+        counts = window.sum(axis=1)
+        values = np.where(window, dt, 0.)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean_new = values.sum(axis=1) / counts
+            var = np.where(window, (dt - mean_new[:, None]) ** 2, 0.).sum(axis=1) / np.maximum(counts - 1, 1)
+        sigma_new = np.sqrt(var) / factor
+        ok = counts > 2
+        mean = np.where(ok, mean_new, mean)
+        sigma = np.where(ok, sigma_new, sigma)
+    if squeeze:
+        return float(mean[0]), float(sigma[0]), int(counts[0])
+    return mean, sigma, counts
+
+
+def bootstrap_core(dt, n_bootstrap=BOOTSTRAP, seed=0, nsigma=CORE_NSIGMA):
+    # (mean, sigma, mean_err, sigma_err, n_core) with all bootstrap samples
+    # fitted in one vectorized call
+    dt = np.asarray(dt, dtype=np.float64)
+    dt = dt[np.isfinite(dt)]
+    if dt.size < 3:
+        return np.nan, np.nan, np.nan, np.nan, dt.size
+    mean, sigma, n_core = core_gaussian(dt, nsigma)
+    rng = np.random.default_rng(seed)
+    samples = dt[rng.integers(0, dt.size, size=(n_bootstrap, dt.size))]
+    means, sigmas, _ = core_gaussian(samples, nsigma)
+    return mean, sigma, float(np.nanstd(means)), float(np.nanstd(sigmas)), n_core
+
+
+def pair_label(pair):
+    return "CH%i-CH%i" % (pair[0] + 1, pair[1] + 1)
+
+
+def parse_pair(text):
+    # "2-0" (channel indices) or "CH3-CH1"
+    a, b = text.upper().replace("CH", "").split("-")
+    offset = 1 if "CH" in text.upper() else 0
+    return int(a) - offset, int(b) - offset
+
+
+def read_times(filepath, time_branch=TIME_BRANCH, amp_branch=AMP_BRANCH):
+    import uproot as ur
+    with ur.open(filepath) as f:
+        tree = f["pulse"]
+        times = tree[time_branch].array(library="np")
+        amps = tree[amp_branch].array(library="np") if amp_branch in tree else None
+    return np.asarray(times, dtype=np.float64), amps
+
+
+def run_resolution(run, pairs, preprocessed_path=constants.PREPROCESSED_PATH, time_branch=TIME_BRANCH,
+                   amp_branch=AMP_BRANCH, hit_amplitude=HIT_AMPLITUDE, n_bootstrap=BOOTSTRAP):
+    # one row per pair for one run
+    filepath = "%s/out_run%i.root" % (preprocessed_path, run)
+    times, amps = read_times(filepath, time_branch, amp_branch)
+    hit = np.ones(times.shape, dtype=bool) if amps is None else np.abs(amps) > hit_amplitude
+    hit &= np.isfinite(times) & (times != 0)
+    rows = []
+    for a, b in pairs:
+        dt = np.where(hit[:, a] & hit[:, b], times[:, a] - times[:, b], np.nan)
+        mean, sigma, mean_err, sigma_err, n_core = bootstrap_core(dt, n_bootstrap, seed=run)
+        rows.append({
+            "run": run, "pair": pair_label((a, b)), "channel_a": a, "channel_b": b,
+            "n_events": len(times), "n_pairs": int(np.isfinite(dt).sum()), "n_core": n_core,
+            "mean": mean, "sigma": sigma, "mean_err": mean_err, "sigma_err": sigma_err,
+            "sigma_ps": sigma * TIME_TO_PS, "sigma_err_ps": sigma_err * TIME_TO_PS,
+        })
+    return rows
+
+
+def _run_job(job):
+    run, kwargs = job
+    try:
+        return run, run_resolution(run, **kwargs), None
+    except Exception as e:
+        return run, [], str(e)
+
+
+def scan_resolution(runs, pairs, jobs=1, catalog_path=constants.CATALOG_PATH, **kwargs):
+    # DataFrame with one row per (run, pair), joined with x/y/z/power of the catalog
+    import pandas as pd
+    kwargs["pairs"] = pairs
+    work = [(run, kwargs) for run in runs]
+    if jobs > 1 and len(work) > 1:
+        from multiprocessing import Pool
+        with Pool(jobs) as pool:
+            results = pool.map(_run_job, work)
+    else:
+        results = [_run_job(job) for job in work]
+    rows = []
+    for run, run_rows, error in results:
+        if error:
+            print("Run %i: skipped (%s)" % (run, error))
+        rows += run_rows
+    table = pd.DataFrame(rows)
+    for column in ["x", "y", "z", "power"]:
+        table[column] = np.nan
+    if len(table) and os.path.exists(catalog_path):
+        from runcatalog import RunCatalog
+        with RunCatalog(catalog_path) as catalog:
+            keys = {r["run"]: r for r in catalog.runs()}
+        for column in ["x", "y", "z", "power"]:
+            values = [keys.get(run, {}).get(column) for run in table["run"]]
+            table[column] = [np.nan if v is None else float(v) for v in values]
+    return table
+
+
+def resolution_grid(table, pair, value="sigma_ps", power=None):
+    # (z values, x values, 2D [z, x]) of one pair for the scan map
+    label = pair if isinstance(pair, str) else pair_label(pair)
+    rows = table[table["pair"] == label]
+    if power is not None:
+        rows = rows[rows["power"] == power]
+    grid = rows.pivot_table(index="z", columns="x", values=value, aggfunc="mean")
+    return grid.index.to_numpy(), grid.columns.to_numpy(), grid.to_numpy()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Channel-pair time resolution for a range of runs.')
+    parser.add_argument('--first', type=int, required=True, help='first run')
+    parser.add_argument('--last', type=int, required=True, help='last run (inclusive)')
+    parser.add_argument('--pairs', type=str, nargs='+', default=['2-0', '4-0', '6-0'],
+                        help='channel index pairs a-b (dt = t_a - t_b), or CH3-CH1')
+    parser.add_argument('--timeBranch', type=str, default=TIME_BRANCH)
+    parser.add_argument('--hitAmplitude', type=float, default=HIT_AMPLITUDE)
+    parser.add_argument('--bootstrap', type=int, default=BOOTSTRAP)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--preprocessedPath', type=str, default=constants.PREPROCESSED_PATH)
+    parser.add_argument('--output', type=str, default=RESULTS_PATH)
+    parser.add_argument('--plot', action='store_true', help='draw the Z-X map of every pair')
+    args = parser.parse_args()
+
+    pairs = [parse_pair(p) for p in args.pairs]
+    table = scan_resolution(range(args.first, args.last + 1), pairs, jobs=args.jobs,
+                            preprocessed_path=args.preprocessedPath, time_branch=args.timeBranch,
+                            hit_amplitude=args.hitAmplitude, n_bootstrap=args.bootstrap)
+    table.to_csv(args.output, index=False)
+    if len(table):
+        print(table.groupby("pair")[["sigma_ps", "sigma_err_ps"]].median())
+    print("Results of %i rows written to %s" % (len(table), args.output))
+
+    if args.plot and len(table):
+        import matplotlib.pyplot as plt
+        fig, axes = plt.subplots(1, len(pairs), figsize=(5 * len(pairs), 4), squeeze=False)
+        for ax, pair in zip(axes[0], pairs):
+            z, x, sigma = resolution_grid(table, pair)
+            mesh = ax.pcolormesh(x, z, sigma, shading='nearest')
+            fig.colorbar(mesh, ax=ax, label="sigma [ps]")
+            ax.set_title(pair_label(pair))
+            ax.set_xlabel("X [um]")
+            ax.set_ylabel("Z [um]")
+        plt.show()
@@ -0,0 +1,353 @@
+# trcarchive.py
+# Compressed archive of the raw .trc files of a run (Trace{run}.trca).
+#
+# All channel files of a run go into one container. For every channel the
+# bytes in front of the sample array (WAVEDESC, user text and TRIGTIME block)
+# are kept verbatim; the int16 (or int8, byte-format traces) samples are split
+# in blocks of block_segments segments, delta-coded along each segment, byte-shuffled and compressed
+# (zstd when the zstandard module is installed, else zlib or lzma) so one
+# segment is restored by decompressing a single block. Any bytes after the
+# sample array are kept verbatim too, and a SHA-256 per channel checks that
+# extract() gives back the original file.
+#
+# Layout: magic | compressed chunks ... | JSON index | u64 index offset | magic
+#
+#   python trcarchive.py pack --rawPath RawData_from_oscilloscope --runNumber 12 --delete
+#   python trcarchive.py extract --archive Trace12.trca --output restored/
+#
+#   archive = TrcArchive("Trace12.trca")
+#   adc = archive.read_segments(3, 500, 501)        # CH3, segment 500 -> (1, points)
+#   conversion.get_configuration(archive.member(3)) # members read like .trc files
+
+import glob
+import hashlib
+import io
+import json
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+
+MAGIC = b"FCFDTRCA"
+ARCHIVE_VERSION = 1
+EXTENSION = ".trca"
+DEFAULT_BLOCK_SEGMENTS = 100
+DEFAULT_LEVELS = {"zstd": 9, "zlib": 6, "lzma": 6}
+CACHED_BLOCKS = 16      # one or two blocks of every channel while converting event by event
+
+
+def default_codec():
+    try:
+        import zstandard
+        return "zstd"
+    except ImportError:
+        return "zlib"
+
+
+def compress(data, codec, level):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    if codec == "lzma":
+        import lzma
+        return lzma.compress(data, preset=level)
+    return zlib.compress(data, level)
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "lzma":
+        import lzma
+        return lzma.decompress(data)
+    return zlib.decompress(data)
+
+
+def encode_block(adc):
+    # (segments, points) int16/int8 -> delta along the segment, bytes of a
+    # sample split into planes
+    delta = adc.copy()
+    delta[:, 1:] = np.diff(adc, axis=1)     # wraps like the sample type, cumsum undoes it
+    size = adc.dtype.itemsize
+    return delta.view(np.uint8).reshape(-1, size).T.tobytes()
+
+
+def decode_block(data, nsegments, points, dtype="<i2"):
+    dtype = np.dtype(dtype)
+    shuffled = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, -1)
+    delta = np.ascontiguousarray(shuffled.T).view(dtype).reshape(nsegments, points)
+    return np.cumsum(delta, axis=1, dtype=dtype)
+
+
+def trace_files(raw_path, trace_name):
+    # {channel number: path} of C{n}--{trace_name}.trc
+    files = {}
+    for path in glob.glob(os.path.join(raw_path, "C*--%s.trc" % trace_name)):
+        match = re.match(r"C(\d+)--", os.path.basename(path))
+        if match:
+            files[int(match.group(1))] = path
+    return dict(sorted(files.items()))
+
+
+def pack_run(files, archive_path, block_segments=DEFAULT_BLOCK_SEGMENTS, codec=None, level=None):
+    # files: {channel number: .trc path}; returns (raw bytes, archive bytes)
+    import conversion
+    codec = codec or default_codec()
+    level = DEFAULT_LEVELS[codec] if level is None else level
+    index = {"version": ARCHIVE_VERSION, "codec": codec, "level": level,
+             "block_segments": block_segments, "channels": {}}
+    raw_bytes = 0
+    tmp = archive_path + ".tmp"
+    with open(tmp, "wb") as out:
+        out.write(MAGIC)
+
+        def put(data):
+            start = out.tell()
+            out.write(compress(data, codec, level))
+            return [start, out.tell() - start]
+
+        for ch, path in files.items():
+            with open(path, "rb") as f:
+                content = f.read()
+            raw_bytes += len(content)
+            _, full_offset = conversion.get_waveform_block_offset(path)
+            nsegments, points, _, _, _ = conversion.get_configuration(path)
+            dtype = conversion.get_sample_format(path)
+            data_bytes = conversion.SAMPLE_BYTES[dtype] * nsegments * points
+            adc = np.frombuffer(content, dtype=dtype, count=nsegments * points,
+                                offset=full_offset).reshape(nsegments, points)
+            blocks = []
+            for first in range(0, nsegments, block_segments):
+                blocks.append(put(encode_block(adc[first:first + block_segments])))
+            index["channels"][str(ch)] = {
+                "name": os.path.basename(path),
+                "size": len(content),
+                "sha256": hashlib.sha256(content).hexdigest(),
+                "data_offset": full_offset,
+                "nsegments": nsegments,
+                "points": points,
+                "dtype": dtype,
+                "header": put(content[:full_offset]),
+                "tail": put(content[full_offset + data_bytes:]),
+                "blocks": blocks,
+            }
+        index_offset = out.tell()
+        out.write(json.dumps(index).encode())
+        out.write(struct.pack("<Q", index_offset))
+        out.write(MAGIC)
+    os.replace(tmp, archive_path)
+    return raw_bytes, os.path.getsize(archive_path)
+
+
+class ArchiveMember:
+    # one channel of an archive, readable like the original .trc file:
+    # open() gives a seekable binary file, read_at() reads a byte range
+
+    def __init__(self, archive, ch):
+        self.archive = archive
+        self.ch = ch
+        self.info = archive.index["channels"][str(ch)]
+        self.name = self.info["name"]
+        self.size = self.info["size"]
+        self.dtype = self.info.get("dtype", "<i2")    # archives before byte-format support
+        self.sample_bytes = np.dtype(self.dtype).itemsize
+        self._header = None
+        self._tail = None
+
+    def __repr__(self):
+        return "%s[%s]" % (self.archive.path, self.name)
+
+    def header(self):
+        if self._header is None:
+            self._header = self.archive._chunk(self.info["header"])
+        return self._header
+
+    def read_at(self, offset, size):
+        offset = max(0, offset)
+        end = min(self.size, offset + max(0, size))
+        if end <= offset:
+            return b""
+        data_start = self.info["data_offset"]
+        data_end = data_start + self.sample_bytes * self.info["nsegments"] * self.info["points"]
+        parts = []
+        if offset < data_start:
+            parts.append(self.header()[offset:min(end, data_start)])
+        if end > data_start and offset < data_end:
+            lo, hi = max(offset, data_start) - data_start, min(end, data_end) - data_start
+            block_bytes = self.sample_bytes * self.info["points"] * self.archive.block_segments
+            for b in range(lo // block_bytes, (hi - 1) // block_bytes + 1):
+                block = self.archive.read_block(self.ch, b).tobytes()
+                base = b * block_bytes
+                parts.append(block[max(lo - base, 0):hi - base])
+        if end > data_end:
+            if self._tail is None:
+                self._tail = self.archive._chunk(self.info["tail"])
+            parts.append(self._tail[max(offset, data_end) - data_end:end - data_end])
+        return b"".join(parts)
+
+    def open(self):
+        return _MemberFile(self)
+
+
+class _MemberFile(io.RawIOBase):
+
+    def __init__(self, member):
+        self.member = member
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.member.size}[whence]
+        self.position = base + offset
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.member.size - self.position
+        data = self.member.read_at(self.position, size)
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+class TrcArchive:
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._file.seek(-len(MAGIC) - 8, io.SEEK_END)
+        index_offset = struct.unpack("<Q", self._file.read(8))[0]
+        if self._file.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a .trc archive" % path)
+        end = self._file.seek(-len(MAGIC) - 8, io.SEEK_END)
+        self._file.seek(index_offset)
+        self.index = json.loads(self._file.read(end - index_offset))
+        self.codec = self.index["codec"]
+        self.block_segments = self.index["block_segments"]
+        self.channels = sorted(int(ch) for ch in self.index["channels"])
+        self._cache = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _chunk(self, location):
+        start, length = location
+        self._file.seek(start)
+        return decompress(self._file.read(length), self.codec)
+
+    def member(self, ch):
+        return ArchiveMember(self, ch)
+
+    def read_block(self, ch, block):
+        # decoded (segments, points) samples of one block, a few blocks are cached
+        key = (ch, block)
+        if key not in self._cache:
+            info = self.index["channels"][str(ch)]
+            first = block * self.block_segments
+            nsegments = min(self.block_segments, info["nsegments"] - first)
+            data = self._chunk(info["blocks"][block])
+            if len(self._cache) >= CACHED_BLOCKS:
+                self._cache.pop(next(iter(self._cache)))
+            self._cache[key] = decode_block(data, nsegments, info["points"], info.get("dtype", "<i2"))
+        return self._cache[key]
+
+    def read_segments(self, ch, start, stop=None):
+        # raw ADC codes of segments [start, stop) of channel ch
+        stop = start + 1 if stop is None else stop
+        if ch not in self.channels:
+            raise ValueError("C%s is not in %s (channels %s)" % (ch, self.path, self.channels))
+        nsegments = self.index["channels"][str(ch)]["nsegments"]
+        if not 0 <= start < stop <= nsegments:
+            raise ValueError("Segments [%i, %i) of C%i out of range, %s holds [0, %i)"
+                             % (start, stop, ch, self.path, nsegments))
+        first_block, last_block = start // self.block_segments, (stop - 1) // self.block_segments
+        blocks = [self.read_block(ch, b) for b in range(first_block, last_block + 1)]
+        adc = np.concatenate(blocks) if len(blocks) > 1 else blocks[0]
+        offset = first_block * self.block_segments
+        return adc[start - offset:stop - offset]
+
+    def extract(self, ch, output_path):
+        # writes the original .trc file back and checks its SHA-256
+        member = self.member(ch)
+        content = member.read_at(0, member.size)
+        if hashlib.sha256(content).hexdigest() != member.info["sha256"]:
+            raise ValueError("Checksum mismatch restoring %s" % member.name)
+        with open(output_path, "wb") as f:
+            f.write(content)
+        return output_path
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Pack, inspect or restore raw .trc archives.')
+    parser.add_argument('action', choices=['pack', 'extract', 'info'])
+    parser.add_argument('--rawPath', type=str, default='.', help='folder with the .trc files (pack)')
+    parser.add_argument('--runNumber', type=int, default=None, help='run to pack')
+    parser.add_argument('--sequence', type=int, default=-1)
+    parser.add_argument('--archive', type=str, default=None, help='archive file (default: rawPath/Trace{run}.trca)')
+    parser.add_argument('--codec', type=str, default=None, choices=['zstd', 'zlib', 'lzma'])
+    parser.add_argument('--level', type=int, default=None)
+    parser.add_argument('--blockSegments', type=int, default=DEFAULT_BLOCK_SEGMENTS)
+    parser.add_argument('--delete', action='store_true', help='remove the .trc files after a verified pack')
+    parser.add_argument('--output', type=str, default='.', help='folder for extracted files')
+    args = parser.parse_args()
+
+    if args.runNumber is None and (args.action == 'pack' or args.archive is None):
+        parser.error("%s needs --runNumber%s" % (args.action, "" if args.action == 'pack' else " or --archive"))
+    trace = None
+    if args.runNumber is not None:
+        trace = "Trace%i" % args.runNumber if args.sequence < 0 else "Trace%i_%i" % (args.runNumber, args.sequence)
+    archive_path = args.archive or os.path.join(args.rawPath, trace + EXTENSION)
+
+    if args.action == 'pack':
+        files = trace_files(args.rawPath, trace)
+        if not files:
+            raise SystemExit("No C*--%s.trc files in %s" % (trace, args.rawPath))
+        raw, packed = pack_run(files, archive_path, args.blockSegments, args.codec, args.level)
+        print("Packed %i channels: %0.1f MB -> %0.1f MB (%0.2fx) in %s" % (
+            len(files), raw / 1e6, packed / 1e6, raw / max(packed, 1), archive_path))
+        if args.delete:
+            with TrcArchive(archive_path) as archive:
+                for ch in archive.channels:
+                    member = archive.member(ch)
+                    content = member.read_at(0, member.size)
+                    if hashlib.sha256(content).hexdigest() != member.info["sha256"]:
+                        raise SystemExit("Verification of %s failed, nothing deleted" % member.name)
+            for path in files.values():
+                os.remove(path)
+            print("Removed %i .trc files." % len(files))
+    elif args.action == 'extract':
+        os.makedirs(args.output, exist_ok=True)
+        with TrcArchive(archive_path) as archive:
+            for ch in archive.channels:
+                print(archive.extract(ch, os.path.join(args.output, archive.member(ch).name)))
+    else:
+        with TrcArchive(archive_path) as archive:
+            print("%s: codec %s, %i segments per block" % (archive_path, archive.codec, archive.block_segments))
+            for ch in archive.channels:
+                info = archive.index["channels"][str(ch)]
+                print("  CH%i %s: %i segments x %i points, %s samples, %i blocks" % (
+                    ch, info["name"], info["nsegments"], info["points"], info.get("dtype", "<i2"), len(info["blocks"])))
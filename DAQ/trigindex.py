@@ -0,0 +1,155 @@
+# trigindex.py
+# Per-run trigger index: the TRIGTIME block of every channel as contiguous arrays.
+#
+# Each .trc file of a sequence run carries, per segment, the trigger time
+# (seconds since the first trigger) and the horizontal offset of the first
+# sample. The index reads that block of all channels with one structured
+# array read per file, checks that the channels agree (same segment count,
+# same trigger times) and is saved as one small compressed .npz next to the
+# converted run. Events can then be selected by time window or by the gap to
+# the previous/next trigger with a binary search, without touching waveforms.
+#
+#   index = build_index(["C1--Trace12.trc", ..., "C7--Trace12.trc"])
+#   index.save("converted_run12_trigindex.npz")
+#   events = index.select_time(0.5, 1.0)                 # triggers in [0.5 s, 1.0 s)
+#   events = index.select_gap(max_gap=2e-6)             # pile-up candidates
+
+import struct
+
+import numpy as np
+
+
+TRIGTIME_DTYPE = np.dtype([("trigger_time", "<f8"), ("horizontal_offset", "<f8")])
+INDEX_VERSION = 1
+TIME_TOLERANCE = 1e-9   # s, trigger times of one segment seen by different channels
+
+
+def read_trigtime(filepath):
+    # (trigger_time, horizontal_offset) of all segments of one .trc file
+    import conversion
+    with conversion.open_trc(filepath) as f:
+        f.seek(conversion.aTRIGTIME_ARRAY)
+        trigtime_bytes = struct.unpack('i', f.read(4))[0]
+    offset, _ = conversion.get_waveform_block_offset(filepath)
+    nsegments = conversion.get_configuration(filepath)[0]
+    if trigtime_bytes != nsegments * TRIGTIME_DTYPE.itemsize:
+        raise ValueError("%s: TRIGTIME block of %i bytes does not match %i segments"
+                         % (filepath, trigtime_bytes, nsegments))
+    block = conversion.read_array(filepath, TRIGTIME_DTYPE, nsegments, offset)
+    return block["trigger_time"], block["horizontal_offset"]
+
+
+class TriggerIndex:
+
+    def __init__(self, trigger_time, horizontal_offset, channels, run=-1, sequence=-1):
+        # trigger_time: (nsegments,) of the reference (first) channel
+        # horizontal_offset: (nchan, nsegments)
+        self.trigger_time = np.ascontiguousarray(trigger_time, dtype=np.float64)
+        self.horizontal_offset = np.ascontiguousarray(horizontal_offset, dtype=np.float64)
+        self.channels = np.asarray(channels, dtype=np.int32)
+        self.run = run
+        self.sequence = sequence
+        gap = np.diff(self.trigger_time)
+        # gap to the previous trigger (inf for the first segment) and its sorted order
+        self.gap_before = np.concatenate([[np.inf], gap])
+        self.gap_after = np.concatenate([gap, [np.inf]])
+        self._gap_order = np.argsort(np.minimum(self.gap_before, self.gap_after), kind="stable")
+
+    def __len__(self):
+        return self.trigger_time.size
+
+    def time_offsets(self):
+        # (nsegments, nchan) horizontal offset of every channel relative to the
+        # reference channel, the timeoffsets branch of the converted run
+        return (self.horizontal_offset - self.horizontal_offset[0]).T
+
+    def select_time(self, t0=None, t1=None):
+        # segments with t0 <= trigger_time < t1, as a slice (trigger times increase)
+        i0 = 0 if t0 is None else int(np.searchsorted(self.trigger_time, t0, side="left"))
+        i1 = len(self) if t1 is None else int(np.searchsorted(self.trigger_time, t1, side="left"))
+        return slice(i0, max(i0, i1))
+
+    def select_gap(self, min_gap=0., max_gap=np.inf):
+        # segments whose nearest neighbouring trigger is min_gap <= gap < max_gap,
+        # in event order
+        nearest = np.minimum(self.gap_before, self.gap_after)[self._gap_order]
+        lo = int(np.searchsorted(nearest, min_gap, side="left"))
+        hi = int(np.searchsorted(nearest, max_gap, side="left"))
+        return np.sort(self._gap_order[lo:hi])
+
+    def rate(self):
+        # mean trigger rate of the sequence [Hz]
+        if len(self) < 2:
+            return np.nan
+        return (len(self) - 1) / (self.trigger_time[-1] - self.trigger_time[0])
+
+    def save(self, path):
+        np.savez_compressed(path, version=INDEX_VERSION, run=self.run, sequence=self.sequence,
+                            channels=self.channels, trigger_time=self.trigger_time,
+                            horizontal_offset=self.horizontal_offset)
+        return path
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data["trigger_time"], data["horizontal_offset"], data["channels"],
+                   int(data["run"]), int(data["sequence"]))
+
+
+def validate(trigger_times, channels, tolerance=TIME_TOLERANCE):
+    # list of problems found across the channels (empty when consistent)
+    problems = []
+    counts = [t.size for t in trigger_times]
+    if len(set(counts)) > 1:
+        problems.append("segment counts differ: " + ", ".join(
+            "CH%i=%i" % (c + 1, n) for c, n in zip(channels, counts)))
+        return problems
+    reference = trigger_times[0]
+    for c, t in zip(channels[1:], trigger_times[1:]):
+        bad = np.flatnonzero(np.abs(t - reference) > tolerance)
+        if bad.size:
+            problems.append("CH%i trigger times differ from CH%i in %i segments (first: %i)"
+                            % (c + 1, channels[0] + 1, bad.size, bad[0]))
+    if reference.size > 1 and (np.diff(reference) < 0).any():
+        problems.append("trigger times of CH%i are not increasing" % (channels[0] + 1))
+    return problems
+
+
+def build_index(files, channels=None, run=-1, sequence=-1, strict=False):
+    # files: one .trc per channel, the first one is the timing reference
+    channels = list(range(len(files))) if channels is None else list(channels)
+    blocks = [read_trigtime(f) for f in files]
+    trigger_times = [b[0] for b in blocks]
+    problems = validate(trigger_times, channels)
+    for problem in problems:
+        print("Trigger index: %s" % problem)
+    if problems and (strict or len(set(t.size for t in trigger_times)) > 1):
+        raise ValueError("Inconsistent trigger times: " + "; ".join(problems))
+    index = TriggerIndex(trigger_times[0], np.stack([b[1] for b in blocks]), channels, run, sequence)
+    index.problems = problems
+    return index
+
+
+if __name__ == "__main__":
+    import argparse
+    import conversion
+
+    parser = argparse.ArgumentParser(description='Build and query the trigger index of a run.')
+    parser.add_argument('--rawPath', type=str, default='.', help='folder with the .trc files')
+    parser.add_argument('--runNumber', type=int, required=True)
+    parser.add_argument('--sequence', type=int, default=-1)
+    parser.add_argument('--skipChannels', type=str, default='', help='comma separated scope channels to leave out')
+    parser.add_argument('--output', type=str, default=None, help='.npz file (default: next to the raw files)')
+    parser.add_argument('--maxGap', type=float, default=None, help='print segments closer than this to a neighbour [s]')
+    args = parser.parse_args()
+
+    trace = "Trace%i" % args.runNumber if args.sequence < 0 else "Trace%i_%i" % (args.runNumber, args.sequence)
+    found = conversion.find_channels(args.rawPath, trace, conversion.parse_channels(args.skipChannels))
+    index = build_index(list(found.values()), channels=[ch - 1 for ch in found],
+                        run=args.runNumber, sequence=args.sequence)
+    output = args.output or "%s/%s_trigindex.npz" % (args.rawPath, trace)
+    index.save(output)
+    print("%i segments, %i channels, mean rate %.1f Hz -> %s" % (len(index), len(index.channels), index.rate(), output))
+    if args.maxGap is not None:
+        close = index.select_gap(max_gap=args.maxGap)
+        print("%i segments within %g s of another trigger: %s" % (close.size, args.maxGap, close[:50]))
@@ -0,0 +1,152 @@
+# wavestore.py
+# Chunked, compressed (event, channel, sample) waveform store, written by
+# conversion.py next to the ROOT output (--arrayStore hdf5|zarr).
+#
+# Samples are kept as the raw int16 ADC codes, chunked per block of events and
+# per channel and compressed with blosc/zstd + byte shuffle, so a notebook can
+# slice a few events of one channel without decoding the rest of the run.
+# Gains/offsets, trigger times and horizontal offsets are stored alongside so
+# read() returns the same volts as the channel branch of converted_run{N}.root.
+#
+#     store = WaveStore("converted_run12.h5")
+#     v = store.read(events=slice(100, 110), channels=[2, 4])   # (10, 2, points)
+
+import os
+
+import numpy as np
+
+
+STORE_VERSION = 1
+DEFAULT_BLOCK_EVENTS = 100
+DEFAULT_CLEVEL = 5
+EXTENSIONS = {"hdf5": ".h5", "zarr": ".zarr"}
+
+
+def store_path(base_without_extension, backend):
+    return base_without_extension + EXTENSIONS[backend]
+
+
+def _hdf5_compression(clevel):
+    try:
+        import hdf5plugin
+    except ImportError:
+        print("hdf5plugin not installed, falling back to gzip compression.")
+        return {"compression": "gzip", "compression_opts": 4, "shuffle": True}
+    return dict(hdf5plugin.Blosc(cname="zstd", clevel=clevel, shuffle=hdf5plugin.Blosc.SHUFFLE))
+
+
+def _zarr_create(group, name, data, chunks, clevel):
+    import zarr
+    try:
+        from numcodecs import Blosc
+        compressor = Blosc(cname="zstd", clevel=clevel, shuffle=Blosc.SHUFFLE)
+        return group.create_dataset(name, data=data, chunks=chunks, compressor=compressor)
+    except TypeError:
+        # zarr 3 takes a codec list instead of a single compressor
+        codec = zarr.codecs.BloscCodec(cname="zstd", clevel=clevel, shuffle="shuffle")
+        array = group.create_array(name, shape=data.shape, dtype=data.dtype,
+                                   chunks=chunks, compressors=[codec])
+        array[...] = data
+        return array
+
+
+def write_run(path, adc, vertical_gains, vertical_offsets, horizontal_interval,
+              trigger_times, horizontal_offsets, attrs=None, backend="hdf5",
+              block_events=DEFAULT_BLOCK_EVENTS, clevel=DEFAULT_CLEVEL):
+    # adc: (events, channels, samples) int16
+    # trigger_times: (events,) of the first channel
+    # horizontal_offsets: (events, channels)
+    adc = np.ascontiguousarray(adc, dtype=np.int16)
+    nevents, nchan, npoints = adc.shape
+    chunks = (min(block_events, max(nevents, 1)), 1, npoints)
+    meta = {
+        "store_version": STORE_VERSION,
+        "n_events": nevents,
+        "n_channels": nchan,
+        "points_per_frame": npoints,
+        "horizontal_interval": float(horizontal_interval),
+        "block_events": chunks[0],
+    }
+    meta.update(attrs or {})
+    columns = {
+        "vertical_gain": np.asarray(vertical_gains, dtype=np.float64),
+        "vertical_offset": np.asarray(vertical_offsets, dtype=np.float64),
+        "trigger_time": np.asarray(trigger_times, dtype=np.float64),
+        "horizontal_offset": np.asarray(horizontal_offsets, dtype=np.float64).reshape(nevents, -1),
+    }
+
+    if backend == "hdf5":
+        import h5py
+        with h5py.File(path, "w") as f:
+            f.create_dataset("adc", data=adc, chunks=chunks, **_hdf5_compression(clevel))
+            for name, value in columns.items():
+                f.create_dataset(name, data=value)
+            f.attrs.update(meta)
+    elif backend == "zarr":
+        import zarr
+        group = zarr.open_group(path, mode="w")
+        _zarr_create(group, "adc", adc, chunks, clevel)
+        for name, value in columns.items():
+            group[name] = value
+        group.attrs.update(meta)
+    else:
+        raise ValueError("Unknown array store backend: %s" % backend)
+    return path
+
+
+class WaveStore:
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.isdir(path) or path.endswith(".zarr"):
+            import zarr
+            self._file = None
+            self._root = zarr.open_group(path, mode="r")
+        else:
+            import h5py
+            self._file = h5py.File(path, "r")
+            self._root = self._file
+        self.attrs = dict(self._root.attrs)
+        self.adc = self._root["adc"]
+        self.vertical_gain = np.asarray(self._root["vertical_gain"][:])
+        self.vertical_offset = np.asarray(self._root["vertical_offset"][:])
+        self.trigger_time = np.asarray(self._root["trigger_time"][:])
+        self.horizontal_offset = np.asarray(self._root["horizontal_offset"][:])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def shape(self):
+        return tuple(self.adc.shape)
+
+    def read_adc(self, events=slice(None), channels=None):
+        # only the chunks covering the requested events/channels are decoded
+        if isinstance(events, int):
+            events = slice(events, events + 1)
+        if channels is None:
+            return np.asarray(self.adc[events])
+        return np.stack([np.asarray(self.adc[events, int(c), :]) for c in channels], axis=1)
+
+    def read(self, events=slice(None), channels=None):
+        # volts, same values as the channel branch of the ROOT output
+        adc = self.read_adc(events, channels)
+        chan = np.arange(self.shape[1]) if channels is None else np.asarray(channels)
+        volts = (self.vertical_gain[chan][None, :, None] * adc
+                 - self.vertical_offset[chan][None, :, None])
+        return volts.astype(np.float32)
+
+    def time(self, event):
+        # sample times of one event, same as the time branch of the ROOT output:
+        # offsets of the first converted channel (reference_slot, 0 in older stores)
+        npoints = self.shape[2]
+        return (self.horizontal_offset[event, int(self.attrs.get("reference_slot", 0))]
+                + self.attrs["horizontal_interval"] * np.arange(npoints)).astype(np.float32)
@@ -1,20 +1,15 @@
-import ROOT
-import uproot as ur
+import os
+import sys
 import numpy as np
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "DAQ"))
+import runsummary
+
 
 BASE_PATH = "/home/arcadia/Documents/Motors_automation_test/DAQtest/280runs/280_runs_converted/"
 FIGURES_PATH = "/home/arcadia/Documents/Motors_automation_test/DAQtest/280runs/figures/"        # # folder to save the plots
 
-data_path_array = []
-
-# # adding the files to the array of paths
-# for file in os.listdir(BASE_PATH):
-#     if file.endswith(".root"):
-#         data_path_array.append(BASE_PATH + file)
-
-
 # first scan by X with constant Z
 # every 70 runs the Z coordinate changes by 250 um
 
@@ -34,11 +29,6 @@ elif initial_run_number == 141:
 elif initial_run_number == 211:
     Z_coordinate = 85750
 
-for i in range (initial_run_number, initial_run_number + 70):
-    data_path_array.append(BASE_PATH + f"converted_run{i}.root")
-
-# print(len(data_path_array))
-
 '''
 root file number -> Z coordinate
 1-71    ----------> 85000 um
@@ -71,49 +61,46 @@ step_x = 5
 
 mean_of_means_array = []
 
-current_index = 1
-for data_path in data_path_array:
-
-    data = ur.open(data_path)["pulse"]
-    out_data = data.arrays(["time", "channel"], library="np")
-
-    SignalMeanOfEvent = []
-
-    for iEvent in range(0, 1000):
-        first_index = np.where(out_data["channel"][iEvent, iChannel, :] > 0.1)[0][0]
-        last_index = np.where(out_data["channel"][iEvent, iChannel, :] > 0.1)[0][-1]
-        SignalMeanOfEvent.append(np.mean(out_data["channel"][iEvent, iChannel, first_index + 10 : last_index - 10]))
-
-    mean_value = sum(SignalMeanOfEvent) / len(SignalMeanOfEvent)
-    print(f"{current_index}\t: {mean_value:.7f} V.")
+if __name__ == "__main__":     # update_summary starts worker processes
+    # per-run plateau means come from the cached summary table, only new or
+    # changed runs are read again
+    run_numbers = range(initial_run_number, initial_run_number + 70)
+    summary = runsummary.update_summary(run_numbers, path=BASE_PATH + "RunSummary.parquet",
+                                        converted_path=BASE_PATH.rstrip("/"), jobs=4, use_pedestals=True)
+    # runs missing from the summary (not converted or failed) give NaN
+    plateau_means = {}
+    if len(summary):
+        plateau_means = summary[summary["channel"] == iChannel].set_index("run")["plateau_mean"].reindex(run_numbers)
 
-    mean_of_means_array.append(mean_value)
+    for current_index, run in enumerate(run_numbers, start=1):
+        mean_value = plateau_means.get(run, np.nan)
+        print(f"{current_index}\t: {mean_value:.7f} V.")
 
-    current_index += 1
+        mean_of_means_array.append(mean_value)
 
-    x_array.append(current_x)
-    current_x += step_x
+        x_array.append(current_x)
+        current_x += step_x
 
-# saving as csv
-combined_array = np.column_stack((x_array, mean_of_means_array))
-np.savetxt('arrays.csv', combined_array, delimiter=',', header='x_array,mean_of_means_array', comments='', fmt='%f')
+    # saving as csv
+    combined_array = np.column_stack((x_array, mean_of_means_array))
+    np.savetxt('arrays.csv', combined_array, delimiter=',', header='x_array,mean_of_means_array', comments='', fmt='%f')
 
-# plotting
-plt.plot(x_array, mean_of_means_array, color="blue")
-plt.title(f"Signal Mean vs X position (Scope Channel {iChannel + 1}). Z = {Z_coordinate} um")
-plt.xlabel("X coordinate [um]")
-plt.ylabel("Signal mean [V]")
-plt.grid(True)
+    # plotting
+    plt.plot(x_array, mean_of_means_array, color="blue")
+    plt.title(f"Signal Mean vs X position (Scope Channel {iChannel + 1}). Z = {Z_coordinate} um")
+    plt.xlabel("X coordinate [um]")
+    plt.ylabel("Signal mean [V]")
+    plt.grid(True)
 
 
-# # saving as an image
-plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.pdf')
-plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.eps')
-plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.svg')
-# plt.savefig(f'{FIGURES_PATH}Channel{iChannel}.jpg')
+    # # saving as an image
+    plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.pdf')
+    plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.eps')
+    plt.savefig(f'{FIGURES_PATH}Channel{iChannel}_Z{Z_coordinate}.svg')
+    # plt.savefig(f'{FIGURES_PATH}Channel{iChannel}.jpg')
 
 
 
 
-# # showing the plot
-plt.show()
\ No newline at end of file
+    # # showing the plot
+    plt.show()
@@ -0,0 +1,173 @@
+# eventdisplay.py
+# Event display helpers for long waveforms and many overlaid events.
+#
+# MinMaxPyramid keeps, per waveform, the min and max of every block of
+# 2, 4, 8, ... samples. view() returns only the samples needed to draw a time
+# window at a given width: the full-resolution samples when zoomed in, the
+# min/max envelope of the right level when zoomed out, so the drawn shape
+# (peaks included) is the same as plotting every sample.
+#
+# persistence() histograms thousands of events into one (time, voltage) image,
+# like the persistence mode of the scope, instead of drawing thousands of lines.
+#
+#     run = load_run("converted_run12.root")
+#     show_event(ax, run["time"][0, 0], run["channel"][0, 3])
+#     plot_persistence(ax, run["time"][:, 0], run["channel"][:, 3])
+
+import numpy as np
+
+
+DEFAULT_MAX_POINTS = 4000
+MIN_BLOCK_POINTS = 2
+
+
+def load_run(path, events=None):
+    # same arrays as the notebook: channel (events, nchan, points), time (events, 1, points)
+    import uproot as ur
+    entry_start, entry_stop = (None, None) if events is None else (events.start, events.stop)
+    with ur.open(path) as f:
+        return f["pulse"].arrays(["channel", "time"], entry_start=entry_start,
+                                 entry_stop=entry_stop, library="np")
+
+
+class MinMaxPyramid:
+
+    def __init__(self, t, y):
+        # t: sample times (increasing), y: samples of one waveform
+        self.t = np.asarray(t, dtype=np.float64)
+        y = np.asarray(y)
+        self.levels = [(y, y)]              # level k: blocks of 2**k samples
+        mins, maxs = y, y
+        while mins.size >= 2 * MIN_BLOCK_POINTS:
+            n = mins.size // 2 * 2
+            pair_min = mins[:n].reshape(-1, 2).min(axis=1)
+            pair_max = maxs[:n].reshape(-1, 2).max(axis=1)
+            if n < mins.size:
+                # odd tail: the last sample is its own block
+                pair_min = np.append(pair_min, mins[-1])
+                pair_max = np.append(pair_max, maxs[-1])
+            mins, maxs = pair_min, pair_max
+            self.levels.append((mins, maxs))
+
+    def __len__(self):
+        return self.t.size
+
+    def level_for(self, n_samples, max_points=DEFAULT_MAX_POINTS):
+        # coarsest level not needed while the window fits max_points;
+        # each block is drawn as two points (min and max)
+        level = 0
+        while level + 1 < len(self.levels) and n_samples / 2 ** level > max_points:
+            level += 1
+        return level
+
+    def view(self, t0=None, t1=None, max_points=DEFAULT_MAX_POINTS):
+        # (t, y) to draw the window [t0, t1] with at most ~max_points points
+        i0 = 0 if t0 is None else max(int(np.searchsorted(self.t, t0, side="left")) - 1, 0)
+        i1 = self.t.size if t1 is None else min(int(np.searchsorted(self.t, t1, side="right")) + 1, self.t.size)
+        level = self.level_for(i1 - i0, max_points)
+        if level == 0:
+            return self.t[i0:i1], self.levels[0][0][i0:i1]
+        block = 2 ** level
+        b0, b1 = i0 // block, -(-i1 // block)
+        mins, maxs = self.levels[level]
+        mins, maxs = mins[b0:b1], maxs[b0:b1]
+        # block k spans samples [k*block, (k+1)*block); draw min then max at
+        # the block's first and middle sample times
+        starts = np.minimum(np.arange(b0, b0 + mins.size) * block, self.t.size - 1)
+        middles = np.minimum(starts + block // 2, self.t.size - 1)
+        t = np.column_stack([self.t[starts], self.t[middles]]).ravel()
+        y = np.column_stack([mins, maxs]).ravel()
+        return t, y
+
+
+class DecimatedLine:
+    # matplotlib line that re-decimates itself when the x range changes
+
+    def __init__(self, ax, t, y, max_points=DEFAULT_MAX_POINTS, **kwargs):
+        self.ax = ax
+        self.pyramid = MinMaxPyramid(t, y)
+        self.max_points = max_points
+        (self.line,) = ax.plot(*self.pyramid.view(max_points=max_points), **kwargs)
+        ax.callbacks.connect("xlim_changed", self._update)
+
+    def _update(self, ax):
+        t0, t1 = ax.get_xlim()
+        self.line.set_data(*self.pyramid.view(t0, t1, self.max_points))
+        ax.figure.canvas.draw_idle()
+
+
+def show_event(ax, t, waveforms, labels=None, max_points=DEFAULT_MAX_POINTS):
+    # one or several (channels, points) waveforms of one event
+    waveforms = np.atleast_2d(waveforms)
+    lines = []
+    for i, y in enumerate(waveforms):
+        label = labels[i] if labels is not None else None
+        lines.append(DecimatedLine(ax, t, y, max_points, label=label))
+    ax.set_xlabel("Time [s]")
+    ax.set_ylabel("Voltage [V]")
+    return lines
+
+
+def _widen(low, high):
+    # a range with nonzero width around a constant (e.g. an all-zero channel)
+    if high > low:
+        return low, high
+    half = 0.5 * max(abs(low) * 1e-3, 1e-12)
+    return low - half, high + half
+
+
+def persistence(t, waveforms, time_bins=500, voltage_bins=256, time_range=None, voltage_range=None):
+    # 2D histogram of all samples of all events: counts[voltage_bin, time_bin]
+    # t: (points,) shared or (events, points) per-event sample times
+    waveforms = np.asarray(waveforms)
+    t = np.broadcast_to(np.asarray(t), waveforms.shape)
+    if time_range is None:
+        time_range = _widen(float(t.min()), float(t.max()))
+    if voltage_range is None:
+        voltage_range = _widen(float(waveforms.min()), float(waveforms.max()))
+    tb = ((t - time_range[0]) / (time_range[1] - time_range[0]) * time_bins).astype(np.int64)
+    vb = ((waveforms - voltage_range[0]) / (voltage_range[1] - voltage_range[0]) * voltage_bins).astype(np.int64)
+    # the upper edges belong to the last bin, like np.histogram2d
+    tb[tb == time_bins] = time_bins - 1
+    vb[vb == voltage_bins] = voltage_bins - 1
+    inside = (tb >= 0) & (tb < time_bins) & (vb >= 0) & (vb < voltage_bins)
+    counts = np.bincount(vb[inside] * time_bins + tb[inside], minlength=voltage_bins * time_bins)
+    return counts.reshape(voltage_bins, time_bins), time_range, voltage_range
+
+
+def plot_persistence(ax, t, waveforms, time_bins=500, voltage_bins=256, time_range=None,
+                     voltage_range=None, cmap="inferno", log=True):
+    from matplotlib.colors import LogNorm
+    counts, time_range, voltage_range = persistence(t, waveforms, time_bins, voltage_bins,
+                                                    time_range, voltage_range)
+    image = ax.imshow(np.ma.masked_equal(counts, 0), origin="lower", aspect="auto", cmap=cmap,
+                      extent=(time_range[0], time_range[1], voltage_range[0], voltage_range[1]),
+                      norm=LogNorm() if log else None, interpolation="nearest")
+    ax.figure.colorbar(image, ax=ax, label="Samples")
+    ax.set_xlabel("Time [s]")
+    ax.set_ylabel("Voltage [V]")
+    return image
+
+
+if __name__ == "__main__":
+    import argparse
+    import matplotlib.pyplot as plt
+
+    parser = argparse.ArgumentParser(description='Event display of a converted run.')
+    parser.add_argument('file', type=str, help='converted_run{N}.root')
+    parser.add_argument('--channel', type=int, default=0, help='channel index (0 = CH1)')
+    parser.add_argument('--event', type=int, default=0)
+    parser.add_argument('--persistence', action='store_true', help='overlay all events as a persistence image')
+    parser.add_argument('--maxEvents', type=int, default=None, help='events read for the persistence image')
+    args = parser.parse_args()
+
+    fig, ax = plt.subplots(figsize=(10, 6))
+    if args.persistence:
+        run = load_run(args.file, None if args.maxEvents is None else slice(0, args.maxEvents))
+        plot_persistence(ax, run["time"][:, 0], run["channel"][:, args.channel])
+        ax.set_title("Scope Channel %i, %i events" % (args.channel + 1, len(run["channel"])))
+    else:
+        run = load_run(args.file, slice(args.event, args.event + 1))
+        show_event(ax, run["time"][0, 0], run["channel"][0, args.channel])
+        ax.set_title("Scope Channel %i, event %i" % (args.channel + 1, args.event))
+    plt.show()
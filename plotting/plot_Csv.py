@@ -1,45 +1,131 @@
 
 
 import pandas as pd
+import numpy as np
 import matplotlib.pyplot as plt
 import os
 import glob
-from scipy.interpolate import interp1d
+import argparse
 
 folder = r"C:/Users/zohra/Downloads/csv_files/download"
-
-mean_files = sorted(glob.glob(os.path.join(folder, "mean_arrays_Z_*um.csv")))
-
-plt.figure(figsize=(10,6))
-
-first_mean_df = pd.read_csv(mean_files[0])
-first_mean_df.columns = first_mean_df.columns.str.strip()
-common_x = first_mean_df['X[um]']
-
-for mean_csv in mean_files:
-    z_label = os.path.basename(mean_csv).split("_Z_")[1].replace("um.csv", " µm")
-
-    mean_df = pd.read_csv(mean_csv)
-    mean_df.columns = mean_df.columns.str.strip()
-
-    f = interp1d(mean_df['X[um]'], mean_df['CH3'], kind='linear', fill_value="extrapolate")
-    y = f(common_x)
-
-
-    plt.scatter(common_x, y, s=25, alpha=0.7, edgecolors='none', label=f"CH3 at Z = {z_label}")
-
-
-plt.xlabel("X [µm]", fontsize=12)
-plt.ylabel(" [mV]", fontsize=12)
-plt.title("CH3  vs X at Different Heights", fontsize=14)
-
-plt.legend(title="Heights", loc='upper right', fontsize=9, title_fontsize=10, frameon=True)
-
-plt.grid(True, linestyle="--", alpha=0.7)
-
-
-output_file = os.path.join(folder, "CH3_vs_x_different_heights.png")
-plt.savefig(output_file, dpi=300)
-
-plt.show()
-
+X_COLUMN = 'X[um]'
+
+
+def z_of_file(path):
+    return float(os.path.basename(path).split("_Z_")[1].replace("um.csv", ""))
+
+
+def load_heights(files, column='CH3', x_column=X_COLUMN):
+    # reads every height once; returns z (nz,) and lists of x / y rows
+    # sorted by height (rows may have different lengths)
+    files = sorted(files, key=z_of_file)
+    z, xs, ys = [], [], []
+    for path in files:
+        df = pd.read_csv(path, skipinitialspace=True)
+        df.columns = df.columns.str.strip()
+        df = df.sort_values(x_column)
+        z.append(z_of_file(path))
+        xs.append(df[x_column].to_numpy(dtype=float))
+        ys.append(df[column].to_numpy(dtype=float))
+    return np.asarray(z), xs, ys
+
+
+def resample(xs, ys, common_x):
+    # linear interpolation (with linear extrapolation, like
+    # interp1d(fill_value="extrapolate")) of all heights onto common_x at once:
+    # rows are shifted apart on one axis so a single searchsorted finds every
+    # interval; returns (nz, len(common_x))
+    common_x = np.asarray(common_x, dtype=float)
+    if all(len(x) == len(common_x) and np.array_equal(x, common_x) for x in xs):
+        return np.vstack(ys)
+    lengths = np.array([len(x) for x in xs])
+    if (lengths < 2).any():
+        raise ValueError("every height needs at least two X points")
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    flat_x = np.concatenate(xs)
+    flat_y = np.concatenate(ys)
+    lo = min(flat_x.min(), common_x.min())
+    span = max(flat_x.max(), common_x.max()) - lo + 1.
+    row = np.repeat(np.arange(len(xs)), lengths)
+    shifted = flat_x - lo + row * span
+
+    query = (common_x[None, :] - lo) + np.arange(len(xs))[:, None] * span
+    idx = np.searchsorted(shifted, query)
+    # keep the interval inside its own row, edge intervals extrapolate
+    first = starts[:, None] + 1
+    last = (starts + lengths - 1)[:, None]
+    idx = np.clip(idx, first, last)
+    x0, x1 = flat_x[idx - 1], flat_x[idx]
+    y0, y1 = flat_y[idx - 1], flat_y[idx]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slope = np.where(x1 != x0, (y1 - y0) / (x1 - x0), 0.)
+    return y0 + slope * (common_x[None, :] - x0)
+
+
+def load_grid(files, column='CH3', common_x=None, x_column=X_COLUMN):
+    # (z, common_x, values[z, x]); the X grid of the lowest height by default
+    z, xs, ys = load_heights(files, column, x_column)
+    if common_x is None:
+        common_x = xs[0]
+    return z, np.asarray(common_x, dtype=float), resample(xs, ys, common_x)
+
+
+def plot_overlay(ax, z, x, values, label='CH3', cmap='viridis'):
+    # every height as one curve, drawn as a single LineCollection
+    from matplotlib.collections import LineCollection
+    segments = np.stack([np.broadcast_to(x, values.shape), values], axis=2)
+    lines = LineCollection(segments, cmap=cmap, linewidths=1.2)
+    lines.set_array(z)
+    ax.add_collection(lines)
+    ax.set_xlim(np.nanmin(x), np.nanmax(x))
+    ax.set_ylim(np.nanmin(values), np.nanmax(values))
+    ax.figure.colorbar(lines, ax=ax, label="Z [µm]")
+    ax.set_title(f"{label}  vs X at Different Heights", fontsize=14)
+    ax.set_ylabel(" [mV]", fontsize=12)
+    return lines
+
+
+def plot_scatter(ax, z, x, values, label='CH3', cmap='viridis'):
+    # the original scatter view, one scatter call for all heights
+    points = ax.scatter(np.broadcast_to(x, values.shape).ravel(), values.ravel(),
+                        c=np.repeat(z, values.shape[1]), s=25, alpha=0.7, edgecolors='none', cmap=cmap)
+    ax.figure.colorbar(points, ax=ax, label="Z [µm]")
+    ax.set_title(f"{label}  vs X at Different Heights", fontsize=14)
+    ax.set_ylabel(" [mV]", fontsize=12)
+    return points
+
+
+def plot_heatmap(ax, z, x, values, label='CH3', cmap='viridis'):
+    # Z-X map, one pcolormesh
+    mesh = ax.pcolormesh(x, z, values, shading='nearest', cmap=cmap)
+    ax.figure.colorbar(mesh, ax=ax, label=f"{label} [mV]")
+    ax.set_title(f"{label} vs X and Z", fontsize=14)
+    ax.set_ylabel("Z [µm]", fontsize=12)
+    return mesh
+
+
+STYLES = {"overlay": plot_overlay, "scatter": plot_scatter, "heatmap": plot_heatmap}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Plot one channel of all mean_arrays_Z_*um.csv files.')
+    parser.add_argument('--folder', type=str, default=folder)
+    parser.add_argument('--channel', type=str, default='CH3', help='column to plot')
+    parser.add_argument('--style', type=str, default='scatter', choices=list(STYLES))
+    parser.add_argument('--noShow', action='store_true')
+    args = parser.parse_args()
+
+    mean_files = glob.glob(os.path.join(args.folder, "mean_arrays_Z_*um.csv"))
+    z, common_x, values = load_grid(mean_files, args.channel)
+
+    fig, ax = plt.subplots(figsize=(10,6))
+    STYLES[args.style](ax, z, common_x, values, label=args.channel)
+
+    ax.set_xlabel("X [µm]", fontsize=12)
+    ax.grid(True, linestyle="--", alpha=0.7)
+
+    output_file = os.path.join(args.folder, f"{args.channel}_vs_x_different_heights_{args.style}.png")
+    fig.savefig(output_file, dpi=300)
+
+    if not args.noShow:
+        plt.show()